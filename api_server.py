@@ -0,0 +1,243 @@
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import BytesParser
+from email.policy import default as email_policy
+from http.server import BaseHTTPRequestHandler, HTTPServer
+# Tắt log rác của TensorFlow (phải đặt trước khi import tensorflow)
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+
+from config.inference import INFERENCE_BACKEND
+
+
+STORAGE_OPTIONS = ("none", "mysql", "firestore", "both")
+
+
+MAX_BODY_BYTES = int(os.getenv('API_MAX_BODY_MB', 50)) * 1024 * 1024
+
+# Service của process hiện tại (mỗi process một model)
+service = None
+
+
+def parse_images(content_type, body):
+    """
+    Đọc ảnh từ request, hỗ trợ:
+    - multipart/form-data: một hoặc nhiều field file (curl -F image=@leaf.jpg)
+    - application/json: {"images": [{"filename": "...", "data": "<base64>"}]}
+    - image/*: body là bytes của một ảnh
+    Returns: list (filename, bytes)
+    """
+    content_type = content_type or ""
+
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser(policy=email_policy).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body
+        )
+        files = []
+        for part in message.iter_parts():
+            filename = part.get_filename()
+            if filename:
+                files.append((filename, part.get_payload(decode=True)))
+        return files
+
+    if content_type.startswith("application/json"):
+        payload = json.loads(body.decode("utf-8"))
+        images = payload.get("images", []) if isinstance(payload, dict) else None
+        if not isinstance(images, list) or not all(isinstance(item, dict) for item in images):
+            raise ValueError('JSON phải có dạng {"images": [{"filename": "...", "data": "<base64>"}]}')
+        return [
+            (item.get("filename", f"image_{i}.jpg"), base64.b64decode(item["data"]))
+            for i, item in enumerate(images)
+        ]
+
+    if content_type.startswith("image/"):
+        return [("upload." + content_type.split("/", 1)[1].split(";")[0], body)]
+
+    raise ValueError(f"Content-Type không được hỗ trợ: {content_type}")
+
+
+def verify_user(authorization):
+    #Xác thực Firebase ID token trong header "Authorization: Bearer <token>", trả về uid (None nếu không hợp lệ)
+    if not authorization or not authorization.startswith("Bearer "):
+        return None
+    from config.firebase_config import get_firebase_auth
+    try:
+        return get_firebase_auth().verify_id_token(authorization[len("Bearer "):].strip())['uid']
+    except Exception as e:
+        print(f"ID token không hợp lệ: {e}")
+        return None
+
+
+class DiagnosisRequestHandler(BaseHTTPRequestHandler):
+    server_version = "LeafGuardAPI/1.0"
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            # 503 cho tới khi model load + warm-up xong (load balancer chưa gửi traffic vào)
+            ready = service is not None and service.is_ready()
+            self._send_json(200 if ready else 503, {
+                'status': 'ok' if ready else 'starting',
+                'ready': ready,
+                'pid': os.getpid()
+            })
+        elif self.path == "/metrics":
+            from src.metrics import render_prometheus
+            data = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if self.path.split("?", 1)[0] != "/diagnose":
+            self._send_json(404, {'error': 'Not found'})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            self._send_json(400, {'error': 'Content-Length không hợp lệ'})
+            return
+        if length <= 0:
+            self._send_json(400, {'error': 'Body rỗng'})
+            return
+        if length > MAX_BODY_BYTES:
+            self._send_json(413, {'error': 'Body quá lớn'})
+            return
+
+        start = time.perf_counter()
+        try:
+            files = parse_images(self.headers.get("Content-Type"), self.rfile.read(length))
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        if not files:
+            self._send_json(400, {'error': 'Không có ảnh nào trong request'})
+            return
+
+        # Chỉ lưu lịch sử cho user đã xác thực bằng Firebase ID token (khi server bật --storage);
+        # X-User-Id không kèm token bị từ chối thay vì tin theo header
+        user_id = None
+        if service.storage != "none" and (self.headers.get("Authorization") or self.headers.get("X-User-Id")):
+            user_id = verify_user(self.headers.get("Authorization"))
+            if user_id is None:
+                self._send_json(401, {'error': 'Cần Firebase ID token hợp lệ (Authorization: Bearer <token>) để lưu lịch sử'})
+                return
+
+        try:
+            results = service.diagnose_many(files, user_id=user_id)
+        except Exception as e:
+            # Model chưa load xong / load lỗi: vẫn trả lời client thay vì đóng kết nối
+            self._send_json(503, {'error': str(e)})
+            return
+
+        self._send_json(200, {
+            'results': results,
+            'elapsed_ms': (time.perf_counter() - start) * 1000
+        })
+
+    def log_message(self, format, *args):
+        # Log ngắn gọn kèm pid để phân biệt các process
+        sys.stderr.write(f"[{os.getpid()}] {self.address_string()} - {format % args}\n")
+
+
+class PooledHTTPServer(HTTPServer):
+    #HTTPServer xử lý request bằng thread pool có giới hạn (thay vì mỗi request một thread mới)
+
+    def __init__(self, server_address, handler_class, threads):
+        super().__init__(server_address, handler_class)
+        self.threads = threads
+        self.executor = None
+
+    def start_pool(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="api-worker")
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def serve(server, backend, storage, multi_process=False):
+    #Chạy trong mỗi process: load model một lần rồi phục vụ request
+    global service
+    # Import tại đây để TensorFlow chỉ khởi tạo trong process con (sau khi fork)
+    from src.diagnosis_service import DiagnosisService
+    from src.metrics import start_exporters
+    from config.metrics import METRICS_FILE
+
+    # Metrics của API được xuất qua GET /metrics; file metrics tách theo pid khi chạy nhiều process
+    metrics_file = f"{METRICS_FILE}.{os.getpid()}" if METRICS_FILE and multi_process else METRICS_FILE
+    start_exporters(metrics_file=metrics_file, port=None)
+    service = DiagnosisService(backend=backend, storage=storage)
+    server.start_pool()
+    print(f"[{os.getpid()}] Đang load model, /health trả 503 tới khi sẵn sàng")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP API chẩn đoán bệnh lá cây (POST /diagnose)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--processes", type=int, default=1, help="Số process (mỗi process một model)")
+    parser.add_argument("--threads", type=int, default=8, help="Số worker thread mỗi process")
+    parser.add_argument("--backend", choices=["keras", "tflite"], default=INFERENCE_BACKEND)
+    parser.add_argument("--storage", choices=STORAGE_OPTIONS, default="none",
+                        help="Lưu kết quả vào đâu ('none' để load test không cần database)")
+    args = parser.parse_args(argv)
+
+    # Socket được tạo trước khi fork để các process dùng chung cổng
+    server = PooledHTTPServer((args.host, args.port), DiagnosisRequestHandler, args.threads)
+    print(f"LeafGuard API lắng nghe tại http://{args.host}:{args.port} "
+          f"({args.processes} process x {args.threads} thread, storage={args.storage})")
+
+    if args.processes <= 1 or not hasattr(os, "fork"):
+        if args.processes > 1:
+            print("⚠️  Hệ điều hành không hỗ trợ fork, chỉ chạy 1 process")
+        serve(server, args.backend, args.storage)
+        return 0
+
+    # Fork trước khi load model: mỗi process con có TensorFlow runtime riêng
+    children = []
+    for _ in range(args.processes):
+        pid = os.fork()
+        if pid == 0:
+            serve(server, args.backend, args.storage, multi_process=True)
+            os._exit(0)
+        children.append(pid)
+
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
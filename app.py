@@ -1,9 +1,8 @@
 import streamlit as st
-import tensorflow as tf
-from PIL import Image, ImageOps
 import numpy as np
 import os
 import json
+import threading
 from src.camera_input import get_image_input
 
 
@@ -20,6 +19,29 @@ from src.ui_components import (
 from src.diagnosis_handler import handle_diagnosis
 from src.utils import get_plant_type_from_label
 from src.camera_input import get_image_input
+from src.inference_engine import InferenceEngine
+from src.predictor import load_predictor, warmup_batch_sizes, BackgroundPredictor
+from src.preprocessing import preprocess_image
+from src.prediction_cache import PredictionCache, model_identity
+from src.tta import needs_tta, apply_tta
+from src.metrics import span, start_exporters
+from src.write_behind import WriteBehindQueue, build_diagnosis_sinks
+from database.outbox_relay import start_outbox_relay
+from config.persistence import WRITE_BEHIND_ENABLED, OUTBOX_ENABLED, OUTBOX_RELAY_IN_PROCESS
+from config.inference import (
+    MODEL_PATH,
+    CLASS_INDICES_PATH,
+    INFERENCE_BACKEND,
+    TFLITE_MODEL_PATH,
+    INFERENCE_MAX_BATCH_SIZE,
+    INFERENCE_MAX_WAIT_MS,
+    INFERENCE_TIMEOUT_SECONDS,
+    INFERENCE_WARMUP,
+    PREPROCESS_RESAMPLE,
+    TTA_ENABLED,
+    PREDICTION_CACHE_MAX_ENTRIES,
+    PREDICTION_CACHE_TTL_SECONDS
+)
 
 st.set_page_config(
     page_title="AI Chẩn Đoán Bệnh Cây Trồng",
@@ -32,25 +54,114 @@ st.set_page_config(
 inject_theme_css()
 inject_falling_leaves()
 
+# Exporter Prometheus (file / endpoint /metrics), chỉ khởi động một lần mỗi process
+start_exporters()
+
 auth_manager = AuthManager()
 auth_manager.init_session_state()
 firestore = FirestoreManager()
 
+def get_warmup_sizes():
+    # Chỉ warm-up 1, các lũy thừa của 2 và max; engine đệm batch gộp được lên size đã warm-up gần nhất
+    return warmup_batch_sizes(INFERENCE_MAX_BATCH_SIZE) if INFERENCE_WARMUP else None
+
+
+def current_model_id():
+    # Định danh model đang dùng; file model đổi (train lại) thì key cache và model trong bộ nhớ cũng đổi
+    model_path = TFLITE_MODEL_PATH if INFERENCE_BACKEND == "tflite" else MODEL_PATH
+    return f"{INFERENCE_BACKEND}|{PREPROCESS_RESAMPLE}|tta={TTA_ENABLED}|{model_identity(model_path)}"
+
+
+@st.cache_resource(max_entries=1)
+def load_model(model_id, backend=INFERENCE_BACKEND):
+    # model_id chỉ làm key cache: file model đổi thì load lại thay vì dùng model cũ trong bộ nhớ
+    # backend='keras' dùng file .h5, backend='tflite' dùng model INT8 đã export
+    # Trả về predictor: callable(batch) đã trace sẵn, không đi qua model.predict()
+    # Load + warm-up chạy trong thread nền: trang hiện ngay, nút chẩn đoán mở khi model sẵn sàng
+    return BackgroundPredictor(
+        lambda: load_predictor(backend, MODEL_PATH, TFLITE_MODEL_PATH, warmup_sizes=get_warmup_sizes())
+    )
+
+
+@st.cache_resource
+def get_engine_slot():
+    # Engine đang phục vụ, để đóng engine của model cũ khi model đổi
+    return {}
+
+
+@st.cache_resource(max_entries=1)
+def get_inference_engine(model_id):
+    # Engine dùng chung cho mọi session: gom request đồng thời thành một batch
+    engine = InferenceEngine(
+        predict_fn=load_model(model_id),
+        max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+        max_wait_ms=INFERENCE_MAX_WAIT_MS,
+        batch_sizes=get_warmup_sizes(),
+        timeout=INFERENCE_TIMEOUT_SECONDS
+    )
+    slot = get_engine_slot()
+    old_engine, slot['engine'] = slot.get('engine'), engine
+    if old_engine is not None:
+        # Session khác có thể vẫn đang dùng engine cũ trong lần chạy hiện tại: đóng sau một phút
+        # (daemon: timer đang chờ không giữ process lại khi tắt server)
+        close_timer = threading.Timer(60.0, old_engine.close)
+        close_timer.daemon = True
+        close_timer.start()
+    return engine
+
+
+# Tính một lần mỗi lần chạy script: model, engine và key cache dự đoán dùng cùng một định danh
+MODEL_ID = current_model_id()
+model = load_model(MODEL_ID)
+engine = get_inference_engine(MODEL_ID)
+
+if model.error is not None:
+    if isinstance(model.error, FileNotFoundError):
+        if INFERENCE_BACKEND == "tflite":
+            st.error("Không tìm thấy file model TFLite! Hãy chạy export_tflite.py trước.")
+        else:
+            st.error("Không tìm thấy file model!")
+    else:
+        st.error(f"Lỗi load model: {model.error}")
+
+
+@st.cache_resource
+def get_prediction_cache():
+    # Cache dùng chung mọi session: cùng ảnh upload lại sẽ không chạy model lần nữa
+    return PredictionCache(
+        max_entries=PREDICTION_CACHE_MAX_ENTRIES,
+        ttl_seconds=PREDICTION_CACHE_TTL_SECONDS
+    )
+
+
+prediction_cache = get_prediction_cache()
+
+
+@st.cache_resource
+def get_persistence_queue():
+    # Một worker nền cho cả process; job còn dang dở trong spool được xử lý lại khi khởi động
+    if not WRITE_BEHIND_ENABLED:
+        return None
+    return WriteBehindQueue(sinks=build_diagnosis_sinks(FirestoreManager()))
+
+
+persistence_queue = get_persistence_queue()
+
+
 @st.cache_resource
-def load_model():
-    model_path = "models/MobileNetV2_best.h5"
-    if not os.path.exists(model_path):
-        st.error("Không tìm thấy file model!")
+def get_outbox_relay():
+    # Relay outbox MySQL -> Firestore chạy nền trong process web app (hoặc chạy riêng database/outbox_relay.py)
+    if not (OUTBOX_ENABLED and OUTBOX_RELAY_IN_PROCESS):
         return None
-    return tf.keras.models.load_model(model_path)
+    return start_outbox_relay(FirestoreManager())
 
 
-model = load_model()
+get_outbox_relay()
 
 
 @st.cache_data
 def load_class_names():
-    class_path = "models/class_indices.json"
+    class_path = CLASS_INDICES_PATH
     if not os.path.exists(class_path):
         st.error("Không tìm thấy file class_indices.json!")
         return None
@@ -62,14 +173,40 @@ def load_class_names():
 CLASS_NAMES = load_class_names()
 
 
-def predict_image(image, model):
-    size = (224, 224)
-    image = ImageOps.fit(image, size, Image.Resampling.LANCZOS)
-    img = np.asarray(image)
-    img = tf.keras.applications.mobilenet_v2.preprocess_input(img)
-    img = img[np.newaxis, ...]
-    preds = model.predict(img, verbose=0)
-    return preds[0]
+def predict_image(image, engine, image_bytes=None):
+    # Trả về None (đã hiện lỗi) nếu engine chưa có hoặc dự đoán lỗi (hết thời gian chờ, model load lỗi, engine đã đóng)
+    if engine is None:
+        st.error("AI chưa thể phân tích ảnh lúc này, vui lòng thử lại.")
+        return None
+
+    # Ảnh đã từng chấm điểm (upload lại / rerun) thì lấy thẳng từ cache
+    cache_key = None
+    if image_bytes:
+        with span("cache_lookup"):
+            cache_key = PredictionCache.make_key(image_bytes, MODEL_ID)
+            cached = prediction_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    # Crop + resize + preprocess_input gộp một bước vào buffer float32 dùng lại
+    with span("preprocess"):
+        img = preprocess_image(image)
+    try:
+        # Engine tự gộp ảnh này với request của các session khác
+        with span("inference"):
+            preds = engine.predict(img)
+
+        # Dự đoán chưa đủ tin cậy: chạy thêm các view lật/crop trong một batch rồi lấy trung bình
+        if TTA_ENABLED and needs_tta(preds):
+            with span("tta"):
+                preds = apply_tta(img, preds, engine.predict_batch)
+    except (TimeoutError, RuntimeError) as e:
+        st.error(f"AI chưa thể phân tích ảnh lúc này, vui lòng thử lại. ({e})")
+        return None
+
+    if cache_key:
+        prediction_cache.put(cache_key, preds)
+    return preds
 
 
 col1, col2 = st.columns([1, 1.4], gap="large")
@@ -86,9 +223,15 @@ with col1:
         st.image(image, caption="Ảnh đã tải lên", use_container_width=True)
        
         st.markdown("<br>", unsafe_allow_html=True)
-        if st.button("CHẨN ĐOÁN", type="primary", use_container_width=True):
+        model_ready = model.is_ready()
+        if not model_ready and model.error is None:
+            st.caption("Model AI đang được tải, nút chẩn đoán sẽ mở khi sẵn sàng.")
+        if st.button("CHẨN ĐOÁN", type="primary", use_container_width=True, disabled=not model_ready):
             with st.spinner("AI đang phân tích ảnh..."):
-                preds = predict_image(image, model)
+                image_bytes = file.getvalue() if file is not None and hasattr(file, 'getvalue') else None
+                preds = predict_image(image, engine, image_bytes=image_bytes)
+            if preds is None:
+                st.stop()
            
             # Create a file-like object for handle_diagnosis if from camera
             if file is None or not hasattr(file, 'name'):
@@ -116,7 +259,8 @@ with col1:
                 class_names=CLASS_NAMES,
                 auth_manager=auth_manager,
                 firestore=firestore,
-                silent=True  # Don't display messages here, will display in col2
+                silent=True,  # Don't display messages here, will display in col2
+                persistence_queue=persistence_queue
             )
            
             # Store result in session state for display in col2
@@ -188,3 +332,9 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+
+# Model còn đang load ở thread nền: chạy lại trang mỗi giây để nút chẩn đoán tự mở khi xong
+if not model.is_loaded():
+    model.wait(1.0)
+    st.rerun()
+
@@ -0,0 +1,289 @@
+import os
+import sys
+import time
+import argparse
+import threading
+import io
+import numpy as np
+from PIL import Image, ImageOps
+# Tắt log rác của TensorFlow (phải đặt trước khi import tensorflow)
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+import tensorflow as tf
+
+
+from config.inference import MODEL_PATH
+from src.inference_engine import InferenceEngine
+from src.predictor import KerasPredictor
+from src.model_exporter import measure_latency
+from src.preprocessing import decode_image, preprocess_image, RESAMPLE_FILTERS
+from src.data_loader import list_labeled_images
+from src.tta import needs_tta, apply_tta, build_tta_views
+
+
+def load_benchmark_model(model_path=MODEL_PATH):
+    # Ưu tiên model đã train; nếu chưa có thì dùng MobileNetV2 random weights (tốc độ như nhau)
+    if os.path.exists(model_path):
+        print(f"Đang load model từ: {model_path}")
+        return tf.keras.models.load_model(model_path)
+    print(f"⚠️  Không tìm thấy {model_path}, dùng MobileNetV2 random weights để đo tốc độ")
+    return tf.keras.applications.MobileNetV2(weights=None, input_shape=(224, 224, 3), classes=15)
+
+
+def random_inputs(n):
+    # Ảnh giả đã preprocess về [-1, 1]
+    return np.random.uniform(-1.0, 1.0, size=(n, 224, 224, 3)).astype(np.float32)
+
+
+def _run_callers(predict_one, concurrency, requests_per_caller):
+    # Chạy `concurrency` thread, mỗi thread gửi tuần tự `requests_per_caller` ảnh
+    image = random_inputs(1)[0]
+    barrier = threading.Barrier(concurrency + 1)
+    errors = []
+
+    def caller():
+        barrier.wait()
+        try:
+            for _ in range(requests_per_caller):
+                predict_one(image)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=caller) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    if errors:
+        raise errors[0]
+    return concurrency * requests_per_caller / elapsed
+
+
+def bench_batching(args):
+    predictor = KerasPredictor(load_benchmark_model(args.model))
+
+    def direct_predict(image):
+        return predictor(image[np.newaxis, ...])[0]
+
+    engine = InferenceEngine(
+        predict_fn=predictor,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms
+    )
+
+    # Warm-up để không tính thời gian trace graph lần đầu
+    direct_predict(random_inputs(1)[0])
+    engine.predict(random_inputs(1)[0])
+
+    print("\n" + "=" * 60)
+    print(f"MICRO-BATCHING (max_batch_size={args.max_batch_size}, max_wait_ms={args.max_wait_ms})")
+    print("=" * 60)
+    print(f"{'Callers':>8} | {'Direct (img/s)':>15} | {'Engine (img/s)':>15} | {'Speedup':>8}")
+    print("-" * 60)
+
+    for concurrency in args.concurrency:
+        engine.total_batches = engine.total_images = 0
+        direct = _run_callers(direct_predict, concurrency, args.requests)
+        batched = _run_callers(engine.predict, concurrency, args.requests)
+        avg_batch = engine.total_images / max(engine.total_batches, 1)
+        print(f"{concurrency:>8} | {direct:>15.1f} | {batched:>15.1f} | {batched / direct:>7.2f}x"
+              f"  (batch TB: {avg_batch:.1f})")
+
+    engine.close()
+
+
+def bench_latency(args):
+    model = load_benchmark_model(args.model)
+    predictor = KerasPredictor(model)
+
+    variants = [
+        ("model.predict()", lambda x: model.predict(x, verbose=0)),
+        ("KerasPredictor (tf.function)", predictor),
+    ]
+
+    print("\n" + "=" * 60)
+    print(f"LATENCY BATCH-1 ({args.runs} lần gọi)")
+    print("=" * 60)
+    results = {}
+    for name, fn in variants:
+        results[name] = measure_latency(fn, runs=args.runs)
+        r = results[name]
+        print(f"{name:30s} p50={r['p50_ms']:7.2f}ms  p95={r['p95_ms']:7.2f}ms  TB={r['mean_ms']:7.2f}ms")
+
+    before = results["model.predict()"]["p50_ms"]
+    after = results["KerasPredictor (tf.function)"]["p50_ms"]
+    print(f"\nNhanh hơn {before / after:.2f}x (p50)")
+
+
+def legacy_preprocess(file):
+    # Pipeline cũ: decode đầy đủ + ImageOps.fit LANCZOS + preprocess_input
+    image = Image.open(file).convert("RGB")
+    image = ImageOps.fit(image, (224, 224), Image.Resampling.LANCZOS)
+    img = np.asarray(image)
+    return tf.keras.applications.mobilenet_v2.preprocess_input(img)
+
+
+def synthetic_jpeg(width=4000, height=3000):
+    # Ảnh 12MP giả lập ảnh chụp điện thoại
+    rng = np.random.default_rng(0)
+    small = rng.integers(0, 255, size=(height // 50, width // 50, 3), dtype=np.uint8)
+    image = Image.fromarray(small).resize((width, height), Image.Resampling.BILINEAR)
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=92)
+    return buf.getvalue()
+
+
+def _time_pipeline(fn, payloads, repeat):
+    timings = []
+    for _ in range(repeat):
+        for data in payloads:
+            start = time.perf_counter()
+            fn(io.BytesIO(data))
+            timings.append((time.perf_counter() - start) * 1000)
+    return float(np.percentile(timings, 50)), float(np.percentile(timings, 99))
+
+
+def _evaluate_filter(predictor, samples, decode_fn, resample, batch_size=32):
+    # Trả về mảng nhãn dự đoán cho toàn bộ samples
+    preds = []
+    batch = np.empty((batch_size, 224, 224, 3), dtype=np.float32)
+    for start in range(0, len(samples), batch_size):
+        chunk = samples[start:start + batch_size]
+        for i, (path, _) in enumerate(chunk):
+            preprocess_image(decode_fn(path), out=batch[i], resample=resample)
+        preds.extend(np.argmax(predictor(batch[:len(chunk)]), axis=1))
+    return np.array(preds)
+
+
+def bench_preprocess(args):
+    # 1. Thời gian decode + preprocess cho ảnh lớn
+    if args.images:
+        payloads = []
+        for root, _, files in os.walk(args.images):
+            for fname in sorted(files)[:args.limit]:
+                with open(os.path.join(root, fname), 'rb') as f:
+                    payloads.append(f.read())
+    else:
+        payloads = [synthetic_jpeg()]
+
+    print("\n" + "=" * 60)
+    print(f"DECODE + PREPROCESS ({len(payloads)} ảnh x {args.repeat} lần)")
+    print("=" * 60)
+    old_p50, old_p99 = _time_pipeline(legacy_preprocess, payloads, args.repeat)
+    new_p50, new_p99 = _time_pipeline(lambda f: preprocess_image(decode_image(f)), payloads, args.repeat)
+    print(f"{'Cũ (full decode + LANCZOS)':32s} p50={old_p50:8.2f}ms  p99={old_p99:8.2f}ms")
+    print(f"{'Mới (draft + fused resize)':32s} p50={new_p50:8.2f}ms  p99={new_p99:8.2f}ms")
+
+    # 2. Accuracy parity trên test split cho từng resampling filter
+    if not args.dataset:
+        return
+
+    samples, _ = list_labeled_images(args.dataset, split="test")
+    labels = np.array([label for _, label in samples])
+    predictor = KerasPredictor(load_benchmark_model(args.model))
+
+    # Baseline: decode đầy đủ + LANCZOS như pipeline cũ
+    baseline = _evaluate_filter(predictor, samples, lambda p: decode_image(p, draft_size=0), "lanczos")
+
+    print("\n" + "=" * 60)
+    print(f"ACCURACY PARITY TRÊN TEST SET ({len(samples)} ảnh)")
+    print("=" * 60)
+    print(f"{'baseline (lanczos, full)':26s} acc={np.mean(baseline == labels):.4f}")
+    for name in RESAMPLE_FILTERS:
+        preds = _evaluate_filter(predictor, samples, decode_image, name)
+        print(f"{name + ' (draft)':26s} acc={np.mean(preds == labels):.4f}  "
+              f"khớp baseline={np.mean(preds == baseline) * 100:.2f}%")
+
+
+def bench_tta(args):
+    predictor = KerasPredictor(load_benchmark_model(args.model))
+
+    # 1. Latency: không TTA / TTA một batch / TTA gọi tuần tự từng view
+    img = random_inputs(1)[0]
+    base = predictor(img[np.newaxis, ...])[0]
+    views = build_tta_views(img)
+    latency = {
+        "Không TTA (batch 1)": measure_latency(lambda x: predictor(x)),
+        f"TTA batch ({len(views) + 1} view)": measure_latency(lambda x: apply_tta(x[0], predictor(x)[0], predictor)),
+        "TTA tuần tự từng view": measure_latency(
+            lambda x: [predictor(v[np.newaxis, ...]) for v in build_tta_views(x[0])]
+        ),
+    }
+
+    print("\n" + "=" * 60)
+    print("LATENCY TEST-TIME AUGMENTATION")
+    print("=" * 60)
+    for name, r in latency.items():
+        print(f"{name:28s} p50={r['p50_ms']:7.2f}ms  p95={r['p95_ms']:7.2f}ms")
+
+    # 2. Accuracy trên dataset/test: TTA chỉ chạy cho dự đoán trong khoảng [LOW, HIGH)
+    if not args.dataset:
+        return
+
+    samples, _ = list_labeled_images(args.dataset, split="test")
+    correct_base = correct_tta = triggered = fixed = broken = 0
+    batch = np.empty((args.batch_size, 224, 224, 3), dtype=np.float32)
+    for start in range(0, len(samples), args.batch_size):
+        chunk = samples[start:start + args.batch_size]
+        for i, (path, _) in enumerate(chunk):
+            preprocess_image(decode_image(path), out=batch[i])
+        preds = predictor(batch[:len(chunk)])
+
+        for i, ((_, label), p) in enumerate(zip(chunk, preds)):
+            base_ok = int(np.argmax(p)) == label
+            if needs_tta(p):
+                triggered += 1
+                p = apply_tta(batch[i], p, predictor)
+            tta_ok = int(np.argmax(p)) == label
+            correct_base += base_ok
+            correct_tta += tta_ok
+            fixed += (not base_ok) and tta_ok
+            broken += base_ok and not tta_ok
+
+    total = len(samples)
+    print("\n" + "=" * 60)
+    print(f"ACCURACY TRÊN TEST SET ({total} ảnh)")
+    print("=" * 60)
+    print(f"   - Ảnh chạy TTA ([LOW, HIGH)): {triggered} ({triggered / total * 100:.1f}%)")
+    print(f"   - Accuracy không TTA: {correct_base / total:.4f}")
+    print(f"   - Accuracy có TTA:    {correct_tta / total:.4f}")
+    print(f"   - TTA sửa đúng: {fixed}, làm sai: {broken}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Đo hiệu năng inference của LeafGuard")
+    parser.add_argument("--model", default=MODEL_PATH, help="Đường dẫn file model .h5")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p_batch = subparsers.add_parser("batching", help="Throughput khi nhiều session gọi đồng thời")
+    p_batch.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    p_batch.add_argument("--requests", type=int, default=20, help="Số request mỗi caller")
+    p_batch.add_argument("--max-batch-size", type=int, default=32)
+    p_batch.add_argument("--max-wait-ms", type=float, default=5.0)
+    p_batch.set_defaults(func=bench_batching)
+
+    p_latency = subparsers.add_parser("latency", help="Latency batch-1: model.predict vs tf.function")
+    p_latency.add_argument("--runs", type=int, default=100)
+    p_latency.set_defaults(func=bench_latency)
+
+    p_pre = subparsers.add_parser("preprocess", help="Decode/preprocess ảnh lớn và accuracy theo filter")
+    p_pre.add_argument("--images", help="Thư mục ảnh để đo (mặc định: ảnh JPEG 12MP giả lập)")
+    p_pre.add_argument("--limit", type=int, default=20, help="Số ảnh tối đa mỗi thư mục")
+    p_pre.add_argument("--repeat", type=int, default=5)
+    p_pre.add_argument("--dataset", help="Thư mục dataset để kiểm tra accuracy trên test split")
+    p_pre.set_defaults(func=bench_preprocess)
+
+    p_tta = subparsers.add_parser("tta", help="Latency và accuracy của test-time augmentation")
+    p_tta.add_argument("--dataset", help="Thư mục dataset để đo accuracy trên test split")
+    p_tta.add_argument("--batch-size", type=int, default=32)
+    p_tta.set_defaults(func=bench_tta)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -2,7 +2,10 @@
 import mysql.connector
 from mysql.connector import Error
 import os
+import time
+import threading
 from dotenv import load_dotenv
+from config.metrics_hooks import observe, register_gauge
 
 # Load biến môi trường từ file .env
 load_dotenv()
@@ -33,15 +36,186 @@ DB_CONFIG = {
     'collation': 'utf8mb4_unicode_ci'
 }
 
+# Connection pool (mỗi process một pool, tạo khi gọi get_connection lần đầu)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+# Chờ tối đa bao lâu (giây) khi pool đã cho mượn hết kết nối
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv('DB_POOL_TIMEOUT_SECONDS', 10))
+# Kết nối sống quá lâu được đóng và mở lại (nhỏ hơn wait_timeout của MySQL, mặc định 8 giờ)
+DB_POOL_RECYCLE_SECONDS = float(os.getenv('DB_POOL_RECYCLE_SECONDS', 1800))
+# Kết nối để rảnh quá lâu được ping trước khi cho mượn
+DB_POOL_PRE_PING_IDLE_SECONDS = float(os.getenv('DB_POOL_PRE_PING_IDLE_SECONDS', 30))
+
+# Thống kê tổng quan (get_statistics) được cache bao nhiêu giây
+STATISTICS_CACHE_TTL_SECONDS = float(os.getenv('STATISTICS_CACHE_TTL_SECONDS', 30))
+
+# Cache truy vấn theo user (lịch sử, thống kê): hết hiệu lực khi user lưu / xóa chẩn đoán
+# TTL chỉ để bắt thay đổi từ process khác (vd. outbox relay chạy riêng)
+USER_CACHE_MAX_ENTRIES = int(os.getenv('USER_CACHE_MAX_ENTRIES', 2048))
+USER_CACHE_TTL_SECONDS = float(os.getenv('USER_CACHE_TTL_SECONDS', 300))
+
+
+class ConnectionPool:
+    """
+    Pool kết nối dùng chung cho cả process (thread-safe).
+    - Kết nối rảnh được dùng lại theo LIFO (kết nối vừa trả là kết nối "nóng" nhất)
+    - Pre-ping kết nối để rảnh lâu, đóng và mở lại kết nối quá DB_POOL_RECYCLE_SECONDS
+    - Đếm số lần mượn / chờ / hết thời gian chờ, thời gian chờ đưa vào metrics "mysql.pool_wait"
+    """
+
+    def __init__(
+        self,
+        config: dict,
+        size: int = DB_POOL_SIZE,
+        timeout: float = DB_POOL_TIMEOUT_SECONDS,
+        recycle: float = DB_POOL_RECYCLE_SECONDS,
+        pre_ping_idle: float = DB_POOL_PRE_PING_IDLE_SECONDS
+    ):
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping_idle = pre_ping_idle
+
+        self._idle = []  # [(connection, thời điểm trả lại)]
+        self._created_at = {}  # id(connection) -> thời điểm tạo
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+        self.counters = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'created': 0,
+            'recycled': 0,
+            'ping_failures': 0
+        }
+
+    def _open(self):
+        connection = mysql.connector.connect(**self.config)
+        with self._cond:
+            self._created_at[id(connection)] = time.monotonic()
+            self.counters['created'] += 1
+        return connection
+
+    def _discard(self, connection, counter=None):
+        with self._cond:
+            self._created_at.pop(id(connection), None)
+            if counter:
+                self.counters[counter] += 1
+        try:
+            connection.close()
+        except Error:
+            pass
+
+    def _is_usable(self, connection, idle_since: float) -> bool:
+        now = time.monotonic()
+        if now - self._created_at.get(id(connection), now) > self.recycle:
+            self._discard(connection, 'recycled')
+            return False
+        if now - idle_since > self.pre_ping_idle:
+            try:
+                connection.ping(reconnect=False)
+            except Error:
+                self._discard(connection, 'ping_failures')
+                return False
+        return True
+
+    def acquire(self):
+        #Mượn một kết nối; trả về None nếu hết thời gian chờ hoặc không kết nối được
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            with self._cond:
+                waited = False
+                while not self._idle and self._in_use >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.counters['timeouts'] += 1
+                        print(f"Lỗi kết nối database: hết thời gian chờ connection pool ({self.timeout}s)")
+                        return None
+                    if not waited:
+                        self.counters['waits'] += 1
+                        waited = True
+                    self._cond.wait(timeout=remaining)
+
+                self._in_use += 1
+                candidate = self._idle.pop() if self._idle else None
+
+            # Ping / mở kết nối bên ngoài lock để không chặn các thread khác
+            try:
+                if candidate is not None:
+                    connection, idle_since = candidate
+                    if not self._is_usable(connection, idle_since):
+                        with self._cond:
+                            self._in_use -= 1
+                        continue
+                else:
+                    connection = self._open()
+            except Error:
+                with self._cond:
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+
+            with self._cond:
+                self.counters['checkouts'] += 1
+            observe("mysql.pool_wait", time.perf_counter() - start)
+            return connection
+
+    def release(self, connection):
+        #Trả kết nối về pool; transaction dang dở bị rollback, kết nối hỏng bị bỏ
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+            reusable = True
+        except Error:
+            reusable = False
+
+        with self._cond:
+            self._in_use -= 1
+            if reusable and id(connection) in self._created_at:
+                self._idle.append((connection, time.monotonic()))
+            self._cond.notify()
+
+        if not reusable:
+            self._discard(connection)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'size': self.size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                **self.counters
+            }
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    # Tạo lại pool sau khi fork (api_server --processes): không dùng chung socket giữa các process
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool(DB_CONFIG)
+                _pool_pid = os.getpid()
+                register_gauge("leafguard_mysql_pool", "MySQL connection pool state and counters.", _pool.stats)
+    return _pool
+
+
 def get_connection():
+    # Mượn kết nối từ pool; nhớ trả lại bằng close_connection
     try:
-        connection = mysql.connector.connect(**DB_CONFIG)
-        if connection.is_connected():
-            return connection
+        return get_pool().acquire()
     except Error as e:
         print(f"Lỗi kết nối database: {e}")
         return None
 
 def close_connection(connection):
-    if connection and connection.is_connected():
-        connection.close()
\ No newline at end of file
+    if connection:
+        get_pool().release(connection)
\ No newline at end of file
@@ -0,0 +1,40 @@
+# config/inference.py
+import os
+from dotenv import load_dotenv
+
+# Load biến môi trường từ file .env
+load_dotenv()
+
+# Đường dẫn model và danh sách class
+MODEL_PATH = os.getenv('MODEL_PATH', 'models/MobileNetV2_best.h5')
+CLASS_INDICES_PATH = os.getenv('CLASS_INDICES_PATH', 'models/class_indices.json')
+
+# Backend inference: 'keras' (float32 .h5) hoặc 'tflite' (INT8, tạo bằng export_tflite.py)
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'keras').lower()
+TFLITE_MODEL_PATH = os.getenv('TFLITE_MODEL_PATH', 'models/MobileNetV2_int8.tflite')
+
+# Warm-up model khi load (forward pass trên input giả cho batch 1, các lũy thừa của 2 và INFERENCE_MAX_BATCH_SIZE;
+# InferenceEngine đệm mỗi batch lên size đã warm-up gần nhất)
+INFERENCE_WARMUP = os.getenv('INFERENCE_WARMUP', 'true').lower() in ('1', 'true', 'yes')
+
+# Preprocessing ảnh đầu vào
+# - DECODE_DRAFT_SIZE: JPEG được decode ở độ phân giải giảm nhưng vẫn >= giá trị này mỗi chiều
+# - PREPROCESS_RESAMPLE: filter resize về 224x224 (nearest/bilinear/bicubic/lanczos),
+#   kiểm tra accuracy bằng `python benchmark.py preprocess --dataset dataset` trước khi đổi
+DECODE_DRAFT_SIZE = int(os.getenv('DECODE_DRAFT_SIZE', 448))
+PREPROCESS_RESAMPLE = os.getenv('PREPROCESS_RESAMPLE', 'bilinear').lower()
+
+# Test-time augmentation cho dự đoán dưới ngưỡng tin cậy cao (mặc định tắt)
+TTA_ENABLED = os.getenv('TTA_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+# Cache kết quả dự đoán theo hash ảnh (LRU + TTL)
+PREDICTION_CACHE_MAX_ENTRIES = int(os.getenv('PREDICTION_CACHE_MAX_ENTRIES', 1024))
+PREDICTION_CACHE_TTL_SECONDS = float(os.getenv('PREDICTION_CACHE_TTL_SECONDS', 3600))
+
+# Micro-batching: gom request từ nhiều session thành một batch
+# - INFERENCE_MAX_BATCH_SIZE: số ảnh tối đa trong một lần forward pass
+# - INFERENCE_MAX_WAIT_MS: thời gian tối đa (ms) chờ thêm request trước khi chạy batch
+# - INFERENCE_TIMEOUT_SECONDS: thời gian tối đa một request chờ kết quả (engine kẹt thì báo lỗi thay vì treo)
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv('INFERENCE_MAX_BATCH_SIZE', 32))
+INFERENCE_MAX_WAIT_MS = float(os.getenv('INFERENCE_MAX_WAIT_MS', 5))
+INFERENCE_TIMEOUT_SECONDS = float(os.getenv('INFERENCE_TIMEOUT_SECONDS', 30))
@@ -0,0 +1,20 @@
+# config/metrics.py
+import os
+from dotenv import load_dotenv
+
+# Load biến môi trường từ file .env
+load_dotenv()
+
+# Đo latency từng bước xử lý (decode, preprocess, inference, lưu ảnh, Firestore, MySQL...)
+# Tắt mặc định: khi tắt, các hàm được đo chạy trực tiếp không qua wrapper
+LATENCY_METRICS_ENABLED = os.getenv('LATENCY_METRICS_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+# Xuất metrics dạng Prometheus text:
+# - METRICS_FILE: ghi định kỳ ra file (dùng với node_exporter textfile collector)
+# - METRICS_PORT: mở endpoint http://localhost:<port>/metrics
+METRICS_FILE = os.getenv('METRICS_FILE')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0)) or None
+METRICS_FILE_INTERVAL_SECONDS = float(os.getenv('METRICS_FILE_INTERVAL_SECONDS', 15))
+
+# Số mẫu gần nhất giữ lại mỗi stage để tính p50/p95/p99
+METRICS_WINDOW_SIZE = int(os.getenv('METRICS_WINDOW_SIZE', 2048))
@@ -0,0 +1,51 @@
+# config/metrics_hooks.py
+import time
+import functools
+
+# Điểm gắn metrics cho config/database.py và database/*: các module này chỉ import file này,
+# không import ngược lên src.metrics. src.metrics gọi install() khi được import (app / API);
+# chưa install (CLI, script) thì observe / timed không làm gì, gauge được giữ lại chờ đăng ký.
+
+_observe = None
+_register_gauge = None
+_pending_gauges = {}
+
+
+def install(observe=None, register_gauge=None):
+    # observe(stage, seconds): ghi một số đo latency (None nếu tắt đo latency)
+    # register_gauge(name, help_text, collect): đăng ký gauge, độc lập với cờ đo latency
+    global _observe, _register_gauge
+    _observe = observe
+    _register_gauge = register_gauge
+    if register_gauge is not None:
+        for name, (help_text, collect) in list(_pending_gauges.items()):
+            register_gauge(name, help_text, collect)
+        _pending_gauges.clear()
+
+
+def observe(stage, seconds):
+    if _observe is not None:
+        _observe(stage, seconds)
+
+
+def register_gauge(name, help_text, collect):
+    if _register_gauge is not None:
+        _register_gauge(name, help_text, collect)
+    else:
+        _pending_gauges[name] = (help_text, collect)
+
+
+def timed(stage):
+    # Decorator đo thời gian cả hàm; kiểm tra hook lúc gọi vì src.metrics có thể được import sau
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _observe is None:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _observe(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
@@ -0,0 +1,34 @@
+# config/persistence.py
+import os
+from dotenv import load_dotenv
+
+# Load biến môi trường từ file .env
+load_dotenv()
+
+# Write-behind: lưu ảnh / Firestore / MySQL chạy nền sau khi đã trả kết quả cho người dùng
+# Job được ghi vào spool trên đĩa trước, nên không mất dữ liệu khi process bị tắt đột ngột
+# Sink ghi theo job id (request_key MySQL, document ID cố định Firestore) nên chạy lại job từ spool không tạo bản sao
+# Mặc định bật; spool cần thư mục ghi được và bền qua các lần khởi động lại (tắt: lưu đồng bộ, lỗi hiện ngay)
+WRITE_BEHIND_ENABLED = os.getenv('WRITE_BEHIND_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+WRITE_BEHIND_SPOOL_DIR = os.getenv('WRITE_BEHIND_SPOOL_DIR', 'spool/diagnoses')
+
+# Retry cho từng sink: backoff lũy thừa base * 2^(lần thử - 1), tối đa max giây
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv('WRITE_BEHIND_MAX_RETRIES', 5))
+WRITE_BEHIND_BACKOFF_BASE_SECONDS = float(os.getenv('WRITE_BEHIND_BACKOFF_BASE_SECONDS', 2))
+WRITE_BEHIND_BACKOFF_MAX_SECONDS = float(os.getenv('WRITE_BEHIND_BACKOFF_MAX_SECONDS', 300))
+
+# Outbox: save_diagnosis / delete_diagnosis (MySQL) ghi sự kiện vào bảng diagnosis_outbox trong cùng
+# transaction, relay đọc bảng này và ghi sang Firestore (thay cho việc ghi Firestore trực tiếp)
+OUTBOX_ENABLED = os.getenv('OUTBOX_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Chạy relay trong process web app / API (tắt nếu chạy riêng: python database/outbox_relay.py)
+OUTBOX_RELAY_IN_PROCESS = os.getenv('OUTBOX_RELAY_IN_PROCESS', 'true').lower() in ('1', 'true', 'yes')
+# Số sự kiện mỗi lần relay (mỗi sự kiện tối đa 2 thao tác ghi, Firestore giới hạn 500 / transaction)
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 200))
+OUTBOX_POLL_INTERVAL_SECONDS = float(os.getenv('OUTBOX_POLL_INTERVAL_SECONDS', 1))
+# Sự kiện gửi lỗi quá số lần này được chuyển sang bảng diagnosis_outbox_dead (không chặn các sự kiện sau)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 10))
+
+# Kho ảnh chẩn đoán theo nội dung (sha256), chia thư mục con 2 cấp theo prefix của hash
+IMAGE_STORE_DIR = os.getenv('IMAGE_STORE_DIR', 'uploads/blobs')
+# Thumbnail (cạnh dài tối đa, pixel) lưu cạnh ảnh trong kho: <tên ảnh>.thumb.jpg (ảnh ngoài kho: <kho>/thumbs/)
+THUMBNAIL_SIZE = int(os.getenv('THUMBNAIL_SIZE', 256))
@@ -0,0 +1,24 @@
+# database/backfill_firestore_aggregates.py
+import argparse
+import os
+import sys
+
+# Thêm parent directory vào path để import config
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.firestore_manager import FirestoreManager
+
+if __name__ == "__main__":
+    # Tính thống kê (plant_counts, disease_counts, confidence_sum) cho các user document cũ
+    parser = argparse.ArgumentParser(description="Backfill thống kê theo user trên Firestore")
+    parser.add_argument("--user-id", help="Chỉ backfill một user")
+    parser.add_argument("--force", action="store_true", help="Tính lại cả user đã có thống kê")
+    args = parser.parse_args()
+    
+    firestore = FirestoreManager()
+    if args.user_id:
+        ok = firestore.backfill_user_aggregates(args.user_id) is not None
+        sys.exit(0 if ok else 1)
+    
+    processed = firestore.backfill_all_user_aggregates(force=args.force)
+    print(f"\nHoàn tất: đã backfill {processed} user")
+    sys.exit(0)
\ No newline at end of file
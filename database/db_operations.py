@@ -1,11 +1,186 @@
-from config.database import get_connection, close_connection
+from config.database import get_connection, close_connection, STATISTICS_CACHE_TTL_SECONDS
+from config.persistence import OUTBOX_ENABLED
 from mysql.connector import Error
 import json
-from datetime import datetime
+import os
+from collections import Counter
+from datetime import datetime, timedelta
 import numpy as np
+from config.metrics_hooks import timed
+from src.ttl_cache import TTLCache
+from src.user_cache import user_query_cache
+from src.image_store import ImageStore, hash_from_path
+from database.prediction_codec import current_vocabulary, encode_predictions, LazyPredictions
 
-def save_diagnosis(plant_type, disease_status, confidence, predictions, firebase_user_id=None, image_path=None):
+# Cột cho trang lịch sử: không kèm prediction_json (JSON lớn, trang lịch sử không dùng)
+HISTORY_COLUMNS = "id, firebase_user_id, image_path, plant_type, disease_status, confidence, created_at"
+
+# Thống kê tổng quan hiển thị cho mọi người: cache ngắn hạn, chỉ một request truy vấn lại khi hết hạn
+_statistics_cache = TTLCache(ttl_seconds=STATISTICS_CACHE_TTL_SECONDS)
+
+# Các class vocabulary đã chắc chắn có trong bảng class_vocabularies (tránh INSERT lặp lại)
+_saved_vocabularies = set()
+
+def _encode_for_storage(cursor, predictions, pending_vocabularies):
+    # Trả về (prediction_json, prediction_blob, vocab_version) để INSERT
+    # Lớp khớp models/class_indices.json: mảng float16; không khớp: JSON như cũ
+    # pending_vocabularies: version đã INSERT trong transaction này, thêm vào _saved_vocabularies sau commit
+    version, class_names = current_vocabulary()
+    blob = encode_predictions(predictions, class_names)
+    if blob is None:
+        return json.dumps({k: float(v) for k, v in predictions.items()}, ensure_ascii=False), None, None
+    if version not in _saved_vocabularies and version not in pending_vocabularies:
+        cursor.execute(
+            "INSERT IGNORE INTO class_vocabularies (version, class_names) VALUES (%s, %s)",
+            (version, json.dumps(list(class_names), ensure_ascii=False))
+        )
+        pending_vocabularies.add(version)
+    return None, blob, version
+
+def _select_vocabulary(cursor, version):
+    # Đọc vocabulary bằng cursor có sẵn (cursor thường hoặc dictionary=True)
+    cursor.execute("SELECT class_names FROM class_vocabularies WHERE version = %s", (version,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    return tuple(json.loads(row['class_names'] if isinstance(row, dict) else row[0]))
+
+def _load_vocabulary(version):
+    # Đọc danh sách tên lớp của một vocab version cũ (model đã train lại với bộ lớp khác)
+    connection = get_connection()
+    if not connection:
+        return None
+    try:
+        cursor = connection.cursor()
+        return _select_vocabulary(cursor, version)
+    except Error as e:
+        print(f"Lỗi đọc class vocabulary: {e}")
+        return None
+    finally:
+        cursor.close()
+        close_connection(connection)
+
+def _attach_predictions(row, resolve_vocabulary=_load_vocabulary):
+    # Thay prediction_blob / vocab_version bằng prediction_json dạng dict giải mã lười
+    blob = row.pop('prediction_blob', None)
+    version = row.pop('vocab_version', None)
+    if blob is not None:
+        row['prediction_json'] = LazyPredictions(blob, version, resolve_vocabulary)
+    elif row.get('prediction_json'):
+        row['prediction_json'] = json.loads(row['prediction_json'])
+    return row
+
+def _add_outbox_event(cursor, diagnosis_id, firebase_user_id, event_type, payload=None):
+    # Ghi sự kiện đồng bộ Firestore trong cùng transaction; bỏ qua nếu tắt outbox hoặc không có user
+    if not OUTBOX_ENABLED or not firebase_user_id:
+        return
+    cursor.execute("""
+        INSERT INTO diagnosis_outbox (diagnosis_id, firebase_user_id, event_type, payload)
+        VALUES (%s, %s, %s, %s)
+    """, (diagnosis_id, firebase_user_id, event_type, json.dumps(payload, ensure_ascii=False) if payload else None))
+
+def _is_healthy(disease_status):
+    # Cùng điều kiện với summarize_prediction / handle_diagnosis và cột is_healthy
+    # (process_label lưu trạng thái khỏe mạnh là "Khỏe mạnh")
+    status = (disease_status or '').lower()
+    return 'healthy' in status or 'khỏe mạnh' in status
+
+def _increment_statistics(cursor, total, healthy):
+    # Cộng dồn thống kê của ngày hiện tại; gọi trong cùng transaction với INSERT vào diagnoses
+    # (CURRENT_DATE() cùng múi giờ session với DEFAULT CURRENT_TIMESTAMP của created_at)
+    cursor.execute("""
+        INSERT INTO statistics (date, total_diagnoses, healthy_count, diseased_count)
+        VALUES (CURRENT_DATE(), %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            total_diagnoses = total_diagnoses + VALUES(total_diagnoses),
+            healthy_count = healthy_count + VALUES(healthy_count),
+            diseased_count = diseased_count + VALUES(diseased_count)
+    """, (total, healthy, total - healthy))
+
+def _decrement_statistics(cursor, date, healthy):
+    # Trừ một bản ghi khỏi thống kê ngày date; gọi trong cùng transaction với DELETE
+    cursor.execute("""
+        UPDATE statistics SET
+            total_diagnoses = GREATEST(total_diagnoses - 1, 0),
+            healthy_count = GREATEST(healthy_count - %s, 0),
+            diseased_count = GREATEST(diseased_count - %s, 0)
+        WHERE date = %s
+    """, (healthy, 1 - healthy, date))
+
+def _increment_user_daily_stats(cursor, rows):
+    # Cộng dồn user_daily_stats của ngày hiện tại; rows: [(user_id, plant_type, disease_status, số chẩn đoán, tổng confidence)]
+    # Chẩn đoán không gắn user không có trong bảng này
+    rows = [row for row in rows if row[0]]
+    if not rows:
+        return
+    cursor.executemany("""
+        INSERT INTO user_daily_stats (firebase_user_id, date, plant_type, disease_status, diagnosis_count, confidence_sum)
+        VALUES (%s, CURRENT_DATE(), %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            diagnosis_count = diagnosis_count + VALUES(diagnosis_count),
+            confidence_sum = confidence_sum + VALUES(confidence_sum)
+    """, rows)
+
+def _decrement_user_daily_stats(cursor, firebase_user_id, date, plant_type, disease_status, confidence):
+    # Trừ một bản ghi khỏi user_daily_stats; nhóm không còn chẩn đoán nào thì xóa dòng
+    if not firebase_user_id:
+        return
+    key = (firebase_user_id, date, plant_type, disease_status)
+    cursor.execute("""
+        UPDATE user_daily_stats SET
+            diagnosis_count = GREATEST(diagnosis_count - 1, 0),
+            confidence_sum = GREATEST(confidence_sum - %s, 0)
+        WHERE firebase_user_id = %s AND date = %s AND plant_type = %s AND disease_status = %s
+    """, (confidence, *key))
+    cursor.execute("""
+        DELETE FROM user_daily_stats
+        WHERE firebase_user_id = %s AND date = %s AND plant_type = %s AND disease_status = %s AND diagnosis_count = 0
+    """, key)
+
+def _acquire_image_blobs(cursor, image_paths):
+    # Tăng ref_count cho ảnh trong kho (tên file là sha256), gọi trong cùng transaction với INSERT vào diagnoses:
+    # lưu lỗi thì rollback cả hai, job write-behind chạy lại cũng không tăng thêm.
+    # Trả về danh sách ảnh không còn file (vừa bị _release_image_blob xóa) -> caller rollback và ghi lại ảnh
+    missing = []
+    for path, count in Counter(p for p in image_paths if p).items():
+        digest = hash_from_path(path)
+        if not digest:
+            continue
+        size_bytes = os.path.getsize(path) if os.path.exists(path) else 0
+        cursor.execute("""
+            INSERT INTO image_blobs (sha256, path, size_bytes, ref_count)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE ref_count = ref_count + VALUES(ref_count)
+        """, (digest, path, size_bytes, count))
+        # Dòng image_blobs đang bị khóa tới khi commit, _release_image_blob (xóa file khi giữ khóa) phải chờ;
+        # chỉ cần kiểm tra file còn tồn tại tại thời điểm này
+        if not os.path.exists(path):
+            missing.append(path)
+    return missing
+
+def _release_image_blob(cursor, image_path):
+    # Giảm ref_count của ảnh trong kho, gọi trong cùng transaction với DELETE khỏi diagnoses (trước commit);
+    # về 0 thì xóa dòng image_blobs và file. Ảnh cũ ngoài kho (không phải tên sha256) được giữ nguyên
+    digest = hash_from_path(image_path)
+    if not digest:
+        return
+    cursor.execute("SELECT ref_count, path FROM image_blobs WHERE sha256 = %s FOR UPDATE", (digest,))
+    row = cursor.fetchone()
+    if row is None:
+        return
+    if row[0] <= 1:
+        cursor.execute("DELETE FROM image_blobs WHERE sha256 = %s", (digest,))
+        # Xóa file khi còn giữ khóa dòng: save_diagnosis tăng ref_count (chờ khóa này) rồi mới kiểm tra
+        # file còn tồn tại, nên không có chẩn đoán mới nào trỏ tới file đã xóa
+        ImageStore().remove(row[1])
+    else:
+        cursor.execute("UPDATE image_blobs SET ref_count = ref_count - 1 WHERE sha256 = %s", (digest,))
+
+@timed("mysql.save_diagnosis")
+def save_diagnosis(plant_type, disease_status, confidence, predictions, firebase_user_id=None, image_path=None, top3_predictions=None, request_key=None):
     #Lưu kết quả chẩn đoán vào database
+    #top3_predictions: chỉ dùng cho bản sao trên Firestore (qua outbox)
+    #request_key: khóa idempotency (job id write-behind); đã có bản ghi cùng khóa thì trả về id cũ, không ghi gì thêm
     connection = get_connection()
     if not connection:
         return False
@@ -13,8 +188,17 @@ def save_diagnosis(plant_type, disease_status, confidence, predictions, firebase
     try:
         cursor = connection.cursor()
         
-        # Chuyển predictions thành JSON
-        predictions_json = json.dumps(predictions, ensure_ascii=False)
+        if request_key:
+            cursor.execute("SELECT id FROM diagnoses WHERE request_key = %s", (request_key,))
+            existing = cursor.fetchone()
+            if existing:
+                connection.rollback()
+                print(f"Chẩn đoán đã được lưu trước đó (ID: {existing[0]}), bỏ qua")
+                return existing[0]
+        
+        # Mã hóa predictions thành mảng float16 (hoặc JSON nếu lớp không khớp vocabulary)
+        pending_vocabularies = set()
+        predictions_json, prediction_blob, vocab_version = _encode_for_storage(cursor, predictions, pending_vocabularies)
         
         # Convert numpy types to Python native types (MySQL connector không hỗ trợ numpy types)
         if isinstance(confidence, (np.floating, np.integer)):
@@ -22,74 +206,293 @@ def save_diagnosis(plant_type, disease_status, confidence, predictions, firebase
         else:
             confidence = float(confidence) if confidence is not None else 0.0
         
-        # INSERT theo đúng thứ tự trong schema: id (auto), firebase_user_id, image_path, plant_type, disease_status, confidence, prediction_json, created_at (auto), updated_at (auto)
+        # INSERT theo đúng thứ tự trong schema: id (auto), firebase_user_id, image_path, plant_type, disease_status, confidence, prediction_json, prediction_blob, vocab_version, request_key, created_at (auto), updated_at (auto)
+        # Hai lần lưu cùng request_key chạy song song: lần sau vi phạm uq_request_key và rollback (lần thử lại trả về id cũ)
         query = """
         INSERT INTO diagnoses 
-        (firebase_user_id, image_path, plant_type, disease_status, confidence, prediction_json)
-        VALUES (%s, %s, %s, %s, %s, %s)
+        (firebase_user_id, image_path, plant_type, disease_status, confidence, prediction_json, prediction_blob, vocab_version, request_key)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
         """
         
         # Thứ tự values phải khớp với thứ tự trong query
-        values = (firebase_user_id, image_path, plant_type, disease_status, confidence, predictions_json)
+        values = (firebase_user_id, image_path, plant_type, disease_status, confidence, predictions_json, prediction_blob, vocab_version, request_key)
         cursor.execute(query, values)
+        diagnosis_id = cursor.lastrowid
+        
+        missing_images = _acquire_image_blobs(cursor, [image_path])
+        if missing_images:
+            connection.rollback()
+            print(f"Lỗi lưu dữ liệu: ảnh không còn trong kho, cần lưu lại ảnh: {missing_images[0]}")
+            return False
+        
+        # Cập nhật thống kê ngày trong cùng transaction (thay cho update_statistics quét lại cả ngày)
+        _increment_statistics(cursor, 1, 1 if _is_healthy(disease_status) else 0)
+        _increment_user_daily_stats(cursor, [(firebase_user_id, plant_type, disease_status, 1, confidence)])
+        
+        # Sự kiện đồng bộ sang Firestore (relay ghi sau, cùng commit với bản ghi chẩn đoán)
+        _add_outbox_event(cursor, diagnosis_id, firebase_user_id, 'save', {
+            'plant_type': plant_type,
+            'disease': disease_status,
+            'confidence': confidence * 100,
+            'top3_predictions': top3_predictions or [],
+            'timestamp': datetime.now().isoformat()
+        })
         connection.commit()
+        _saved_vocabularies.update(pending_vocabularies)
+        user_query_cache.bump(firebase_user_id)
         
-        diagnosis_id = cursor.lastrowid
         print(f"Đã lưu chẩn đoán ID: {diagnosis_id}")
         return diagnosis_id
         
     except Error as e:
         print(f"Lỗi lưu dữ liệu: {e}")
+        connection.rollback()
         return False
     finally:
         if connection:
             cursor.close()
             close_connection(connection)
 
-def get_user_diagnoses(firebase_user_id=None, limit=10):
+@timed("mysql.save_diagnoses_bulk")
+def save_diagnoses_bulk(records, chunk_size=500):
+    #Lưu nhiều kết quả chẩn đoán một lần (dùng cho CLI chẩn đoán hàng loạt)
+    #records: list dict với các key giống tham số của save_diagnosis
+    connection = get_connection()
+    if not connection:
+        return 0
+    
+    try:
+        cursor = connection.cursor()
+        
+        query = """
+        INSERT INTO diagnoses 
+        (firebase_user_id, image_path, plant_type, disease_status, confidence, prediction_json, prediction_blob, vocab_version)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """
+        
+        pending_vocabularies = set()
+        values = [
+            (
+                r.get('firebase_user_id'),
+                r.get('image_path'),
+                r['plant_type'],
+                r['disease_status'],
+                float(r['confidence']) if r.get('confidence') is not None else 0.0,
+                *_encode_for_storage(cursor, r.get('predictions', {}), pending_vocabularies)
+            )
+            for r in records
+        ]
+        
+        # Chia nhỏ để mỗi lần gửi không quá lớn
+        saved = 0
+        for start in range(0, len(values), chunk_size):
+            cursor.executemany(query, values[start:start + chunk_size])
+            saved += cursor.rowcount
+        
+        missing_images = _acquire_image_blobs(cursor, [r.get('image_path') for r in records])
+        if missing_images:
+            connection.rollback()
+            print(f"Lỗi lưu dữ liệu hàng loạt: {len(missing_images)} ảnh không còn trong kho")
+            return 0
+        
+        healthy = sum(1 for r in records if _is_healthy(r['disease_status']))
+        _increment_statistics(cursor, len(records), healthy)
+        
+        # Gộp theo (user, loại cây, bệnh): một lần upsert cho mỗi nhóm
+        daily = {}
+        for user_id, _, plant, disease, confidence, *_ in values:
+            count, confidence_sum = daily.get((user_id, plant, disease), (0, 0.0))
+            daily[(user_id, plant, disease)] = (count + 1, confidence_sum + confidence)
+        _increment_user_daily_stats(cursor, [(*key, count, total) for key, (count, total) in daily.items()])
+        connection.commit()
+        _saved_vocabularies.update(pending_vocabularies)
+        user_query_cache.bump(*{r.get('firebase_user_id') for r in records})
+        
+        print(f"Đã lưu {saved} chẩn đoán")
+        return saved
+        
+    except Error as e:
+        print(f"Lỗi lưu dữ liệu hàng loạt: {e}")
+        connection.rollback()
+        return 0
+    finally:
+        if connection:
+            cursor.close()
+            close_connection(connection)
+
+# Thứ tự sắp xếp lịch sử: tên -> (cột, chiều); id cùng chiều để thứ tự luôn xác định (keyset)
+HISTORY_SORTS = {
+    'newest': ('created_at', 'DESC'),
+    'oldest': ('created_at', 'ASC'),
+    'confidence_desc': ('confidence', 'DESC'),
+    'confidence_asc': ('confidence', 'ASC'),
+}
+
+def _history_filters(firebase_user_id=None, plant_type=None, disease_status=None, date_from=None, date_to=None):
+    # Điều kiện WHERE cho lịch sử; user + một bộ lọc loại cây hoặc bệnh với mọi kiểu sắp xếp có index riêng,
+    # lọc đồng thời loại cây và bệnh, hoặc khoảng ngày khi sắp xếp theo độ tin cậy, vẫn sắp xếp bằng filesort
+    conditions, params = [], []
+    if firebase_user_id:
+        conditions.append("firebase_user_id = %s")
+        params.append(firebase_user_id)
+    if plant_type:
+        conditions.append("plant_type = %s")
+        params.append(plant_type)
+    if disease_status:
+        conditions.append("disease_status = %s")
+        params.append(disease_status)
+    # Lọc theo khoảng created_at (không bọc DATE() để dùng được index)
+    if date_from:
+        conditions.append("created_at >= %s")
+        params.append(date_from)
+    if date_to:
+        conditions.append("created_at < %s")
+        params.append(date_to + timedelta(days=1))
+    return conditions, params
+
+def _sort_value_sql(column):
+    # confidence là FLOAT: giá trị đọc ra rồi gửi lại dạng double không bằng đúng giá trị đã lưu,
+    # ép về FLOAT để so sánh keyset chính xác (CAST ... AS FLOAT cần MySQL 8.0.17 trở lên)
+    return "CAST(%s AS FLOAT)" if column == 'confidence' else "%s"
+
+def get_user_diagnoses(firebase_user_id=None, limit=10, sort='newest', plant_type=None, disease_status=None, date_from=None, date_to=None):
     #Lấy lịch sử chẩn đoán của một user hoặc tất cả nếu không có user_id
+    #sort: một key của HISTORY_SORTS; lọc theo loại cây, bệnh, khoảng ngày (datetime.date, tính cả hai đầu)
+    #Kết quả của một user được cache tới khi user đó lưu / xóa chẩn đoán
+    #Chỉ gồm các cột danh sách (HISTORY_COLUMNS); vector dự đoán lấy khi xem chi tiết qua get_diagnosis_predictions
+    args = (firebase_user_id, limit, sort, plant_type, disease_status, date_from, date_to)
+    if firebase_user_id:
+        results = user_query_cache.get_or_load(firebase_user_id, ('mysql.diagnoses', *args), lambda: _query_user_diagnoses(*args))
+    else:
+        results = _query_user_diagnoses(*args)
+    return results if results is not None else []
+
+@timed("mysql.get_user_diagnoses")
+def _query_user_diagnoses(firebase_user_id, limit, sort, plant_type, disease_status, date_from, date_to):
     connection = get_connection()
     if not connection:
-        return []
+        return None
     
     try:
         cursor = connection.cursor(dictionary=True)
         
-        if firebase_user_id:
-            query = """
-            SELECT * FROM diagnoses 
-            WHERE firebase_user_id = %s
-            ORDER BY created_at DESC 
-            LIMIT %s
-            """
-            cursor.execute(query, (firebase_user_id, limit))
+        column, order = HISTORY_SORTS[sort]
+        conditions, params = _history_filters(firebase_user_id, plant_type, disease_status, date_from, date_to)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = f"""
+        SELECT {HISTORY_COLUMNS} FROM diagnoses 
+        {where}
+        ORDER BY {column} {order}, id {order} 
+        LIMIT %s
+        """
+        cursor.execute(query, (*params, limit))
+        return cursor.fetchall()
+        
+    except Error as e:
+        print(f"Lỗi lấy dữ liệu: {e}")
+        return None
+    finally:
+        if connection:
+            cursor.close()
+            close_connection(connection)
+
+def get_user_diagnoses_page(firebase_user_id, page_size=25, cursor_key=None, direction='next', sort='newest', plant_type=None, disease_status=None, date_from=None, date_to=None):
+    #Phân trang lịch sử theo keyset (cột sắp xếp, id), sắp xếp và lọc như get_user_diagnoses
+    #cursor_key: (giá trị cột sắp xếp, id) của bản ghi cuối trang hiện tại (direction='next')
+    #            hoặc của bản ghi đầu trang hiện tại (direction='prev'); None = trang đầu
+    #Trả về dict: items, has_next, has_prev, next_key, prev_key (cache tới khi user lưu / xóa chẩn đoán)
+    args = (firebase_user_id, page_size, cursor_key, direction, sort, plant_type, disease_status, date_from, date_to)
+    page = user_query_cache.get_or_load(firebase_user_id, ('mysql.page', *args), lambda: _query_user_diagnoses_page(*args))
+    if page is None:
+        return {'items': [], 'has_next': False, 'has_prev': False, 'next_key': None, 'prev_key': None}
+    return page
+
+@timed("mysql.get_user_diagnoses_page")
+def _query_user_diagnoses_page(firebase_user_id, page_size, cursor_key, direction, sort, plant_type, disease_status, date_from, date_to):
+    connection = get_connection()
+    if not connection:
+        return None
+    
+    try:
+        cursor = connection.cursor(dictionary=True)
+        
+        column, order = HISTORY_SORTS[sort]
+        conditions, params = _history_filters(firebase_user_id, plant_type, disease_status, date_from, date_to)
+        
+        backwards = cursor_key is not None and direction == 'prev'
+        if backwards:
+            # Đi ngược lại: đảo chiều sắp xếp rồi đảo lại kết quả
+            order = 'ASC' if order == 'DESC' else 'DESC'
+        if cursor_key is not None:
+            op = '<' if order == 'DESC' else '>'
+            value_sql = _sort_value_sql(column)
+            conditions.append(f"({column} {op} {value_sql} OR ({column} = {value_sql} AND id {op} %s))")
+            params.extend([cursor_key[0], cursor_key[0], cursor_key[1]])
+        
+        # Lấy dư 1 dòng để biết còn trang tiếp theo hay không (không cần COUNT(*))
+        query = f"""
+        SELECT {HISTORY_COLUMNS} FROM diagnoses 
+        WHERE {' AND '.join(conditions)}
+        ORDER BY {column} {order}, id {order} 
+        LIMIT %s
+        """
+        cursor.execute(query, (*params, page_size + 1))
+        rows = cursor.fetchall()
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        
+        if backwards:
+            rows.reverse()
+            has_next, has_prev = True, has_more
         else:
-            # Lấy tất cả nếu không có user_id
-            query = """
-            SELECT * FROM diagnoses 
-            ORDER BY created_at DESC 
-            LIMIT %s
-            """
-            cursor.execute(query, (limit,))
-        results = cursor.fetchall()
-        
-        # Parse JSON field
-        for result in results:
-            if result.get('prediction_json'):
-                result['prediction_json'] = json.loads(result['prediction_json'])
-        
-        return results
+            has_next, has_prev = has_more, cursor_key is not None
+        
+        return {
+            'items': rows,
+            'has_next': has_next,
+            'has_prev': has_prev,
+            'next_key': (rows[-1][column], rows[-1]['id']) if rows else None,
+            'prev_key': (rows[0][column], rows[0]['id']) if rows else None
+        }
         
     except Error as e:
         print(f"Lỗi lấy dữ liệu: {e}")
-        return []
+        return None
     finally:
         if connection:
             cursor.close()
             close_connection(connection)
 
-def get_statistics():
-    #Lấy thống kê tổng quan
+def get_user_filter_options(firebase_user_id):
+    #Danh sách loại cây / bệnh user đã chẩn đoán (cho bộ lọc trang lịch sử), đọc từ index
+    options = user_query_cache.get_or_load(firebase_user_id, ('mysql.filter_options',), lambda: _query_user_filter_options(firebase_user_id))
+    return options if options is not None else {'plants': [], 'diseases': []}
+
+@timed("mysql.get_user_filter_options")
+def _query_user_filter_options(firebase_user_id):
+    connection = get_connection()
+    if not connection:
+        return None
+    
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT DISTINCT plant_type FROM diagnoses WHERE firebase_user_id = %s ORDER BY plant_type", (firebase_user_id,))
+        plants = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT DISTINCT disease_status FROM diagnoses WHERE firebase_user_id = %s ORDER BY disease_status", (firebase_user_id,))
+        diseases = [row[0] for row in cursor.fetchall()]
+        return {'plants': plants, 'diseases': diseases}
+        
+    except Error as e:
+        print(f"Lỗi lấy dữ liệu: {e}")
+        return None
+    finally:
+        if connection:
+            cursor.close()
+            close_connection(connection)
+
+@timed("mysql.get_diagnosis_predictions")
+def get_diagnosis_predictions(diagnosis_id, firebase_user_id=None):
+    #Lấy vector xác suất đầy đủ của một chẩn đoán (cho màn hình chi tiết), None nếu không có
     connection = get_connection()
     if not connection:
         return None
@@ -97,28 +500,129 @@ def get_statistics():
     try:
         cursor = connection.cursor(dictionary=True)
         
-        # Tổng số chẩn đoán
-        cursor.execute("SELECT COUNT(*) as total FROM diagnoses")
-        total = cursor.fetchone()['total']
+        if firebase_user_id:
+            cursor.execute("""
+            SELECT prediction_json, prediction_blob, vocab_version FROM diagnoses 
+            WHERE id = %s AND firebase_user_id = %s
+            """, (diagnosis_id, firebase_user_id))
+        else:
+            cursor.execute("""
+            SELECT prediction_json, prediction_blob, vocab_version FROM diagnoses 
+            WHERE id = %s
+            """, (diagnosis_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
         
-        # Số lượng healthy
-        cursor.execute("SELECT COUNT(*) as healthy FROM diagnoses WHERE disease_status LIKE '%healthy%'")
-        healthy = cursor.fetchone()['healthy']
+        # Giải mã ngay khi connection còn mở: vocabulary chưa cache được đọc bằng chính cursor này
+        # (không mượn thêm connection thứ hai từ pool trong lúc đang giữ connection)
+        predictions = _attach_predictions(
+            row, lambda version: _select_vocabulary(cursor, version)
+        ).get('prediction_json')
+        return dict(predictions) if predictions else None
         
-        # Số lượng diseased
-        cursor.execute("SELECT COUNT(*) as diseased FROM diagnoses WHERE disease_status NOT LIKE '%healthy%'")
-        diseased = cursor.fetchone()['diseased']
+    except (Error, KeyError) as e:
+        print(f"Lỗi lấy dữ liệu: {e}")
+        return None
+    finally:
+        if connection:
+            cursor.close()
+            close_connection(connection)
+
+def migrate_prediction_json(chunk_size=1000):
+    #Chuyển các dòng cũ từ prediction_json sang prediction_blob (float16) theo từng chunk
+    #Mỗi chunk một transaction; chạy lại được, dòng có lớp không khớp vocabulary hiện tại được giữ JSON
+    #Trả về (số dòng đã chuyển, số dòng bỏ qua), None nếu lỗi
+    connection = get_connection()
+    if not connection:
+        return None
+    
+    version, class_names = current_vocabulary()
+    converted = skipped = 0
+    last_id = 0
+    
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+            "INSERT IGNORE INTO class_vocabularies (version, class_names) VALUES (%s, %s)",
+            (version, json.dumps(list(class_names), ensure_ascii=False))
+        )
+        connection.commit()
         
-        # Top diseases
+        while True:
+            # Duyệt theo id (khóa chính) để không quét lại các dòng đã bỏ qua
+            cursor.execute("""
+                SELECT id, prediction_json FROM diagnoses 
+                WHERE id > %s AND prediction_blob IS NULL AND prediction_json IS NOT NULL
+                ORDER BY id 
+                LIMIT %s
+            """, (last_id, chunk_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            
+            updates = []
+            for diagnosis_id, prediction_json in rows:
+                blob = encode_predictions(json.loads(prediction_json), class_names)
+                if blob is None:
+                    skipped += 1
+                else:
+                    updates.append((blob, version, diagnosis_id))
+            
+            if updates:
+                cursor.executemany("""
+                    UPDATE diagnoses 
+                    SET prediction_blob = %s, vocab_version = %s, prediction_json = NULL 
+                    WHERE id = %s
+                """, updates)
+            connection.commit()
+            converted += len(updates)
+            print(f"  Đã chuyển {converted} dòng (id <= {last_id}), bỏ qua {skipped}")
+        
+        return converted, skipped
+        
+    except Error as e:
+        print(f"Lỗi chuyển đổi prediction_json: {e}")
+        connection.rollback()
+        return None
+    finally:
+        if connection:
+            cursor.close()
+            close_connection(connection)
+
+def get_statistics():
+    #Lấy thống kê tổng quan (cache STATISTICS_CACHE_TTL_SECONDS giây)
+    return _statistics_cache.get_or_load('overview', _query_statistics)
+
+@timed("mysql.get_statistics")
+def _query_statistics():
+    connection = get_connection()
+    if not connection:
+        return None
+    
+    try:
+        cursor = connection.cursor(dictionary=True)
+        
+        # Một truy vấn duy nhất, đọc hết từ index idx_is_healthy_disease (covering index)
+        # Số nhóm = số loại bệnh (vài chục), tổng / healthy / diseased / top 5 tính trong Python
         cursor.execute("""
-            SELECT disease_status, COUNT(*) as count 
+            SELECT is_healthy, disease_status, COUNT(*) as count 
             FROM diagnoses 
-            WHERE disease_status NOT LIKE '%healthy%'
-            GROUP BY disease_status 
-            ORDER BY count DESC 
-            LIMIT 5
+            GROUP BY is_healthy, disease_status
         """)
-        top_diseases = cursor.fetchall()
+        groups = cursor.fetchall()
+        
+        total = sum(g['count'] for g in groups)
+        healthy = sum(g['count'] for g in groups if g['is_healthy'])
+        diseased = total - healthy
+        
+        # Top diseases
+        top_diseases = sorted(
+            ({'disease_status': g['disease_status'], 'count': g['count']} for g in groups if not g['is_healthy']),
+            key=lambda g: g['count'],
+            reverse=True
+        )[:5]
         
         return {
             'total': total,
@@ -135,6 +639,7 @@ def get_statistics():
             cursor.close()
             close_connection(connection)
 
+@timed("mysql.delete_diagnosis")
 def delete_diagnosis(diagnosis_id: int, firebase_user_id: str = None) -> bool:
     #Xóa một chẩn đoán từ database
     connection = get_connection()
@@ -144,74 +649,209 @@ def delete_diagnosis(diagnosis_id: int, firebase_user_id: str = None) -> bool:
     try:
         cursor = connection.cursor()
         
+        # Khóa bản ghi và lấy ngày + trạng thái để trừ đúng dòng thống kê
         if firebase_user_id:
             # Xóa với điều kiện user_id
-            query = """
-            DELETE FROM diagnoses 
+            cursor.execute("""
+            SELECT DATE(created_at), disease_status, firebase_user_id, image_path, plant_type, confidence FROM diagnoses 
             WHERE id = %s AND firebase_user_id = %s
-            """
-            cursor.execute(query, (diagnosis_id, firebase_user_id))
+            FOR UPDATE
+            """, (diagnosis_id, firebase_user_id))
         else:
             # Xóa không có điều kiện user_id (admin)
-            query = "DELETE FROM diagnoses WHERE id = %s"
-            cursor.execute(query, (diagnosis_id,))
-        
-        connection.commit()
+            cursor.execute("""
+            SELECT DATE(created_at), disease_status, firebase_user_id, image_path, plant_type, confidence FROM diagnoses 
+            WHERE id = %s
+            FOR UPDATE
+            """, (diagnosis_id,))
+        row = cursor.fetchone()
         
-        if cursor.rowcount > 0:
-            print(f"✅ Đã xóa chẩn đoán ID: {diagnosis_id}")
-            return True
-        else:
+        if row is None:
+            connection.rollback()
             print(f"⚠️ Không tìm thấy chẩn đoán ID: {diagnosis_id} hoặc không có quyền xóa")
             return False
         
+        cursor.execute("DELETE FROM diagnoses WHERE id = %s", (diagnosis_id,))
+        _decrement_statistics(cursor, row[0], 1 if _is_healthy(row[1]) else 0)
+        _decrement_user_daily_stats(cursor, row[2], row[0], row[4], row[1], row[5])
+        _add_outbox_event(cursor, diagnosis_id, row[2], 'delete')
+        # Giảm tham chiếu ảnh trong cùng transaction: không mượn thêm connection, không rò tham chiếu khi lỗi giữa chừng
+        _release_image_blob(cursor, row[3])
+        connection.commit()
+        user_query_cache.bump(row[2])
+        
+        print(f"✅ Đã xóa chẩn đoán ID: {diagnosis_id}")
+        return True
+        
     except Error as e:
         print(f"❌ Lỗi xóa dữ liệu: {e}")
+        connection.rollback()
         return False
     finally:
         if connection:
             cursor.close()
             close_connection(connection)
 
-def update_statistics():
-    #Cập nhật bảng statistics (có thể gọi sau mỗi lần save_diagnosis)
+@timed("mysql.rebuild_statistics")
+def rebuild_statistics(start_date=None, end_date=None):
+    #Tính lại bảng statistics và user_daily_stats từ bảng diagnoses (backfill / sửa lệch), mặc định toàn bộ
+    #start_date, end_date: datetime.date, tính cả hai đầu
+    #Trả về số ngày đã ghi lại, None nếu lỗi
     connection = get_connection()
     if not connection:
-        return False
+        return None
     
     try:
         cursor = connection.cursor()
-        today = datetime.now().date()
         
-        # Đếm số chẩn đoán hôm nay
-        cursor.execute("""
+        # Lọc theo khoảng created_at (dùng được idx_created_at, khác với DATE(created_at) = ...)
+        conditions, params = [], []
+        if start_date:
+            conditions.append("created_at >= %s")
+            params.append(start_date)
+        if end_date:
+            conditions.append("created_at < %s")
+            params.append(end_date + timedelta(days=1))
+        where_diagnoses = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        
+        date_conditions, date_params = [], []
+        if start_date:
+            date_conditions.append("date >= %s")
+            date_params.append(start_date)
+        if end_date:
+            date_conditions.append("date <= %s")
+            date_params.append(end_date)
+        where_statistics = f"WHERE {' AND '.join(date_conditions)}" if date_conditions else ""
+        
+        # Xóa rồi ghi lại trong một transaction: ngày không còn bản ghi nào cũng được dọn
+        cursor.execute(f"DELETE FROM statistics {where_statistics}", tuple(date_params))
+        cursor.execute(f"""
+            INSERT INTO statistics (date, total_diagnoses, healthy_count, diseased_count)
             SELECT 
+                DATE(created_at) as day,
                 COUNT(*) as total,
-                SUM(CASE WHEN disease_status LIKE '%healthy%' THEN 1 ELSE 0 END) as healthy,
-                SUM(CASE WHEN disease_status NOT LIKE '%healthy%' THEN 1 ELSE 0 END) as diseased
+                SUM(is_healthy) as healthy,
+                SUM(1 - is_healthy) as diseased
             FROM diagnoses 
-            WHERE DATE(created_at) = %s
-        """, (today,))
-        
-        result = cursor.fetchone()
+            {where_diagnoses}
+            GROUP BY day
+        """, tuple(params))
+        days = cursor.rowcount
         
-        # Insert hoặc update
-        cursor.execute("""
-            INSERT INTO statistics (date, total_diagnoses, healthy_count, diseased_count)
-            VALUES (%s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE
-                total_diagnoses = VALUES(total_diagnoses),
-                healthy_count = VALUES(healthy_count),
-                diseased_count = VALUES(diseased_count)
-        """, (today, result[0], result[1], result[2]))
+        cursor.execute(f"DELETE FROM user_daily_stats {where_statistics}", tuple(date_params))
+        user_conditions = conditions + ["firebase_user_id IS NOT NULL"]
+        cursor.execute(f"""
+            INSERT INTO user_daily_stats (firebase_user_id, date, plant_type, disease_status, diagnosis_count, confidence_sum)
+            SELECT firebase_user_id, DATE(created_at) as day, plant_type, disease_status, COUNT(*), SUM(confidence)
+            FROM diagnoses 
+            WHERE {' AND '.join(user_conditions)}
+            GROUP BY firebase_user_id, day, plant_type, disease_status
+        """, tuple(params))
         
         connection.commit()
-        return True
+        print(f"Đã tính lại thống kê cho {days} ngày")
+        return days
         
     except Error as e:
-        print(f"Lỗi cập nhật thống kê: {e}")
-        return False
+        print(f"Lỗi tính lại thống kê: {e}")
+        connection.rollback()
+        return None
     finally:
         if connection:
             cursor.close()
-            close_connection(connection)
\ No newline at end of file
+            close_connection(connection)
+
+def update_statistics():
+    #Tính lại thống kê hôm nay. Không cần gọi sau save_diagnosis / delete_diagnosis nữa:
+    #hai hàm này đã cập nhật bảng statistics trong cùng transaction
+    today = datetime.now().date()
+    return rebuild_statistics(today, today) is not None
+
+# Số kỳ (tuần / tháng) mặc định của biểu đồ xu hướng
+TREND_PERIODS = 12
+
+def _period_start(day, period):
+    # Ngày đầu kỳ chứa day: thứ Hai của tuần, hoặc ngày 1 của tháng
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+def _previous_period_start(start, period):
+    if period == 'week':
+        return start - timedelta(weeks=1)
+    return (start - timedelta(days=1)).replace(day=1)
+
+def get_user_weekly_stats(firebase_user_id, weeks=TREND_PERIODS):
+    #Thống kê theo tuần (bắt đầu từ thứ Hai) của weeks tuần gần nhất, cũ nhất trước, kể cả tuần không có chẩn đoán
+    #Mỗi phần tử: period_start, total, healthy, diseased, avg_confidence (0-1), diseases {bệnh: số lần} (không gồm trạng thái khỏe mạnh)
+    return _get_user_period_stats(firebase_user_id, 'week', weeks)
+
+def get_user_monthly_stats(firebase_user_id, months=TREND_PERIODS):
+    #Thống kê theo tháng của months tháng gần nhất, cùng dạng với get_user_weekly_stats
+    return _get_user_period_stats(firebase_user_id, 'month', months)
+
+def _get_user_period_stats(firebase_user_id, period, periods):
+    # Ngày hiện tại nằm trong key cache: sang ngày mới thì cửa sổ các kỳ cũng dịch theo
+    today = datetime.now().date()
+    stats = user_query_cache.get_or_load(
+        firebase_user_id,
+        ('mysql.period_stats', period, periods, today),
+        lambda: _query_user_period_stats(firebase_user_id, period, periods, today)
+    )
+    return stats if stats is not None else []
+
+@timed("mysql.get_user_period_stats")
+def _query_user_period_stats(firebase_user_id, period, periods, today):
+    starts = [_period_start(today, period)]
+    for _ in range(periods - 1):
+        starts.append(_previous_period_start(starts[-1], period))
+    starts.reverse()
+    
+    connection = get_connection()
+    if not connection:
+        return None
+    
+    try:
+        cursor = connection.cursor()
+        
+        # Đọc theo khóa chính của user_daily_stats: số dòng tỉ lệ với số ngày có chẩn đoán, không phải số chẩn đoán
+        cursor.execute("""
+            SELECT date, disease_status, SUM(diagnosis_count), SUM(confidence_sum)
+            FROM user_daily_stats
+            WHERE firebase_user_id = %s AND date >= %s
+            GROUP BY date, disease_status
+        """, (firebase_user_id, starts[0]))
+        rows = cursor.fetchall()
+        
+    except Error as e:
+        print(f"Lỗi lấy thống kê theo kỳ: {e}")
+        return None
+    finally:
+        if connection:
+            cursor.close()
+            close_connection(connection)
+    
+    buckets = {
+        start: {'period_start': start, 'total': 0, 'healthy': 0, 'diseased': 0, 'confidence_sum': 0.0, 'diseases': {}}
+        for start in starts
+    }
+    for day, disease_status, count, confidence_sum in rows:
+        bucket = buckets.get(_period_start(day, period))
+        if bucket is None:
+            continue
+        count = int(count)
+        bucket['total'] += count
+        bucket['confidence_sum'] += float(confidence_sum)
+        if _is_healthy(disease_status):
+            bucket['healthy'] += count
+        else:
+            bucket['diseased'] += count
+            bucket['diseases'][disease_status] = bucket['diseases'].get(disease_status, 0) + count
+    
+    stats = []
+    for start in starts:
+        bucket = buckets[start]
+        confidence_sum = bucket.pop('confidence_sum')
+        bucket['avg_confidence'] = confidence_sum / bucket['total'] if bucket['total'] else 0.0
+        stats.append(bucket)
+    return stats
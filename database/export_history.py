@@ -0,0 +1,148 @@
+# database/export_history.py
+# Xuất lịch sử chẩn đoán ra CSV / Parquet theo kiểu streaming: đọc MySQL bằng cursor không buffer
+# (server-side, fetchmany từng chunk) và ghi nối tiếp từng chunk, bộ nhớ không tăng theo số dòng.
+import argparse
+import csv
+import os
+import sys
+import tempfile
+
+# Thêm parent directory vào path để import config
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mysql.connector
+from mysql.connector import Error
+from config.database import DB_CONFIG
+from config.metrics_hooks import timed
+
+EXPORT_COLUMNS = ("id", "firebase_user_id", "plant_type", "disease_status", "confidence", "created_at", "image_path")
+
+EXPORT_FORMATS = ("csv", "parquet")
+
+# Số dòng mỗi lần fetchmany (và mỗi row group Parquet)
+DEFAULT_CHUNK_SIZE = 5000
+
+# Người nhận chậm (vd. trình duyệt tải file) không được làm MySQL cắt kết nối giữa chừng
+NET_WRITE_TIMEOUT_SECONDS = 600
+
+
+def iter_diagnosis_chunks(firebase_user_id=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    #Sinh ra từng list tuple (theo EXPORT_COLUMNS), của một user hoặc toàn bảng, theo thứ tự id
+    # Kết nối riêng (không mượn từ pool): cursor không buffer giữ kết nối suốt quá trình xuất
+    connection = mysql.connector.connect(**DB_CONFIG)
+    cursor = None
+    try:
+        cursor = connection.cursor(buffered=False)
+        cursor.execute(f"SET SESSION net_write_timeout = {NET_WRITE_TIMEOUT_SECONDS}")
+        # Snapshot nhất quán: dòng ghi / xóa trong lúc xuất không làm file bị thiếu hay lặp
+        connection.start_transaction(consistent_snapshot=True, readonly=True)
+        
+        query = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM diagnoses"
+        params = ()
+        if firebase_user_id:
+            query += " WHERE firebase_user_id = %s"
+            params = (firebase_user_id,)
+        cursor.execute(query + " ORDER BY id", params)
+        
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+        
+        connection.commit()
+    finally:
+        # Generator bị bỏ dở: đóng kết nối là đủ, không cần đọc hết phần còn lại của kết quả
+        if cursor is not None:
+            try:
+                cursor.close()
+            except Error:
+                pass
+        connection.close()
+
+
+def _write_csv(path, chunks):
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_COLUMNS)
+        for rows in chunks:
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+def _write_parquet(path, chunks):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Xuất Parquet cần cài pyarrow: pip install pyarrow")
+    
+    schema = pa.schema([
+        ("id", pa.int64()),
+        ("firebase_user_id", pa.string()),
+        ("plant_type", pa.string()),
+        ("disease_status", pa.string()),
+        ("confidence", pa.float32()),
+        ("created_at", pa.timestamp("s")),
+        ("image_path", pa.string()),
+    ])
+    
+    count = 0
+    # Mỗi chunk là một row group: chỉ chunk hiện tại nằm trong bộ nhớ
+    with pq.ParquetWriter(path, schema, compression="snappy") as writer:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema
+            ))
+            count += len(rows)
+    return count
+
+
+@timed("mysql.export_diagnoses")
+def export_diagnoses(path, fmt="csv", firebase_user_id=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Xuất chẩn đoán (của một user, hoặc toàn bảng nếu firebase_user_id=None) ra file path.
+    Ghi vào file tạm rồi rename, trả về số dòng đã xuất; None nếu lỗi.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Định dạng không hỗ trợ: {fmt}")
+    
+    output_dir = os.path.dirname(path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    # File tạm tên ngẫu nhiên, quyền 0600: hai lần xuất cùng lúc không ghi đè lên nhau
+    fd, tmp_path = tempfile.mkstemp(dir=output_dir or ".", suffix=".tmp")
+    os.close(fd)
+    
+    try:
+        chunks = iter_diagnosis_chunks(firebase_user_id, chunk_size)
+        write = _write_csv if fmt == "csv" else _write_parquet
+        count = write(tmp_path, chunks)
+        os.replace(tmp_path, path)
+        return count
+    except (Error, OSError, RuntimeError) as e:
+        print(f"Lỗi xuất dữ liệu: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+
+
+if __name__ == "__main__":
+    # Admin: xuất toàn bộ bảng diagnoses (hoặc của một user) ra CSV / Parquet
+    parser = argparse.ArgumentParser(description="Xuất bảng diagnoses ra CSV / Parquet (streaming)")
+    parser.add_argument("output", help="File kết quả (.csv hoặc .parquet)")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, help="Định dạng (mặc định theo đuôi file)")
+    parser.add_argument("--user", help="Chỉ xuất lịch sử của một firebase_user_id")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Số dòng mỗi lần đọc")
+    args = parser.parse_args()
+    
+    fmt = args.format or ("parquet" if args.output.lower().endswith(".parquet") else "csv")
+    count = export_diagnoses(args.output, fmt=fmt, firebase_user_id=args.user, chunk_size=args.chunk_size)
+    if count is None:
+        sys.exit(1)
+    
+    print(f"Đã xuất {count} dòng vào {args.output}")
+    sys.exit(0)
@@ -4,13 +4,152 @@ Quản lý operations với Firestore Database
 """
 
 
+from collections import Counter
 from datetime import datetime
 from typing import Dict, List, Optional
 import streamlit as st
 from firebase_admin import firestore
 from config.firebase_config import get_firebase_db
+from config.metrics_hooks import timed
+from src.user_cache import user_query_cache
 
 
+# Firestore giới hạn 500 thao tác ghi cho một batch
+MAX_BATCH_WRITES = 500
+
+# Phiên bản các trường thống kê trên user document
+# (profile chưa có trường này được tính lại từ các diagnosis document một lần)
+AGGREGATES_VERSION = 1
+
+
+def _aggregate_delta(plant_type: str, disease: str, confidence: float, sign: int) -> Dict:
+    # Thay đổi thống kê của user khi thêm (sign=1) / xóa (sign=-1) một chẩn đoán, dùng với set(merge=True)
+    return {
+        'total_diagnoses': firestore.Increment(sign),
+        'confidence_sum': firestore.Increment(sign * float(confidence)),
+        'plant_counts': {plant_type: firestore.Increment(sign)},
+        'disease_counts': {disease: firestore.Increment(sign)}
+    }
+
+
+def _combined_delta(changes: List[tuple]) -> Dict:
+    # Gộp thay đổi thống kê của nhiều chẩn đoán (cùng user) thành một lần ghi
+    # changes: [(diagnosis data, +1 khi thêm / -1 khi xóa)]
+    plant_counts, disease_counts = Counter(), Counter()
+    for d, sign in changes:
+        plant_counts[d['plant_type']] += sign
+        disease_counts[d['disease']] += sign
+    return {
+        'total_diagnoses': firestore.Increment(sum(sign for _, sign in changes)),
+        'confidence_sum': firestore.Increment(sum(sign * float(d.get('confidence', 0)) for d, sign in changes)),
+        'plant_counts': {k: firestore.Increment(v) for k, v in plant_counts.items()},
+        'disease_counts': {k: firestore.Increment(v) for k, v in disease_counts.items()}
+    }
+
+
+def outbox_document_id(diagnosis_id: int) -> str:
+    # ID document cố định theo id MySQL: relay gửi lại cùng sự kiện không tạo bản sao
+    return f"mysql-{diagnosis_id}"
+
+
+def _most_common(counts: Dict) -> Optional[str]:
+    counts = {k: v for k, v in (counts or {}).items() if v > 0}
+    return max(counts, key=counts.get) if counts else None
+
+
+def _compute_aggregates(snapshots) -> Dict:
+    # Thống kê của user tính từ các diagnosis document (cùng các trường với user document)
+    plant_counts, disease_counts = Counter(), Counter()
+    confidence_sum = 0.0
+    for snapshot in snapshots:
+        data = snapshot.to_dict()
+        plant_counts[data.get('plant_type') or 'Unknown'] += 1
+        disease_counts[data.get('disease') or 'Unknown'] += 1
+        confidence_sum += float(data.get('confidence') or 0)
+    return {
+        'total_diagnoses': sum(plant_counts.values()),
+        'confidence_sum': confidence_sum,
+        'plant_counts': dict(plant_counts),
+        'disease_counts': dict(disease_counts),
+        'aggregates_version': AGGREGATES_VERSION
+    }
+
+
+@firestore.transactional
+def _backfill_aggregates_transaction(transaction, user_ref, diagnoses_query) -> Dict:
+    # Đọc user document trong transaction: save / delete đồng thời (cũng ghi user document)
+    # phải chờ transaction commit rồi mới increment, nên không bị ghi đè mất
+    user_ref.get(transaction=transaction)
+    aggregates = _compute_aggregates(transaction.get(diagnoses_query))
+    # merge theo danh sách trường: thay toàn bộ map, giữ nguyên các trường khác của profile
+    transaction.set(user_ref, aggregates, merge=list(aggregates))
+    return aggregates
+
+
+@firestore.transactional
+def _create_diagnosis_transaction(transaction, diagnosis_ref, user_ref, diagnosis_data: Dict) -> bool:
+    # Chỉ tạo document (và cộng thống kê) khi ID cố định chưa tồn tại -> ghi lại cùng job không cộng hai lần
+    if diagnosis_ref.get(transaction=transaction).exists:
+        return False
+    transaction.set(diagnosis_ref, diagnosis_data)
+    transaction.set(
+        user_ref,
+        _aggregate_delta(diagnosis_data['plant_type'], diagnosis_data['disease'], diagnosis_data['confidence'], 1),
+        merge=True
+    )
+    return True
+
+
+@firestore.transactional
+def _delete_diagnosis_transaction(transaction, diagnosis_ref, user_ref, user_id: str) -> bool:
+    # Đọc + kiểm tra ownership + xóa + trừ thống kê trong cùng một transaction
+    snapshot = diagnosis_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return False
+    diagnosis = snapshot.to_dict()
+    if diagnosis.get('user_id') != user_id:
+        return False
+
+    transaction.delete(diagnosis_ref)
+    transaction.set(
+        user_ref,
+        _aggregate_delta(diagnosis['plant_type'], diagnosis['disease'], diagnosis.get('confidence', 0), -1),
+        merge=True
+    )
+    return True
+
+
+@firestore.transactional
+def _apply_outbox_transaction(transaction, db, diagnoses_collection, users_collection, events: List[Dict]) -> int:
+    # Đọc trạng thái hiện tại của các document rồi chỉ ghi những sự kiện chưa được áp dụng
+    # (save: document chưa tồn tại, delete: document còn tồn tại) -> gửi lại nhiều lần vẫn đúng
+    refs = [diagnoses_collection.document(outbox_document_id(e['diagnosis_id'])) for e in events]
+    current = {s.id: (s.to_dict() if s.exists else None) for s in db.get_all(refs, transaction=transaction)}
+
+    changes: Dict[str, List[tuple]] = {}
+    for event, ref in zip(events, refs):
+        existing = current.get(ref.id)
+        if event['event_type'] == 'save' and existing is None:
+            payload = event['payload']
+            data = {
+                'user_id': event['user_id'],
+                'plant_type': payload['plant_type'],
+                'disease': payload['disease'],
+                'confidence': float(payload['confidence']),
+                'top3_predictions': payload.get('top3_predictions', []),
+                'image_url': None,
+                'timestamp': datetime.fromisoformat(payload['timestamp']),
+                'mysql_id': event['diagnosis_id']
+            }
+            transaction.set(ref, data)
+            changes.setdefault(event['user_id'], []).append((data, 1))
+        elif event['event_type'] == 'delete' and existing is not None:
+            transaction.delete(ref)
+            changes.setdefault(existing['user_id'], []).append((existing, -1))
+
+    for user_id, user_changes in changes.items():
+        transaction.set(users_collection.document(user_id), _combined_delta(user_changes), merge=True)
+    return len(events)
 
 
 class FirestoreManager:
@@ -29,6 +168,10 @@ class FirestoreManager:
                 'display_name': display_name or email.split('@')[0],
                 'created_at': datetime.now(),
                 'total_diagnoses': 0,
+                'confidence_sum': 0.0,
+                'plant_counts': {},
+                'disease_counts': {},
+                'aggregates_version': AGGREGATES_VERSION,
                 'last_login': datetime.now()
             }
            
@@ -59,6 +202,7 @@ class FirestoreManager:
     def update_last_login(self, user_id: str) -> bool:
         return self.update_user_profile(user_id, {'last_login': datetime.now()})
    
+    @timed("firestore.save_diagnosis")
     def save_diagnosis(
         self,
         user_id: str,
@@ -66,8 +210,10 @@ class FirestoreManager:
         disease: str,
         confidence: float,
         top3_predictions: List[Dict],
-        image_url: str = None
+        image_url: str = None,
+        document_id: str = None
     ) -> Optional[str]:
+        # document_id: ID cố định (khóa idempotency, vd. job id write-behind); đã tồn tại thì trả về ID đó, không ghi lại
         try:
             diagnosis_data = {
                 'user_id': user_id,
@@ -79,26 +225,131 @@ class FirestoreManager:
                 'timestamp': datetime.now()
             }
            
-            # Thêm vào collection
-            doc_ref = self.diagnoses_collection.add(diagnosis_data)
-            diagnosis_id = doc_ref[1].id
+            if document_id:
+                doc_ref = self.diagnoses_collection.document(document_id)
+                if _create_diagnosis_transaction(
+                    self.db.transaction(), doc_ref, self.users_collection.document(user_id), diagnosis_data
+                ):
+                    user_query_cache.bump(user_id)
+                return doc_ref.id
            
-            # Tăng counter trong user profile
-            self.users_collection.document(user_id).update({
-                'total_diagnoses': firestore.Increment(1)
-            })
+            # Thêm diagnosis + cập nhật thống kê user trong một batch (cùng thành công hoặc cùng thất bại)
+            doc_ref = self.diagnoses_collection.document()
+            batch = self.db.batch()
+            batch.set(doc_ref, diagnosis_data)
+            batch.set(
+                self.users_collection.document(user_id),
+                _aggregate_delta(plant_type, disease, confidence, 1),
+                merge=True
+            )
+            batch.commit()
+            user_query_cache.bump(user_id)
            
-            return diagnosis_id
+            return doc_ref.id
         except Exception as e:
             st.error(f"Error saving diagnosis: {str(e)}")
             return None
    
+    @timed("firestore.save_diagnoses_bulk")
+    def save_diagnoses_bulk(self, diagnoses: List[Dict]) -> List[Optional[str]]:
+        """
+        Lưu nhiều chẩn đoán (dùng cho nhập hàng loạt), mỗi dict có các key giống tham số của save_diagnosis.
+        Ghi theo batch tối đa MAX_BATCH_WRITES thao tác: mỗi chẩn đoán một document,
+        thống kê của mỗi user trong batch được gộp thành một lần ghi.
+        Trả về list cùng thứ tự với diagnoses: ID document đã lưu, hoặc None nếu batch chứa nó commit lỗi.
+        """
+        saved_ids: List[Optional[str]] = []
+        chunk: List[tuple] = []  # (doc_ref, data)
+        chunk_users = set()
+
+        def flush():
+            if not chunk:
+                return
+            batch = self.db.batch()
+            by_user: Dict[str, List[Dict]] = {}
+            for doc_ref, data in chunk:
+                batch.set(doc_ref, data)
+                by_user.setdefault(data['user_id'], []).append(data)
+            for user_id, user_diagnoses in by_user.items():
+                batch.set(
+                    self.users_collection.document(user_id),
+                    _combined_delta([(d, 1) for d in user_diagnoses]),
+                    merge=True
+                )
+            try:
+                batch.commit()
+                saved_ids.extend(doc_ref.id for doc_ref, _ in chunk)
+                user_query_cache.bump(*by_user)
+            except Exception as e:
+                print(f"Error saving diagnoses batch ({len(chunk)} documents): {str(e)}")
+                saved_ids.extend([None] * len(chunk))
+            chunk.clear()
+            chunk_users.clear()
+
+        for d in diagnoses:
+            # Số thao tác nếu thêm chẩn đoán này: các document + một lần ghi thống kê cho mỗi user
+            new_user = d['user_id'] not in chunk_users
+            if len(chunk) + len(chunk_users) + 1 + new_user > MAX_BATCH_WRITES:
+                flush()
+            chunk.append((
+                self.diagnoses_collection.document(),
+                {
+                    'user_id': d['user_id'],
+                    'plant_type': d['plant_type'],
+                    'disease': d['disease'],
+                    'confidence': float(d['confidence']),
+                    'top3_predictions': d.get('top3_predictions', []),
+                    'image_url': d.get('image_url'),
+                    'timestamp': d.get('timestamp') or datetime.now()
+                }
+            ))
+            chunk_users.add(d['user_id'])
+        flush()
+
+        return saved_ids
+   
+    @timed("firestore.apply_outbox_events")
+    def apply_outbox_events(self, events: List[Dict]) -> int:
+        """
+        Áp dụng sự kiện từ bảng diagnosis_outbox (MySQL) trong một transaction.
+        events: [{'diagnosis_id', 'user_id', 'event_type': 'save' | 'delete', 'payload'}], theo thứ tự id.
+        Dừng trước sự kiện thứ hai của cùng một chẩn đoán (một document chỉ ghi một lần mỗi transaction);
+        trả về số sự kiện đầu danh sách đã áp dụng. Lỗi được raise để relay thử lại.
+        """
+        seen = set()
+        for i, event in enumerate(events):
+            if event['diagnosis_id'] in seen:
+                events = events[:i]
+                break
+            seen.add(event['diagnosis_id'])
+        if not events:
+            return 0
+        applied = _apply_outbox_transaction(
+            self.db.transaction(),
+            self.db,
+            self.diagnoses_collection,
+            self.users_collection,
+            events
+        )
+        user_query_cache.bump(*{event['user_id'] for event in events})
+        return applied
+   
     def get_user_diagnoses(
         self,
         user_id: str,
         limit: int = 50,
         order_by: str = 'timestamp'
     ) -> List[Dict]:
+        #Cache tới khi user lưu / xóa chẩn đoán
+        diagnoses = user_query_cache.get_or_load(
+            user_id,
+            ('firestore.diagnoses', limit, order_by),
+            lambda: self._query_user_diagnoses(user_id, limit, order_by)
+        )
+        return diagnoses if diagnoses is not None else []
+
+    @timed("firestore.get_user_diagnoses")
+    def _query_user_diagnoses(self, user_id: str, limit: int, order_by: str) -> Optional[List[Dict]]:
         try:
             query = (
                 self.diagnoses_collection
@@ -118,7 +369,7 @@ class FirestoreManager:
             return diagnoses
         except Exception as e:
             st.error(f"Error getting diagnoses: {str(e)}")
-            return []
+            return None
    
     def get_diagnosis_by_id(self, diagnosis_id: str) -> Optional[Dict]:
         #Lấy diagnosis theo ID
@@ -133,58 +384,82 @@ class FirestoreManager:
             st.error(f"Error getting diagnosis: {str(e)}")
             return None
    
+    @timed("firestore.delete_diagnosis")
     def delete_diagnosis(self, diagnosis_id: str, user_id: str) -> bool:
         #Xóa diagnosis
         try:
-            # Kiểm tra ownership
-            diagnosis = self.get_diagnosis_by_id(diagnosis_id)
-            if not diagnosis or diagnosis['user_id'] != user_id:
+            deleted = _delete_diagnosis_transaction(
+                self.db.transaction(),
+                self.diagnoses_collection.document(diagnosis_id),
+                self.users_collection.document(user_id),
+                user_id
+            )
+            if deleted:
+                user_query_cache.bump(user_id)
+            else:
                 st.error("Unauthorized or diagnosis not found")
-                return False
-           
-            # Delete
-            self.diagnoses_collection.document(diagnosis_id).delete()
-           
-            # Giảm counter
-            self.users_collection.document(user_id).update({
-                'total_diagnoses': firestore.Increment(-1)
-            })
-           
-            return True
+            return deleted
         except Exception as e:
             st.error(f"Error deleting diagnosis: {str(e)}")
             return False
 
 
     def get_user_statistics(self, user_id: str) -> Dict:
-        #Lấy thống kê cho user
+        #Lấy thống kê cho user (cache tới khi user lưu / xóa chẩn đoán)
+        stats = user_query_cache.get_or_load(user_id, ('firestore.statistics',), lambda: self._query_user_statistics(user_id))
+        return stats if stats is not None else {}
+
+    @timed("firestore.get_user_statistics")
+    def _query_user_statistics(self, user_id: str) -> Optional[Dict]:
+        #Đọc một user document (các trường thống kê được cập nhật khi lưu / xóa)
         try:
-            # Lấy all diagnoses
-            diagnoses = self.get_user_diagnoses(user_id, limit=1000)
-           
-            if not diagnoses:
-                return {
-                    'total_diagnoses': 0,
-                    'most_common_plant': None,
-                    'most_common_disease': None,
-                    'avg_confidence': 0
-                }
+            doc = self.users_collection.document(user_id).get()
+            data = doc.to_dict() if doc.exists else {}
            
-            # Calculate statistics
-            plants = [d['plant_type'] for d in diagnoses]
-            diseases = [d['disease'] for d in diagnoses]
-            confidences = [d['confidence'] for d in diagnoses]
-          
-            # Most common
-            most_common_plant = max(set(plants), key=plants.count) if plants else None
-            most_common_disease = max(set(diseases), key=diseases.count) if diseases else None
+            if data.get('aggregates_version') != AGGREGATES_VERSION:
+                # Profile cũ chưa backfill: tính tạm từ các diagnosis document, không ghi
+                # (ghi đè thống kê chỉ chạy qua database/backfill_firestore_aggregates.py)
+                data = _compute_aggregates(self._user_diagnoses_query(user_id).stream())
            
+            total = data.get('total_diagnoses', 0)
             return {
-                'total_diagnoses': len(diagnoses),
-                'most_common_plant': most_common_plant,
-                'most_common_disease': most_common_disease,
-                'avg_confidence': sum(confidences) / len(confidences) if confidences else 0
+                'total_diagnoses': total,
+                'most_common_plant': _most_common(data.get('plant_counts')),
+                'most_common_disease': _most_common(data.get('disease_counts')),
+                'avg_confidence': data.get('confidence_sum', 0) / total if total > 0 else 0
             }
         except Exception as e:
             st.error(f"Error getting statistics: {str(e)}")
-            return {}
\ No newline at end of file
+            return None
+
+    def _user_diagnoses_query(self, user_id: str):
+        return (
+            self.diagnoses_collection
+            .where('user_id', '==', user_id)
+            .select(['plant_type', 'disease', 'confidence'])
+        )
+
+    def backfill_user_aggregates(self, user_id: str) -> Optional[Dict]:
+        #Tính lại thống kê của user từ toàn bộ diagnosis document và ghi đè lên user document (trong một transaction)
+        try:
+            aggregates = _backfill_aggregates_transaction(
+                self.db.transaction(),
+                self.users_collection.document(user_id),
+                self._user_diagnoses_query(user_id)
+            )
+            user_query_cache.bump(user_id)
+            return aggregates
+        except Exception as e:
+            st.error(f"Error backfilling statistics: {str(e)}")
+            return None
+
+    def backfill_all_user_aggregates(self, force: bool = False) -> int:
+        #Backfill cho mọi user chưa có thống kê (hoặc tất cả nếu force); trả về số user đã xử lý
+        processed = 0
+        for doc in self.users_collection.select(['aggregates_version']).stream():
+            if not force and (doc.to_dict() or {}).get('aggregates_version') == AGGREGATES_VERSION:
+                continue
+            if self.backfill_user_aggregates(doc.id) is not None:
+                processed += 1
+                print(f"  Đã backfill user {doc.id}")
+        return processed
@@ -8,6 +8,82 @@ import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config.database import DB_CONFIG
 
+# Điều kiện "khỏe mạnh" giống summarize_prediction / handle_diagnosis: nhãn lưu là "Khỏe mạnh"
+IS_HEALTHY_EXPRESSION = "(disease_status LIKE '%healthy%' OR disease_status LIKE '%khỏe mạnh%')"
+
+# Cột sinh tự động: biểu thức hiện tại phải chứa chuỗi này, nếu không thì chạy lại MODIFY COLUMN
+EXPRESSION_MARKERS = {
+    'is_healthy': 'khỏe mạnh',
+}
+
+# Migration cho database tạo từ schema cũ: CREATE TABLE IF NOT EXISTS không thêm cột / index mới
+# (bảng, loại 'column' | 'index' | 'expression', tên, câu lệnh ALTER)
+MIGRATIONS = [
+    ('diagnoses', 'column', 'is_healthy',
+     "ALTER TABLE diagnoses ADD COLUMN is_healthy TINYINT(1) "
+     f"AS {IS_HEALTHY_EXPRESSION} STORED AFTER prediction_json"),
+    # Phiên bản đầu của is_healthy chỉ so khớp 'healthy' (bỏ sót "Khỏe mạnh"); sau migration này
+    # cần chạy database/rebuild_statistics.py để tính lại bảng statistics
+    ('diagnoses', 'expression', 'is_healthy',
+     f"ALTER TABLE diagnoses MODIFY COLUMN is_healthy TINYINT(1) AS {IS_HEALTHY_EXPRESSION} STORED"),
+    ('diagnoses', 'index', 'idx_is_healthy_disease',
+     "ALTER TABLE diagnoses ADD INDEX idx_is_healthy_disease (is_healthy, disease_status)"),
+    ('diagnoses', 'index', 'idx_user_created_id',
+     "ALTER TABLE diagnoses ADD INDEX idx_user_created_id (firebase_user_id, created_at, id)"),
+    ('diagnoses', 'index', 'idx_user_confidence_id',
+     "ALTER TABLE diagnoses ADD INDEX idx_user_confidence_id (firebase_user_id, confidence, id)"),
+    ('diagnoses', 'index', 'idx_user_plant_created',
+     "ALTER TABLE diagnoses ADD INDEX idx_user_plant_created (firebase_user_id, plant_type, created_at, id)"),
+    ('diagnoses', 'index', 'idx_user_disease_created',
+     "ALTER TABLE diagnoses ADD INDEX idx_user_disease_created (firebase_user_id, disease_status, created_at, id)"),
+    ('diagnoses', 'index', 'idx_user_plant_confidence',
+     "ALTER TABLE diagnoses ADD INDEX idx_user_plant_confidence (firebase_user_id, plant_type, confidence, id)"),
+    ('diagnoses', 'index', 'idx_user_disease_confidence',
+     "ALTER TABLE diagnoses ADD INDEX idx_user_disease_confidence (firebase_user_id, disease_status, confidence, id)"),
+    ('diagnoses', 'column', 'prediction_blob',
+     "ALTER TABLE diagnoses ADD COLUMN prediction_blob VARBINARY(1024) DEFAULT NULL AFTER prediction_json"),
+    ('diagnoses', 'column', 'vocab_version',
+     "ALTER TABLE diagnoses ADD COLUMN vocab_version CHAR(16) DEFAULT NULL AFTER prediction_blob"),
+    ('diagnoses', 'column', 'request_key',
+     "ALTER TABLE diagnoses ADD COLUMN request_key VARCHAR(64) DEFAULT NULL AFTER vocab_version"),
+    ('diagnoses', 'index', 'uq_request_key',
+     "ALTER TABLE diagnoses ADD UNIQUE INDEX uq_request_key (request_key)"),
+]
+
+def _schema_object_exists(cursor, db_name, table, kind, name):
+    if kind == 'column':
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND COLUMN_NAME = %s
+        """, (db_name, table, name))
+    elif kind == 'expression':
+        cursor.execute("""
+            SELECT GENERATION_EXPRESSION FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND COLUMN_NAME = %s
+        """, (db_name, table, name))
+        row = cursor.fetchone()
+        expression = row[0] if row else None
+        if isinstance(expression, (bytes, bytearray)):
+            expression = expression.decode('utf-8')
+        return bool(expression) and EXPRESSION_MARKERS[name] in expression.lower()
+    else:
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND INDEX_NAME = %s
+        """, (db_name, table, name))
+    return cursor.fetchone()[0] > 0
+
+def migrate_database(cursor, db_name):
+    #Áp dụng các migration còn thiếu (chạy lại nhiều lần không sao)
+    applied = 0
+    for table, kind, name, statement in MIGRATIONS:
+        if _schema_object_exists(cursor, db_name, table, kind, name):
+            continue
+        print(f"  Migration: {'cập nhật' if kind == 'expression' else 'thêm'} {kind} {table}.{name}")
+        cursor.execute(statement)
+        applied += 1
+    return applied
+
 def init_database():
     #Khởi tạo database và các bảng tự động
     try:
@@ -44,6 +120,13 @@ def init_database():
                     print(f"  Lỗi ở câu lệnh {i}: {e}")
         
         connection.commit()
+        
+        # Nâng cấp bảng đã có từ phiên bản schema cũ
+        cursor.execute(f"USE {db_name}")
+        applied = migrate_database(cursor, db_name)
+        if applied:
+            print(f"Đã áp dụng {applied} migration")
+        
         print("\nDatabase đã được khởi tạo thành công!")
         print(f"Database: {db_name}")
         print("Các bảng đã tạo:")
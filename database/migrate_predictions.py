@@ -0,0 +1,22 @@
+# database/migrate_predictions.py
+import argparse
+import os
+import sys
+
+# Thêm parent directory vào path để import config
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.db_operations import migrate_prediction_json
+
+if __name__ == "__main__":
+    # Chuyển prediction_json (JSON) của các dòng cũ sang prediction_blob (float16), chạy sau init_db.py
+    parser = argparse.ArgumentParser(description="Chuyển prediction_json sang prediction_blob theo từng chunk")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Số dòng mỗi transaction")
+    args = parser.parse_args()
+    
+    result = migrate_prediction_json(chunk_size=args.chunk_size)
+    if result is None:
+        sys.exit(1)
+    
+    converted, skipped = result
+    print(f"\nHoàn tất: đã chuyển {converted} dòng, giữ JSON {skipped} dòng (lớp không khớp models/class_indices.json)")
+    sys.exit(0)
\ No newline at end of file
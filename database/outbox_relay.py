@@ -0,0 +1,333 @@
+# database/outbox_relay.py
+# Relay đọc bảng diagnosis_outbox (MySQL) và ghi sang Firestore theo batch.
+# Dòng outbox chỉ bị xóa sau khi Firestore đã commit (at-least-once); ID document cố định
+# theo id MySQL và Firestore bỏ qua sự kiện đã áp dụng, nên gửi lại không tạo bản sao.
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+# Thêm parent directory vào path để import config
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mysql.connector
+from mysql.connector import Error
+from config.database import DB_CONFIG, get_connection, close_connection
+from config.persistence import OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL_SECONDS, OUTBOX_MAX_ATTEMPTS
+from config.metrics_hooks import observe, register_gauge
+
+# Thời gian chờ tối đa (giây) giữa các lần thử khi Firestore lỗi liên tục
+MAX_BACKOFF_SECONDS = 60
+
+# Named lock (GET_LOCK) chọn một relay chính khi nhiều process cùng chạy relay
+RELAY_LOCK_NAME = "leafguard_outbox_relay"
+
+
+def _to_event(row):
+    # Dòng diagnosis_outbox -> sự kiện cho FirestoreManager.apply_outbox_events; payload hỏng thì raise ValueError
+    payload = json.loads(row['payload']) if row['payload'] else None
+    if row['event_type'] == 'save' and not isinstance(payload, dict):
+        raise ValueError("sự kiện save cần payload dạng object")
+    if row['event_type'] not in ('save', 'delete'):
+        raise ValueError(f"event_type không hợp lệ: {row['event_type']}")
+    return {
+        'diagnosis_id': row['diagnosis_id'],
+        'user_id': row['firebase_user_id'],
+        'event_type': row['event_type'],
+        'payload': payload
+    }
+
+
+class OutboxRelay:
+    """
+    Mỗi lần chạy: đọc tối đa batch_size dòng cũ nhất (SELECT thường, không khóa dòng), ghi sang Firestore
+    ngoài mọi transaction MySQL, rồi xóa các dòng đã gửi trong một transaction ngắn.
+    INSERT vào diagnosis_outbox (save_diagnosis / delete_diagnosis) không bao giờ phải chờ Firestore.
+    Chỉ relay giữ named lock RELAY_LOCK_NAME mới gửi (giữ đúng thứ tự khi nhiều process cùng chạy relay);
+    named lock không chặn INSERT / UPDATE trên bảng.
+    Lag (thời gian từ lúc ghi MySQL tới lúc Firestore commit) đưa vào metrics "outbox.lag".
+    Dòng đầu hàng đợi đã lỗi thì được gửi riêng; lỗi quá max_attempts lần (hoặc payload hỏng)
+    thì chuyển sang diagnosis_outbox_dead để các sự kiện sau không bị chặn.
+    """
+
+    def __init__(self, firestore, batch_size=OUTBOX_BATCH_SIZE, poll_interval=OUTBOX_POLL_INTERVAL_SECONDS,
+                 max_attempts=OUTBOX_MAX_ATTEMPTS):
+        self.firestore = firestore
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+
+        self.delivered = 0
+        self.failed_batches = 0
+        self.dead_lettered = 0
+        self.pending = 0
+        self.oldest_age_seconds = 0.0
+        self.is_leader = False
+        self._lock = threading.Lock()
+        # Kết nối riêng (ngoài pool) giữ named lock suốt thời gian làm relay chính;
+        # kết nối đứt thì MySQL tự nhả lock và relay khác nhận thay
+        self._lock_connection = None
+
+    def _hold_relay_lock(self):
+        #True nếu relay này đang giữ RELAY_LOCK_NAME (thử lấy nếu chưa có, không chờ)
+        if self._lock_connection is not None:
+            try:
+                self._lock_connection.ping(reconnect=False)
+                return True
+            except Error:
+                # Mất kết nối = mất lock
+                self._lock_connection = None
+        
+        try:
+            connection = mysql.connector.connect(**DB_CONFIG)
+            cursor = connection.cursor()
+            cursor.execute("SELECT GET_LOCK(%s, 0)", (RELAY_LOCK_NAME,))
+            acquired = cursor.fetchone()[0] == 1
+            cursor.close()
+        except Error as e:
+            print(f"Lỗi lấy lock relay outbox: {e}")
+            return False
+        
+        if acquired:
+            self._lock_connection = connection
+        else:
+            connection.close()
+        return acquired
+
+    def _read_batch(self):
+        # Đọc batch bằng consistent read (không khóa gì), commit ngay để không giữ snapshot / kết nối
+        connection = get_connection()
+        if not connection:
+            return None
+        try:
+            cursor = connection.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT id, diagnosis_id, firebase_user_id, event_type, payload, attempts,
+                       TIMESTAMPDIFF(MICROSECOND, created_at, NOW(3)) as lag_us
+                FROM diagnosis_outbox 
+                ORDER BY id 
+                LIMIT %s
+            """, (self.batch_size,))
+            rows = cursor.fetchall()
+            connection.commit()
+            return rows
+        except Error as e:
+            print(f"Lỗi đọc outbox: {e}")
+            connection.rollback()
+            return None
+        finally:
+            cursor.close()
+            close_connection(connection)
+
+    def _finish_batch(self, sent_ids, error=None, failed_ids=(), dead_ids=()):
+        # Transaction ngắn sau khi Firestore đã trả lời: xóa dòng đã gửi / ghi nhận lỗi, đọc backlog
+        # failed_ids: tăng attempts, đủ max_attempts thì chuyển sang dead-letter; dead_ids: chuyển ngay
+        connection = get_connection()
+        if not connection:
+            return None
+        try:
+            cursor = connection.cursor(dictionary=True)
+            if sent_ids:
+                placeholders = ", ".join(["%s"] * len(sent_ids))
+                cursor.execute(f"DELETE FROM diagnosis_outbox WHERE id IN ({placeholders})", list(sent_ids))
+            failed_ids = list(failed_ids) + list(dead_ids)
+            if error is not None and failed_ids:
+                cursor.executemany(
+                    "UPDATE diagnosis_outbox SET attempts = attempts + 1, last_error = %s WHERE id = %s",
+                    [(error[:500], row_id) for row_id in failed_ids]
+                )
+                placeholders = ", ".join(["%s"] * len(failed_ids))
+                cursor.execute(
+                    f"SELECT id FROM diagnosis_outbox WHERE id IN ({placeholders}) AND attempts >= %s",
+                    [*failed_ids, self.max_attempts]
+                )
+                dead = sorted({r['id'] for r in cursor.fetchall()} | set(dead_ids))
+                if dead:
+                    placeholders = ", ".join(["%s"] * len(dead))
+                    cursor.execute(f"""
+                        INSERT INTO diagnosis_outbox_dead
+                        (id, diagnosis_id, firebase_user_id, event_type, payload, attempts, last_error, created_at)
+                        SELECT id, diagnosis_id, firebase_user_id, event_type, payload, attempts, last_error, created_at
+                        FROM diagnosis_outbox WHERE id IN ({placeholders})
+                    """, dead)
+                    cursor.execute(f"DELETE FROM diagnosis_outbox WHERE id IN ({placeholders})", dead)
+                    with self._lock:
+                        self.dead_lettered += len(dead)
+                    print(f"Chuyển {len(dead)} sự kiện outbox sang diagnosis_outbox_dead: {error}")
+            
+            # Backlog còn lại (cho gauge leafguard_outbox)
+            cursor.execute("""
+                SELECT COUNT(*) as pending, TIMESTAMPDIFF(MICROSECOND, MIN(created_at), NOW(3)) as oldest_us
+                FROM diagnosis_outbox
+            """)
+            backlog = cursor.fetchone()
+            connection.commit()
+            return backlog
+        except Error as e:
+            print(f"Lỗi cập nhật outbox: {e}")
+            connection.rollback()
+            return None
+        finally:
+            cursor.close()
+            close_connection(connection)
+
+    def run_once(self):
+        #Gửi một batch; trả về số sự kiện đã xử lý (gửi xong hoặc chuyển dead-letter; 0 nếu relay khác
+        #đang giữ lock), None nếu lỗi
+        leader = self._hold_relay_lock()
+        with self._lock:
+            self.is_leader = leader
+        if not leader:
+            return 0
+        
+        rows = self._read_batch()
+        if rows is None:
+            return None
+        
+        # Dòng đầu đã từng lỗi: gửi riêng để lỗi lặp lại chỉ tính cho đúng dòng đó
+        if rows and rows[0]['attempts'] > 0:
+            rows = rows[:1]
+        
+        # Payload hỏng không bao giờ gửi được: chuyển ngay sang dead-letter, gửi các dòng còn lại
+        events, valid_rows, bad = [], [], []
+        for r in rows:
+            try:
+                events.append(_to_event(r))
+                valid_rows.append(r)
+            except (ValueError, TypeError) as e:
+                bad.append((r['id'], str(e)))
+        if bad:
+            backlog = self._finish_batch([], error=f"Payload không hợp lệ: {bad[0][1]}", dead_ids=[i for i, _ in bad])
+            if backlog is None:
+                return None
+        rows = valid_rows
+        
+        delivered = 0
+        if rows:
+            # Gọi Firestore khi không giữ kết nối / transaction MySQL nào
+            try:
+                delivered = self.firestore.apply_outbox_events(events)
+            except Exception as e:
+                # Giữ lại các dòng để gửi lại, ghi nhận lỗi cho việc kiểm tra
+                self._finish_batch([], error=str(e), failed_ids=[r['id'] for r in rows])
+                with self._lock:
+                    self.failed_batches += 1
+                print(f"Lỗi relay outbox sang Firestore: {e}")
+                return None
+        
+        # Xóa dòng lỗi thì lần sau gửi lại: Firestore bỏ qua sự kiện đã áp dụng
+        backlog = self._finish_batch([r['id'] for r in rows[:delivered]])
+        if backlog is None:
+            return None
+        
+        for r in rows[:delivered]:
+            observe("outbox.lag", (r['lag_us'] or 0) / 1e6)
+        with self._lock:
+            self.delivered += delivered
+            self.pending = backlog['pending']
+            self.oldest_age_seconds = (backlog['oldest_us'] or 0) / 1e6
+        return delivered + len(bad)
+
+    def requeue_dead(self):
+        #Đưa toàn bộ sự kiện dead-letter về lại diagnosis_outbox (attempts = 0), trả về số dòng, None nếu lỗi
+        connection = get_connection()
+        if not connection:
+            return None
+        try:
+            cursor = connection.cursor()
+            cursor.execute("""
+                INSERT INTO diagnosis_outbox
+                (id, diagnosis_id, firebase_user_id, event_type, payload, attempts, last_error, created_at)
+                SELECT id, diagnosis_id, firebase_user_id, event_type, payload, 0, last_error, created_at
+                FROM diagnosis_outbox_dead
+            """)
+            requeued = cursor.rowcount
+            cursor.execute("DELETE FROM diagnosis_outbox_dead")
+            connection.commit()
+            return requeued
+        except Error as e:
+            print(f"Lỗi đưa lại sự kiện dead-letter: {e}")
+            connection.rollback()
+            return None
+        finally:
+            cursor.close()
+            close_connection(connection)
+
+    def run_forever(self):
+        failures = 0
+        while True:
+            try:
+                delivered = self.run_once()
+            except Exception as e:
+                # Lỗi ngoài dự kiến không được làm chết thread relay (đồng bộ Firestore sẽ dừng hẳn)
+                print(f"Lỗi relay outbox: {e}")
+                delivered = None
+            if delivered is None:
+                failures += 1
+                time.sleep(min(self.poll_interval * 2 ** failures, MAX_BACKOFF_SECONDS))
+                continue
+            failures = 0
+            # Còn nguyên một batch đầy: chạy tiếp ngay để đuổi kịp backlog
+            if delivered < self.batch_size:
+                time.sleep(self.poll_interval)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': self.pending,
+                'oldest_age_seconds': self.oldest_age_seconds,
+                'delivered': self.delivered,
+                'failed_batches': self.failed_batches,
+                'dead_lettered': self.dead_lettered,
+                'is_leader': int(self.is_leader)
+            }
+
+
+_relay = None
+_relay_lock = threading.Lock()
+
+
+def start_outbox_relay(firestore):
+    #Chạy relay trong thread nền (chỉ một lần mỗi process)
+    global _relay
+    with _relay_lock:
+        if _relay is None:
+            _relay = OutboxRelay(firestore)
+            register_gauge("leafguard_outbox", "Firestore outbox backlog and delivery counters.", _relay.stats)
+            threading.Thread(target=_relay.run_forever, name="outbox-relay", daemon=True).start()
+    return _relay
+
+
+if __name__ == "__main__":
+    from database.firestore_manager import FirestoreManager
+    
+    parser = argparse.ArgumentParser(description="Đồng bộ bảng diagnosis_outbox (MySQL) sang Firestore")
+    parser.add_argument("--once", action="store_true", help="Gửi hết backlog rồi thoát")
+    parser.add_argument("--batch-size", type=int, default=OUTBOX_BATCH_SIZE)
+    parser.add_argument("--requeue-dead", action="store_true",
+                        help="Đưa các sự kiện trong diagnosis_outbox_dead về lại hàng đợi rồi thoát")
+    args = parser.parse_args()
+    
+    relay = OutboxRelay(FirestoreManager(), batch_size=args.batch_size)
+    if args.requeue_dead:
+        requeued = relay.requeue_dead()
+        if requeued is None:
+            sys.exit(1)
+        print(f"Đã đưa lại {requeued} sự kiện vào diagnosis_outbox")
+        sys.exit(0)
+    if args.once and not relay._hold_relay_lock():
+        print("Relay khác đang chạy (đang giữ lock), không gửi gì")
+        sys.exit(0)
+    if not args.once:
+        print("Outbox relay đang chạy (Ctrl+C để dừng)...")
+        relay.run_forever()
+    
+    while True:
+        delivered = relay.run_once()
+        if delivered is None:
+            sys.exit(1)
+        if delivered == 0:
+            break
+    print(f"Đã gửi {relay.delivered} sự kiện")
+    sys.exit(0)
\ No newline at end of file
@@ -0,0 +1,102 @@
+# database/prediction_codec.py
+# Mã hóa vector xác suất của một lần chẩn đoán thành mảng float16 theo thứ tự lớp cố định
+# (2 byte / lớp) thay vì JSON lặp lại tên lớp trên mỗi dòng.
+# Thứ tự lớp được định danh bằng "vocab version" (hash của danh sách tên lớp),
+# bảng class_vocabularies lưu danh sách tên lớp của từng version để giải mã về sau.
+import hashlib
+import json
+import threading
+from collections.abc import Mapping
+
+import numpy as np
+
+from config.inference import CLASS_INDICES_PATH
+
+# float16 little-endian, độ chính xác ~3 chữ số thập phân, đủ cho xác suất hiển thị
+PREDICTION_DTYPE = np.dtype('<f2')
+
+_vocabularies = {}  # version -> tuple tên lớp (đã biết trong process)
+_vocabularies_lock = threading.Lock()
+_current = None
+
+
+def vocabulary_version(class_names):
+    #Version = 16 ký tự hex đầu của sha256 danh sách tên lớp theo thứ tự
+    digest = hashlib.sha256("\n".join(class_names).encode('utf-8')).hexdigest()
+    return digest[:16]
+
+
+def register_vocabulary(class_names):
+    class_names = tuple(class_names)
+    version = vocabulary_version(class_names)
+    with _vocabularies_lock:
+        _vocabularies[version] = class_names
+    return version
+
+
+def current_vocabulary():
+    #(version, tên lớp) theo thứ tự index trong models/class_indices.json
+    global _current
+    if _current is None:
+        with open(CLASS_INDICES_PATH, encoding='utf-8') as f:
+            class_indices = json.load(f)
+        class_names = tuple(sorted(class_indices, key=class_indices.get))
+        _current = (register_vocabulary(class_names), class_names)
+    return _current
+
+
+def known_vocabulary(version):
+    with _vocabularies_lock:
+        return _vocabularies.get(version)
+
+
+def encode_predictions(predictions, class_names):
+    #dict {tên lớp: xác suất} -> bytes; None nếu các lớp không khớp vocabulary (giữ JSON)
+    if len(predictions) != len(class_names) or any(name not in predictions for name in class_names):
+        return None
+    values = np.array([float(predictions[name]) for name in class_names], dtype=PREDICTION_DTYPE)
+    return values.tobytes()
+
+
+def decode_predictions(blob, class_names):
+    values = np.frombuffer(blob, dtype=PREDICTION_DTYPE)
+    return {name: float(v) for name, v in zip(class_names, values)}
+
+
+class LazyPredictions(Mapping):
+    """
+    Dict {tên lớp: xác suất} chỉ giải mã khi được đọc lần đầu.
+    Dùng cho prediction_json trong kết quả truy vấn: danh sách không đọc tới thì không tốn chi phí.
+    resolve_vocabulary(version) -> tên lớp, gọi khi version chưa có trong process.
+    """
+
+    def __init__(self, blob, version, resolve_vocabulary=None):
+        self._blob = bytes(blob)
+        self._version = version
+        self._resolve = resolve_vocabulary
+        self._decoded = None
+
+    def _data(self):
+        if self._decoded is None:
+            class_names = known_vocabulary(self._version)
+            if class_names is None and self._resolve is not None:
+                class_names = self._resolve(self._version)
+                if class_names:
+                    register_vocabulary(class_names)
+            if class_names is None:
+                raise KeyError(f"Không tìm thấy class vocabulary {self._version}")
+            self._decoded = decode_predictions(self._blob, class_names)
+        return self._decoded
+
+    def __getitem__(self, key):
+        return self._data()[key]
+
+    def __iter__(self):
+        return iter(self._data())
+
+    def __len__(self):
+        return len(self._data())
+
+    def __repr__(self):
+        state = "decoded" if self._decoded is not None else f"{len(self._blob)} bytes"
+        return f"LazyPredictions({self._version}, {state})"
@@ -0,0 +1,22 @@
+# database/rebuild_statistics.py
+import argparse
+import os
+import sys
+from datetime import datetime
+
+# Thêm parent directory vào path để import config
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.db_operations import rebuild_statistics
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+if __name__ == "__main__":
+    # Tính lại bảng statistics và user_daily_stats từ bảng diagnoses (chạy một lần sau khi nâng cấp, hoặc khi số liệu bị lệch)
+    parser = argparse.ArgumentParser(description="Tính lại bảng statistics và user_daily_stats từ bảng diagnoses")
+    parser.add_argument("--from", dest="start_date", type=parse_date, help="Từ ngày (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end_date", type=parse_date, help="Đến ngày (YYYY-MM-DD)")
+    args = parser.parse_args()
+    
+    days = rebuild_statistics(args.start_date, args.end_date)
+    sys.exit(0 if days is not None else 1)
\ No newline at end of file
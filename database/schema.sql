@@ -15,12 +15,88 @@ CREATE TABLE IF NOT EXISTS diagnoses (
     disease_status VARCHAR(200) NOT NULL,
     confidence FLOAT NOT NULL,
     prediction_json JSON,
+    -- Vector xác suất dạng float16 theo thứ tự lớp của vocab_version (thay cho prediction_json)
+    prediction_blob VARBINARY(1024) DEFAULT NULL,
+    vocab_version CHAR(16) DEFAULT NULL,
+    -- Khóa idempotency của lần lưu (job id write-behind): ghi lại cùng job không tạo bản ghi thứ hai
+    request_key VARCHAR(64) DEFAULT NULL,
+    -- Cột sinh tự động từ disease_status, dùng cho thống kê thay vì LIKE (quét toàn bảng)
+    -- Cùng điều kiện với summarize_prediction: nhãn app lưu là "Khỏe mạnh"
+    is_healthy TINYINT(1) AS (disease_status LIKE '%healthy%' OR disease_status LIKE '%khỏe mạnh%') STORED,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     INDEX idx_firebase_user_id (firebase_user_id),
     INDEX idx_plant_type (plant_type),
     INDEX idx_disease_status (disease_status),
-    INDEX idx_created_at (created_at)
+    INDEX idx_created_at (created_at),
+    INDEX idx_is_healthy_disease (is_healthy, disease_status),
+    -- Phân trang lịch sử theo keyset (firebase_user_id, created_at, id)
+    INDEX idx_user_created_id (firebase_user_id, created_at, id),
+    -- Lịch sử sắp xếp theo độ tin cậy, và lọc theo loại cây / bệnh (sắp xếp theo thời gian)
+    INDEX idx_user_confidence_id (firebase_user_id, confidence, id),
+    INDEX idx_user_plant_created (firebase_user_id, plant_type, created_at, id),
+    INDEX idx_user_disease_created (firebase_user_id, disease_status, created_at, id),
+    -- Lọc theo loại cây / bệnh và sắp xếp theo độ tin cậy
+    INDEX idx_user_plant_confidence (firebase_user_id, plant_type, confidence, id),
+    INDEX idx_user_disease_confidence (firebase_user_id, disease_status, confidence, id),
+    UNIQUE INDEX uq_request_key (request_key)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Danh sách tên lớp (thứ tự index) của từng vocab_version, dùng để giải mã prediction_blob
+CREATE TABLE IF NOT EXISTS class_vocabularies (
+    version CHAR(16) PRIMARY KEY,
+    class_names JSON NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Outbox: sự kiện cần đồng bộ sang Firestore, ghi cùng transaction với diagnoses
+-- Relay (database/outbox_relay.py) xóa dòng sau khi Firestore đã ghi xong
+CREATE TABLE IF NOT EXISTS diagnosis_outbox (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    diagnosis_id INT NOT NULL,
+    firebase_user_id VARCHAR(128) NOT NULL,
+    event_type VARCHAR(20) NOT NULL,
+    payload JSON,
+    attempts INT DEFAULT 0,
+    last_error VARCHAR(500) DEFAULT NULL,
+    created_at TIMESTAMP(3) DEFAULT CURRENT_TIMESTAMP(3)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Sự kiện outbox lỗi quá OUTBOX_MAX_ATTEMPTS lần (hoặc payload hỏng): relay bỏ qua để hàng đợi tiếp tục chạy,
+-- đưa lại vào diagnosis_outbox bằng: python database/outbox_relay.py --requeue-dead
+CREATE TABLE IF NOT EXISTS diagnosis_outbox_dead (
+    id BIGINT PRIMARY KEY,
+    diagnosis_id INT NOT NULL,
+    firebase_user_id VARCHAR(128) NOT NULL,
+    event_type VARCHAR(20) NOT NULL,
+    payload JSON,
+    attempts INT DEFAULT 0,
+    last_error VARCHAR(500) DEFAULT NULL,
+    created_at TIMESTAMP(3) NULL,
+    dead_at TIMESTAMP(3) DEFAULT CURRENT_TIMESTAMP(3)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Kho ảnh theo nội dung (src/image_store.py): số chẩn đoán đang dùng mỗi blob,
+-- về 0 thì file được xóa
+CREATE TABLE IF NOT EXISTS image_blobs (
+    sha256 CHAR(64) PRIMARY KEY,
+    path VARCHAR(500) NOT NULL,
+    size_bytes INT NOT NULL,
+    ref_count INT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Thống kê theo user / ngày / loại cây / bệnh, cập nhật cùng transaction với diagnoses
+-- Biểu đồ xu hướng (trang Profile) đọc bảng này: O(số ngày) thay vì O(số chẩn đoán)
+CREATE TABLE IF NOT EXISTS user_daily_stats (
+    firebase_user_id VARCHAR(128) NOT NULL,
+    date DATE NOT NULL,
+    plant_type VARCHAR(100) NOT NULL,
+    disease_status VARCHAR(200) NOT NULL,
+    diagnosis_count INT NOT NULL DEFAULT 0,
+    confidence_sum DOUBLE NOT NULL DEFAULT 0,
+    PRIMARY KEY (firebase_user_id, date, plant_type, disease_status)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- Bảng thống kê
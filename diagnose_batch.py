@@ -0,0 +1,278 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+# Tắt log rác của TensorFlow (phải đặt trước khi import tensorflow)
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+
+from config.inference import MODEL_PATH, TFLITE_MODEL_PATH, CLASS_INDICES_PATH, INFERENCE_BACKEND
+from src.data_loader import IMAGE_EXTENSIONS
+from src.predictor import load_predictor
+from src.preprocessing import decode_image, preprocess_image, IMG_SIZE
+from src.utils import summarize_prediction
+from src.tta import needs_tta, apply_tta
+
+
+CSV_FIELDS = ['path', 'raw_label', 'plant_type', 'disease', 'confidence', 'is_healthy', 'status', 'top3_predictions', 'error',
+              'saved_db', 'saved_firestore']
+
+# Nơi lưu kết quả; mỗi dòng ghi saved_<store> = True / False cho nơi đã thử lưu
+STORES = ('db', 'firestore')
+
+
+def find_images(input_dir):
+    #Duyệt toàn bộ cây thư mục, trả về danh sách file ảnh theo thứ tự ổn định
+    paths = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for fname in sorted(files):
+            if fname.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, fname))
+    return paths
+
+
+def _saved_flag(value):
+    # saved_<store> đọc từ JSONL (bool) hoặc CSV (chuỗi); None = không thử lưu vào store đó
+    if value in (True, 'True'):
+        return True
+    if value in (False, 'False'):
+        return False
+    return None
+
+
+def load_done_paths(output_path, fmt):
+    """
+    Đọc file kết quả đã có để chạy tiếp (resume) từ chỗ dừng.
+    Trả về dict path -> tập store còn lưu lỗi (rỗng = xong). Một ảnh có thể có nhiều dòng
+    (lần chạy sau chỉ lưu lại vào store còn lỗi), dòng sau ghi đè trạng thái của dòng trước.
+    """
+    if not os.path.exists(output_path):
+        return {}
+    done = {}
+
+    def add(row):
+        pending = done.setdefault(row['path'], set())
+        for store in STORES:
+            flag = _saved_flag(row.get(f'saved_{store}'))
+            if flag is True:
+                pending.discard(store)
+            elif flag is False:
+                pending.add(store)
+
+    with open(output_path, 'r', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            for row in csv.DictReader(f):
+                add(row)
+        else:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    add(json.loads(line))
+                except (ValueError, KeyError):
+                    # Dòng cuối bị cắt ngang do dừng đột ngột -> xử lý lại ảnh đó
+                    continue
+    return done
+
+
+def load_and_preprocess(path):
+    # Chạy trong thread pool: decode JPEG (draft mode) + preprocess, PIL nhả GIL khi decode
+    try:
+        out = np.empty((IMG_SIZE, IMG_SIZE, 3), dtype=np.float32)
+        preprocess_image(decode_image(path), out=out)
+        return path, out, None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def iter_batches(paths, batch_size, workers):
+    #Decode song song, giữ tối đa vài batch trong bộ nhớ, trả về từng batch theo thứ tự
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        path_iter = iter(paths)
+        max_pending = batch_size * 2
+
+        def fill():
+            while len(pending) < max_pending:
+                path = next(path_iter, None)
+                if path is None:
+                    return
+                pending.append(executor.submit(load_and_preprocess, path))
+
+        fill()
+        while pending:
+            batch = []
+            while pending and len(batch) < batch_size:
+                batch.append(pending.popleft().result())
+                fill()
+            yield batch
+
+
+class ResultWriter:
+    #Ghi kết quả nối tiếp (append) để có thể resume
+
+    def __init__(self, output_path, fmt):
+        self.fmt = fmt
+        output_dir = os.path.dirname(output_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        is_new = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+        self.file = open(output_path, 'a', encoding='utf-8', newline='')
+        if fmt == 'csv':
+            self.writer = csv.DictWriter(self.file, fieldnames=CSV_FIELDS)
+            if is_new:
+                self.writer.writeheader()
+
+    def write(self, rows):
+        for row in rows:
+            if self.fmt == 'csv':
+                row = dict(row)
+                row['top3_predictions'] = json.dumps(row.get('top3_predictions', []), ensure_ascii=False)
+                self.writer.writerow({k: row.get(k) for k in CSV_FIELDS})
+            else:
+                self.file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        # Flush sau mỗi batch: dừng giữa chừng vẫn giữ được các batch đã xong
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chẩn đoán hàng loạt ảnh lá cây trong một thư mục")
+    parser.add_argument("input_dir", help="Thư mục ảnh (duyệt cả thư mục con)")
+    parser.add_argument("--output", default="diagnoses_batch.jsonl", help="File kết quả")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="Định dạng (mặc định theo đuôi file)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Số thread decode ảnh")
+    parser.add_argument("--backend", choices=["keras", "tflite"], default=INFERENCE_BACKEND)
+    parser.add_argument("--tta", action="store_true", help="Test-time augmentation cho dự đoán trong khoảng [LOW, HIGH)")
+    parser.add_argument("--save-db", action="store_true", help="Lưu kết quả vào bảng diagnoses (MySQL)")
+    parser.add_argument("--save-firestore", action="store_true", help="Lưu kết quả vào Firestore (cần --user-id)")
+    parser.add_argument("--user-id", help="firebase_user_id gán cho các bản ghi khi --save-db / --save-firestore")
+    parser.add_argument("--log-every", type=int, default=10, help="In tiến độ sau mỗi N batch")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ('csv' if args.output.lower().endswith('.csv') else 'jsonl')
+
+    if not os.path.isdir(args.input_dir):
+        print(f"LỖI: Không tìm thấy thư mục '{args.input_dir}'")
+        return 1
+
+    if args.save_firestore and not args.user_id:
+        print("LỖI: --save-firestore cần --user-id")
+        return 1
+
+    # Chỉ import database khi cần (config.database yêu cầu DB_PASSWORD)
+    save_diagnoses_bulk = None
+    if args.save_db:
+        from database.db_operations import save_diagnoses_bulk
+    firestore = None
+    if args.save_firestore:
+        from database.firestore_manager import FirestoreManager
+        firestore = FirestoreManager()
+
+    with open(CLASS_INDICES_PATH, encoding='utf-8') as f:
+        class_names = list(json.load(f).keys())
+
+    print(f"Đang load model (backend={args.backend})...")
+    predictor = load_predictor(args.backend, MODEL_PATH, TFLITE_MODEL_PATH)
+
+    all_paths = find_images(args.input_dir)
+    done = load_done_paths(args.output, fmt)
+    requested = {store for store, enabled in zip(STORES, (args.save_db, args.save_firestore)) if enabled}
+    # Ảnh mới: lưu vào mọi store được yêu cầu; ảnh đã có trong file: chỉ lưu lại vào store còn lỗi
+    # (store đã lưu xong không lưu lại, tránh bản ghi trùng)
+    stores_for = {p: (done[p] & requested if p in done else requested) for p in all_paths}
+    paths = [p for p in all_paths if p not in done or stores_for[p]]
+    print(f"Tìm thấy {len(all_paths)} ảnh, đã xử lý trước đó {len(all_paths) - len(paths)}, còn lại {len(paths)}")
+    if not paths:
+        return 0
+
+    writer = ResultWriter(args.output, fmt)
+    processed = failed = saved = saved_firestore = save_failed = 0
+    start = time.perf_counter()
+
+    try:
+        for batch_idx, batch in enumerate(iter_batches(paths, args.batch_size, args.workers), 1):
+            ok = [(path, arr) for path, arr, err in batch if err is None]
+            rows = [{'path': path, 'error': err} for path, arr, err in batch if err is not None]
+            failed += len(rows)
+
+            db_records = []
+            firestore_records = []
+            if ok:
+                preds = predictor(np.stack([arr for _, arr in ok]))
+                for (path, arr), p in zip(ok, preds):
+                    if args.tta and needs_tta(p):
+                        p = apply_tta(arr, p, predictor)
+                    result = summarize_prediction(p, class_names)
+                    row_idx = len(rows)
+                    rows.append({'path': path, **result})
+
+                    # Giống handle_diagnosis: không lưu kết quả dưới ngưỡng LOW
+                    if 'firestore' in stores_for[path] and result['status'] != 'low_confidence':
+                        firestore_records.append((row_idx, {
+                            'user_id': args.user_id,
+                            'plant_type': result['plant_type'],
+                            'disease': result['disease'],
+                            'confidence': result['confidence'],
+                            'top3_predictions': result['top3_predictions']
+                        }))
+                    if 'db' in stores_for[path] and result['status'] != 'low_confidence':
+                        db_records.append((row_idx, {
+                            'firebase_user_id': args.user_id,
+                            'image_path': path.replace("\\", "/"),
+                            'plant_type': result['plant_type'],
+                            'disease_status': result['disease'],
+                            'confidence': result['confidence'] / 100.0,
+                            'predictions': {class_names[i]: float(p[i]) for i in range(len(class_names))}
+                        }))
+
+            # Lưu trước rồi mới ghi file; mỗi dòng ghi kết quả lưu của từng store (saved_db / saved_firestore)
+            # để lần chạy tiếp theo (resume) chỉ lưu lại vào store còn lỗi
+            if db_records:
+                count = save_diagnoses_bulk([record for _, record in db_records])
+                saved += count
+                for row_idx, _ in db_records:
+                    rows[row_idx]['saved_db'] = bool(count)
+            if firestore_records:
+                doc_ids = firestore.save_diagnoses_bulk([record for _, record in firestore_records])
+                for (row_idx, _), doc_id in zip(firestore_records, doc_ids):
+                    rows[row_idx]['saved_firestore'] = doc_id is not None
+                    saved_firestore += doc_id is not None
+            save_failed += sum(1 for row in rows if False in (row.get('saved_db'), row.get('saved_firestore')))
+
+            writer.write(rows)
+            processed += len(batch)
+
+            if batch_idx % args.log_every == 0 or processed == len(paths):
+                elapsed = time.perf_counter() - start
+                print(f"  [{processed}/{len(paths)}] {processed / elapsed:.1f} ảnh/s, lỗi: {failed}")
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    print("\n" + "=" * 60)
+    print(f"Hoàn tất {processed} ảnh trong {elapsed:.1f}s ({processed / elapsed:.1f} ảnh/s)")
+    print(f"   - Lỗi đọc ảnh: {failed}")
+    if args.save_db:
+        print(f"   - Đã lưu vào MySQL: {saved}")
+    if args.save_firestore:
+        print(f"   - Đã lưu vào Firestore: {saved_firestore}")
+    if save_failed:
+        print(f"   - Lưu lỗi (saved_db / saved_firestore = False, chạy lại lệnh để thử lại): {save_failed}")
+    print(f"   - Kết quả: {args.output}")
+    print("=" * 60)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,46 @@
+import os
+import argparse
+# Tắt log rác của TensorFlow (phải đặt trước khi import tensorflow)
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+import tensorflow as tf
+
+
+from config.inference import MODEL_PATH, TFLITE_MODEL_PATH
+from src.data_loader import create_generators
+from src.model_exporter import create_calibration_generator, export_int8_tflite, compare_models
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export MobileNetV2_best.h5 sang TFLite INT8")
+    parser.add_argument("--model", default=MODEL_PATH, help="Model Keras nguồn (.h5)")
+    parser.add_argument("--output", default=TFLITE_MODEL_PATH, help="File .tflite đầu ra")
+    parser.add_argument("--dataset", default="dataset", help="Thư mục dataset (train/val/test)")
+    parser.add_argument("--calibration-samples", type=int, default=200,
+                        help="Số ảnh từ dataset/val dùng để calibrate")
+    parser.add_argument("--skip-eval", action="store_true", help="Bỏ qua đánh giá trên test set")
+    args = parser.parse_args()
+
+    print("--- EXPORT MODEL TFLITE INT8 ---")
+
+    if not os.path.exists(args.model):
+        print(f"LỖI: Không tìm thấy model '{args.model}'")
+        exit(1)
+
+    print(f"Đang load model từ: {args.model}")
+    model = tf.keras.models.load_model(args.model)
+
+    # 1. Quantize với calibration set lấy từ dataset/val
+    calibration_gen = create_calibration_generator(args.dataset)
+    export_int8_tflite(model, calibration_gen, args.output, args.calibration_samples)
+
+    # 2. Đánh giá accuracy, latency và kích thước so với model float32
+    if not args.skip_eval:
+        _, _, test_gen = create_generators(args.dataset)
+        class_names = list(test_gen.class_indices.keys())
+        output_dir = os.path.dirname(args.output) or "models"
+        compare_models(model, args.model, args.output, test_gen, class_names, output_dir=output_dir)
+
+    print("\n" + "=" * 60)
+    print("Đã export xong. Bật backend TFLite cho app bằng cách thêm vào .env:")
+    print("   INFERENCE_BACKEND=tflite")
+    print("=" * 60)
@@ -2,6 +2,7 @@ import streamlit as st
 import sys
 import os
 import pandas as pd
+import tempfile
 from datetime import datetime
 
 # Add src to path
@@ -9,8 +10,12 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from src.auth_manager import AuthManager
 from database.firestore_manager import FirestoreManager
-from database.db_operations import get_user_diagnoses as get_user_diagnoses_mysql, delete_diagnosis as delete_diagnosis_mysql
+from database.db_operations import get_user_diagnoses_page as get_user_diagnoses_page_mysql, delete_diagnosis as delete_diagnosis_mysql
+from database.db_operations import get_user_filter_options, _is_healthy
+from database.export_history import export_diagnoses
 from PIL import Image
+from src.image_store import ensure_thumbnail
+from src.user_cache import user_query_cache
 
 # Page config
 st.set_page_config(
@@ -34,37 +39,97 @@ if not auth_manager.is_logged_in():
 # Get current user
 user_id = auth_manager.get_current_user_id()
 
+# Số kết quả mỗi trang
+PAGE_SIZE = 25
+
+# Nhãn sắp xếp -> key của HISTORY_SORTS (sắp xếp và lọc chạy trong MySQL, có index)
+SORT_OPTIONS = {
+    "Mới nhất": 'newest',
+    "Cũ nhất": 'oldest',
+    "Độ tin cậy cao": 'confidence_desc',
+    "Độ tin cậy thấp": 'confidence_asc',
+}
+ALL_OPTION = "Tất cả"
+
+
+@st.cache_data(max_entries=1024, show_spinner=False)
+def load_thumbnail(image_path: str):
+    # Bytes thumbnail (ảnh cũ chưa có thì tạo lúc này); đường dẫn ảnh không đổi nên cache theo đường dẫn
+    thumb_path = ensure_thumbnail(image_path)
+    if thumb_path is None:
+        return None
+    with open(thumb_path, 'rb') as f:
+        return f.read()
+
+# Vị trí trang hiện tại (keyset): (cursor_key, direction, số trang); đổi user thì về trang đầu
+if st.session_state.get('history_user_id') != user_id:
+    st.session_state.history_user_id = user_id
+    st.session_state.history_page = (None, 'next', 1)
+    # File xuất của user trước (cùng tab trình duyệt) không được đưa cho user khác
+    st.session_state.pop('history_export', None)
+
 st.title("Lịch sử Chẩn đoán")
 st.caption("Xem lại tất cả kết quả chẩn đoán trước đây")
 
 st.divider()
 
-col1, col2, col3 = st.columns([2, 2, 1])
+# Truy vấn lịch sử / bộ lọc được cache theo user, chỉ chạy lại khi user lưu / xóa chẩn đoán
+filter_options = get_user_filter_options(user_id)
 
-with col1:
-    limit = st.selectbox(
-        "Số lượng hiển thị",
-        options=[10, 25, 50, 100],
-        index=1,
-        help="Số lượng kết quả hiển thị"
-    )
+col1, col2, col3, col4 = st.columns([2, 2, 2, 1])
 
-with col2:
+with col1:
     sort_by = st.selectbox(
         "Sắp xếp theo",
-        options=["Mới nhất", "Cũ nhất", "Độ tin cậy cao", "Độ tin cậy thấp"],
+        options=list(SORT_OPTIONS),
         help="Thứ tự sắp xếp"
     )
 
+with col2:
+    plant_filter = st.selectbox("Loại cây", options=[ALL_OPTION] + filter_options['plants'])
+
 with col3:
+    disease_filter = st.selectbox("Tình trạng", options=[ALL_OPTION] + filter_options['diseases'])
+
+with col4:
+    st.write("")
     if st.button("Làm mới", use_container_width=True):
+        user_query_cache.bump(user_id)
+        st.session_state.history_page = (None, 'next', 1)
         st.rerun()
 
+date_range = st.date_input("Khoảng thời gian", value=(), help="Để trống để xem tất cả")
+date_from = date_range[0] if len(date_range) > 0 else None
+date_to = date_range[1] if len(date_range) > 1 else date_from
+
+query_filters = {
+    'sort': SORT_OPTIONS[sort_by],
+    'plant_type': None if plant_filter == ALL_OPTION else plant_filter,
+    'disease_status': None if disease_filter == ALL_OPTION else disease_filter,
+    'date_from': date_from,
+    'date_to': date_to
+}
+
+# Đổi sắp xếp / bộ lọc thì cursor cũ không còn ý nghĩa: về trang đầu
+if st.session_state.get('history_filters') != query_filters:
+    st.session_state.history_filters = query_filters
+    st.session_state.history_page = (None, 'next', 1)
+
+cursor_key, direction, page_number = st.session_state.history_page
+
+st.markdown(f"**Trang {page_number}** ({PAGE_SIZE} kết quả / trang)")
+
 st.divider()
 with st.spinner("Đang tải lịch sử..."):
-    diagnoses_mysql = get_user_diagnoses_mysql(firebase_user_id=user_id, limit=limit)
+    page = get_user_diagnoses_page_mysql(
+        firebase_user_id=user_id,
+        page_size=PAGE_SIZE,
+        cursor_key=cursor_key,
+        direction=direction,
+        **query_filters
+    )
     diagnoses = []
-    for d in diagnoses_mysql:
+    for d in page['items']:
         diagnoses.append({
             'id': d.get('id'),
             'plant_type': d.get('plant_type', ''),
@@ -75,6 +140,16 @@ with st.spinner("Đang tải lịch sử..."):
             'top3_predictions': []
         })
 
+if not diagnoses and cursor_key is not None:
+    # Trang hiện tại không còn bản ghi (vd. vừa xóa hết): quay về trang đầu
+    st.session_state.history_page = (None, 'next', 1)
+    st.rerun()
+
+has_filters = any(query_filters[k] for k in ('plant_type', 'disease_status', 'date_from'))
+if not diagnoses and has_filters:
+    st.info("Không có kết quả nào khớp với bộ lọc.")
+    st.stop()
+
 if not diagnoses:
     st.info("""
     Bạn chưa có lịch sử chẩn đoán nào.
@@ -87,12 +162,13 @@ if not diagnoses:
     
     st.stop()
 
-st.subheader(f"Tổng quan ({len(diagnoses)} kết quả)")
+st.subheader(f"Tổng quan trang {page_number} ({len(diagnoses)} kết quả)")
 
 col1, col2, col3, col4 = st.columns(4)
 
 with col1:
-    healthy_count = sum(1 for d in diagnoses if 'healthy' in d['disease'].lower())
+    # Cùng điều kiện với cột is_healthy / thống kê (nhãn app lưu là "Khỏe mạnh", không chứa 'healthy')
+    healthy_count = sum(1 for d in diagnoses if _is_healthy(d['disease']))
     st.metric("Khỏe mạnh", healthy_count)
 
 with col2:
@@ -121,7 +197,7 @@ with tab1:
             
             with col1:
                 # Status indicator
-                if 'healthy' in diagnosis['disease'].lower():
+                if _is_healthy(diagnosis['disease']):
                     st.markdown("### ✓")
                 else:
                     st.markdown("### ✗")
@@ -130,16 +206,17 @@ with tab1:
                 st.markdown(f"**{diagnosis['plant_type']}**")
                 st.caption(f"Bệnh: {diagnosis['disease']}")
                 
-                # Hiển thị ảnh nếu có
+                # Hiển thị thumbnail nếu có (ảnh gốc chỉ tải khi mở "Chi tiết")
                 image_path = diagnosis.get('image_path')
-                if image_path and os.path.exists(image_path):
+                if image_path:
                     try:
-                        img = Image.open(image_path)
-                        st.image(img, caption="Ảnh đã chẩn đoán", use_container_width=True, width=200)
+                        thumbnail = load_thumbnail(image_path)
+                        if thumbnail is not None:
+                            st.image(thumbnail, caption="Ảnh đã chẩn đoán", width=200)
+                        else:
+                            st.caption(f"⚠️ Ảnh không tìm thấy: {image_path}")
                     except Exception as e:
                         st.caption(f"⚠️ Không thể tải ảnh: {str(e)}")
-                elif image_path:
-                    st.caption(f"⚠️ Ảnh không tìm thấy: {image_path}")
             
             with col3:
                 # Timestamp
@@ -163,6 +240,14 @@ with tab1:
                     for pred in diagnosis.get('top3_predictions', []):
                         st.write(f"- {pred['label']}: {pred['confidence']:.2f}%")
                     
+                    # Nội dung expander luôn được chạy, nên ảnh gốc chỉ đọc khi người dùng bật xem
+                    image_path = diagnosis.get('image_path')
+                    if image_path and st.toggle("Xem ảnh gốc", key=f"full_image_{diagnosis['id']}"):
+                        if os.path.exists(image_path):
+                            st.image(Image.open(image_path), use_container_width=True)
+                        else:
+                            st.caption(f"⚠️ Ảnh không tìm thấy: {image_path}")
+                    
                     # Delete button
                     if st.button(f"Xóa", key=f"delete_{diagnosis['id']}"):
                         if delete_diagnosis_mysql(diagnosis['id'], user_id):
@@ -200,15 +285,61 @@ with tab2:
         hide_index=True
     )
     
-    # Export button
-    csv = df.to_csv(index=False).encode('utf-8')
-    st.download_button(
-        label="Tải xuống CSV",
-        data=csv,
-        file_name=f"leafguard_history_{datetime.now().strftime('%Y%m%d')}.csv",
-        mime="text/csv",
-        use_container_width=True
-    )
+    # Xuất toàn bộ lịch sử (không chỉ trang hiện tại): đọc MySQL từng chunk và ghi thẳng ra file tạm
+    export_col1, export_col2 = st.columns([1, 2])
+    with export_col1:
+        export_format = st.selectbox("Định dạng", options=["csv", "parquet"], label_visibility="collapsed")
+    with export_col2:
+        if st.button("Xuất toàn bộ lịch sử", use_container_width=True):
+            st.session_state.pop('history_export', None)
+            # Tên file ngẫu nhiên, chỉ chủ process đọc được (mkstemp: quyền 0600); xóa ngay sau khi đọc
+            fd, export_path = tempfile.mkstemp(prefix="leafguard_history_", suffix=f".{export_format}")
+            os.close(fd)
+            exported = None
+            try:
+                with st.spinner("Đang xuất dữ liệu..."):
+                    exported = export_diagnoses(export_path, fmt=export_format, firebase_user_id=user_id)
+                if exported is not None:
+                    with open(export_path, 'rb') as f:
+                        st.session_state.history_export = {
+                            'user_id': user_id,
+                            'format': export_format,
+                            'count': exported,
+                            'data': f.read()
+                        }
+            finally:
+                if os.path.exists(export_path):
+                    os.remove(export_path)
+            if exported is None:
+                st.error("Không thể xuất lịch sử")
+    
+    # Bytes chỉ nằm trong session_state cho tới lần render download_button (nút giữ bản của riêng nó
+    # trong lần chạy này); lấy ra ngay để file xuất không bị giữ trong session suốt phiên làm việc
+    history_export = st.session_state.pop('history_export', None)
+    if history_export and history_export['user_id'] == user_id:
+        st.download_button(
+            label=f"Tải xuống {history_export['format'].upper()} ({history_export['count']} kết quả)",
+            data=history_export['data'],
+            file_name=f"leafguard_history_{datetime.now().strftime('%Y%m%d')}.{history_export['format']}",
+            mime="text/csv" if history_export['format'] == "csv" else "application/octet-stream",
+            use_container_width=True
+        )
+
+# Điều hướng trang
+col_prev, col_page, col_next = st.columns([1, 2, 1])
+
+with col_prev:
+    if st.button("← Trang trước", disabled=not page['has_prev'], use_container_width=True):
+        st.session_state.history_page = (page['prev_key'], 'prev', max(page_number - 1, 1))
+        st.rerun()
+
+with col_page:
+    st.markdown(f"<div style='text-align: center'>Trang {page_number}</div>", unsafe_allow_html=True)
+
+with col_next:
+    if st.button("Trang sau →", disabled=not page['has_next'], use_container_width=True):
+        st.session_state.history_page = (page['next_key'], 'next', page_number + 1)
+        st.rerun()
 
 st.divider()
 
@@ -1,12 +1,14 @@
 import streamlit as st
 import sys
 import os
+import pandas as pd
 
 # Add src to path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from src.auth_manager import AuthManager
 from database.firestore_manager import FirestoreManager
+from database.db_operations import get_user_weekly_stats, get_user_monthly_stats
 
 # Page config
 st.set_page_config(
@@ -105,6 +107,45 @@ if stats.get('most_common_disease'):
 
 st.divider()
 
+st.subheader("Xu hướng")
+
+# Đọc từ bảng tổng hợp user_daily_stats (theo ngày), không quét toàn bộ lịch sử
+trend_period = st.radio("Theo", options=["Tuần", "Tháng"], horizontal=True, label_visibility="collapsed")
+if trend_period == "Tuần":
+    trend = get_user_weekly_stats(user_id)
+    period_format = '%d/%m'
+else:
+    trend = get_user_monthly_stats(user_id)
+    period_format = '%m/%Y'
+
+if not any(row['total'] for row in trend):
+    st.caption("Chưa có dữ liệu trong khoảng thời gian này")
+else:
+    periods = [row['period_start'].strftime(period_format) for row in trend]
+    
+    st.markdown("**Số lần chẩn đoán**")
+    counts_df = pd.DataFrame({
+        'Khỏe mạnh': [row['healthy'] for row in trend],
+        'Có bệnh': [row['diseased'] for row in trend]
+    }, index=pd.Index(periods, name='Kỳ'))
+    st.bar_chart(counts_df)
+    
+    st.markdown("**Độ tin cậy trung bình (%)**")
+    confidence_df = pd.DataFrame({
+        'Độ tin cậy': [row['avg_confidence'] * 100 if row['total'] else None for row in trend]
+    }, index=pd.Index(periods, name='Kỳ'))
+    st.line_chart(confidence_df)
+    
+    diseases_df = pd.DataFrame(
+        [row['diseases'] for row in trend],
+        index=pd.Index(periods, name='Kỳ')
+    ).fillna(0)
+    if not diseases_df.empty:
+        st.markdown("**Bệnh phát hiện theo kỳ**")
+        st.bar_chart(diseases_df)
+
+st.divider()
+
 st.subheader("Chỉnh sửa thông tin")
 
 with st.form("edit_profile_form"):
@@ -0,0 +1,33 @@
+import sys
+import argparse
+
+from src.image_store import scan_savings
+
+
+def format_size(num_bytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024 or unit == "GB":
+            return f"{num_bytes:.1f} {unit}" if unit != "B" else f"{num_bytes} B"
+        num_bytes /= 1024
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ước tính dung lượng tiết kiệm khi lưu ảnh theo nội dung (dedup)")
+    parser.add_argument("root", nargs="?", default="uploads/diagnoses", help="Thư mục ảnh cũ cần quét")
+    args = parser.parse_args(argv)
+
+    print(f"Đang quét {args.root}...")
+    report = scan_savings(args.root)
+
+    print("\n" + "=" * 60)
+    print(f"   - Số file ảnh: {report['files']} ({format_size(report['bytes'])})")
+    print(f"   - Nội dung khác nhau: {report['unique_files']} ({format_size(report['unique_bytes'])})")
+    print(f"   - Tiết kiệm nhờ dedup: {format_size(report['saved_bytes'])} ({report['saved_ratio'] * 100:.1f}%)")
+    print("=" * 60)
+    print("Lưu ý: ảnh cũ đã được encode lại JPEG quality 95, nên con số chỉ phản ánh phần trùng lặp;")
+    print("kho mới lưu bytes gốc nên không còn bước encode lại.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
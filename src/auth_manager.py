@@ -129,6 +129,8 @@ class AuthManager:
         st.session_state.user = None
         st.session_state.user_id = None
         st.session_state.user_email = None
+        # Dữ liệu đã tải của user (vd. file xuất lịch sử) không được để lại cho người dùng sau trên cùng tab
+        st.session_state.pop('history_export', None)
         st.success("Đã đăng xuất thành công")
    
     def reset_password(self, email: str) -> tuple[bool, str]:
@@ -1,6 +1,7 @@
 # camera_input.py
 import streamlit as st
-from PIL import Image
+from src.preprocessing import decode_image
+from src.metrics import span
 
 
 def get_image_input():
@@ -26,7 +27,8 @@ def get_image_input():
             help="Kéo thả file vào đây hoặc click để chọn"
         )
         if uploaded_file is not None:
-            image = Image.open(uploaded_file).convert("RGB")
+            with span("decode"):
+                image = decode_image(uploaded_file)
 
 
     elif source == "Chụp từ camera":
@@ -37,7 +39,8 @@ def get_image_input():
             help="Đặt lá cây vào khung và chụp ảnh. Đảm bảo ánh sáng đủ và lá cây rõ nét."
         )
         if camera_file is not None:
-            image = Image.open(camera_file).convert("RGB")
+            with span("decode"):
+                image = decode_image(camera_file)
             uploaded_file = camera_file  # Camera input cũng là file object
 
 
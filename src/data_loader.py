@@ -17,6 +17,7 @@ except ImportError:
 
 IMG_SIZE = 224
 BATCH_SIZE = 32
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.jfif')
 
  
 def _find_dataset_root(candidate):
@@ -98,6 +99,26 @@ def create_generators(dataset_dir="dataset"):
     return train_gen, val_gen, test_gen
 
 
+def list_labeled_images(dataset_dir="dataset", split="test"):
+    """
+    Liệt kê ảnh của một split kèm nhãn, theo đúng thứ tự class của flow_from_directory
+
+    Returns:
+        tuple: (danh sách (đường dẫn, class_index), danh sách tên class)
+    """
+    dataset_root = _find_dataset_root(dataset_dir)
+    split_dir = os.path.join(dataset_root, split)
+    class_names = sorted(d for d in os.listdir(split_dir) if os.path.isdir(os.path.join(split_dir, d)))
+
+    samples = []
+    for class_idx, class_name in enumerate(class_names):
+        class_dir = os.path.join(split_dir, class_name)
+        for fname in sorted(os.listdir(class_dir)):
+            if fname.lower().endswith(IMAGE_EXTENSIONS):
+                samples.append((os.path.join(class_dir, fname), class_idx))
+    return samples, class_names
+
+
 def get_class_weights_for_training(train_gen, dataset_dir="dataset"):
     """
     Tính toán và trả về class weights để dùng trong model.fit()
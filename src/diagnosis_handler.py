@@ -1,14 +1,40 @@
+import io
 import os
 import streamlit as st
 import numpy as np
 from PIL import Image
 from src.auth_manager import AuthManager
 from database.firestore_manager import FirestoreManager
-from src.utils import save_diagnosis_image, process_label, get_plant_type_from_label
-from database.db_operations import save_diagnosis as save_diagnosis_mysql, update_statistics
+from src.utils import (
+    save_diagnosis_image,
+    process_label,
+    get_top3_predictions,
+    CONFIDENCE_THRESHOLD_LOW,
+    CONFIDENCE_THRESHOLD_HIGH
+)
+from database.db_operations import save_diagnosis as save_diagnosis_mysql
+from config.persistence import OUTBOX_ENABLED
+from src.metrics import span, timed
+
+
+# Read original uploaded bytes (UploadedFile hoặc file-like object)
+def _read_file_bytes(file, image: Image.Image) -> bytes:
+    if hasattr(file, 'getvalue'):
+        return file.getvalue()
+    if hasattr(file, 'read'):
+        if hasattr(file, 'seek'):
+            file.seek(0)
+        data = file.read()
+        if data:
+            return data
+    # Không đọc được bytes gốc: encode lại ảnh
+    buf = io.BytesIO()
+    image.save(buf, format='JPEG', quality=95)
+    return buf.getvalue()
 
 
 # Handle diagnosis
+@timed("handle_diagnosis")
 def handle_diagnosis(
     image: Image.Image,
     file,
@@ -16,11 +42,9 @@ def handle_diagnosis(
     class_names: list,
     auth_manager: AuthManager,
     firestore: FirestoreManager,
-    silent: bool = False  # If True, don't display messages, just return result
+    silent: bool = False,  # If True, don't display messages, just return result
+    persistence_queue=None  # WriteBehindQueue: nếu có, việc lưu trữ chạy nền thay vì chạy đồng bộ
 ):
-    CONFIDENCE_THRESHOLD_LOW = 40.0
-    CONFIDENCE_THRESHOLD_HIGH = 60.0
-   
     class_idx = np.argmax(preds)
     confidence = float(preds[class_idx] * 100)
     raw_label = class_names[class_idx]
@@ -46,42 +70,34 @@ def handle_diagnosis(
     # Create dictionary predictions for all classes
     predictions_dict = {class_names[i]: float(preds[i]) for i in range(len(class_names))}
    
-    top_plant_type = get_plant_type_from_label(raw_label)
-   
-    filtered_predictions = []
-    for i, class_name in enumerate(class_names):
-        plant_type = get_plant_type_from_label(class_name)
-        conf = preds[i] * 100
-        if plant_type == top_plant_type and conf >= 40.0:
-            filtered_predictions.append((i, class_name, conf))
-   
-    filtered_predictions.sort(key=lambda x: x[2], reverse=True)
-    top3_filtered = filtered_predictions[:3]
-   
-    if len(top3_filtered) == 0:
-        same_plant_predictions = [(i, class_names[i], preds[i] * 100)
-                                  for i in range(len(class_names))
-                                  if get_plant_type_from_label(class_names[i]) == top_plant_type]
-        same_plant_predictions.sort(key=lambda x: x[2], reverse=True)
-        top3_filtered = same_plant_predictions[:3]
-   
-    top3_predictions = []
-    for idx, class_name, conf in top3_filtered:
-        plant_name_vn, disease_name_vn = process_label(class_name)
-        lbl = f"{plant_name_vn} - {disease_name_vn}"
-        top3_predictions.append({
-            'label': lbl,
-            'confidence': float(conf)
-        })
+    top3_predictions = get_top3_predictions(preds, class_names, raw_label)
        
-    if auth_manager.is_logged_in():
+    if auth_manager.is_logged_in() and persistence_queue is not None:
+        # Write-behind: chỉ ghi job + bytes ảnh gốc vào spool, lưu ảnh / Firestore / MySQL chạy nền
+        with span("write_behind_enqueue"):
+            persistence_queue.enqueue(
+                payload={
+                    'user_id': auth_manager.get_current_user_id(),
+                    'filename': file.name,
+                    'plant_type': plant_name,
+                    'disease': disease_name,
+                    'confidence': float(confidence),
+                    'top3_predictions': top3_predictions,
+                    'predictions': predictions_dict
+                },
+                blob=_read_file_bytes(file, image)
+            )
+    elif auth_manager.is_logged_in():
         user_id = auth_manager.get_current_user_id()
        
         # Save image to directory
-        image_path = save_diagnosis_image(image, user_id, file.name)
+        with span("save_diagnosis_image"):
+            image_path = save_diagnosis_image(image, user_id, file.name, data=_read_file_bytes(file, image))
        
-        # Lưu vào Firestore
-        if not silent:
+        # Lưu vào Firestore (khi bật outbox, relay đồng bộ từ MySQL sang Firestore)
+        if OUTBOX_ENABLED:
+            pass
+        elif not silent:
             with st.spinner("Đang lưu kết quả vào lịch sử..."):
                 try:
                     diagnosis_id_firestore = firestore.save_diagnosis(
@@ -105,20 +121,17 @@ def handle_diagnosis(
             except Exception as e:
                 pass  # Silent mode
        
-        # Save to MySQL (with image path)
+        # Save to MySQL (with image path); bảng statistics được cập nhật trong cùng transaction
         try:
-            diagnosis_id_mysql = save_diagnosis_mysql(
+            save_diagnosis_mysql(
                 plant_type=plant_name,
                 disease_status=disease_name,
                 confidence=float(confidence / 100.0),  # Convert to Python float
                 predictions=predictions_dict,
                 firebase_user_id=user_id,
-                image_path=image_path
+                image_path=image_path,
+                top3_predictions=top3_predictions
             )
-           
-            if diagnosis_id_mysql:
-                # Cập nhật thống kê
-                update_statistics()
         except Exception as e:
             if not silent:
                 st.warning(f"MySQL database error: {str(e)}")
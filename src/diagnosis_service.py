@@ -0,0 +1,171 @@
+"""
+Diagnosis Service Module
+Pipeline chẩn đoán không phụ thuộc Streamlit (dùng cho HTTP API):
+decode -> preprocess -> inference -> xử lý nhãn/top 3 -> lưu trữ (tùy chọn)
+"""
+
+
+import io
+import json
+from typing import List, Optional
+
+import numpy as np
+
+from config.inference import (
+    MODEL_PATH,
+    TFLITE_MODEL_PATH,
+    CLASS_INDICES_PATH,
+    INFERENCE_BACKEND,
+    INFERENCE_MAX_BATCH_SIZE,
+    INFERENCE_MAX_WAIT_MS,
+    INFERENCE_TIMEOUT_SECONDS,
+    INFERENCE_WARMUP,
+    TTA_ENABLED
+)
+from config.persistence import OUTBOX_ENABLED, OUTBOX_RELAY_IN_PROCESS
+from src.inference_engine import InferenceEngine
+from src.predictor import load_predictor, warmup_batch_sizes, BackgroundPredictor
+from src.preprocessing import decode_image, preprocess_image, IMG_SIZE
+from src.utils import summarize_prediction, save_diagnosis_image
+from src.tta import needs_tta, apply_tta
+from src.metrics import span
+
+
+STORAGE_OPTIONS = ("none", "mysql", "firestore", "both")
+
+
+class DiagnosisService:
+    """
+    Một instance cho mỗi process: giữ một model duy nhất và một InferenceEngine
+    để các request đồng thời được gộp batch giống app Streamlit.
+
+    storage='none' không ghi gì ra ngoài (dùng cho load test local).
+    """
+
+    def __init__(self, backend: str = INFERENCE_BACKEND, storage: str = "none", tta: bool = TTA_ENABLED):
+        if storage not in STORAGE_OPTIONS:
+            raise ValueError(f"storage không hợp lệ: {storage}")
+
+        with open(CLASS_INDICES_PATH, encoding='utf-8') as f:
+            self.class_names = list(json.load(f).keys())
+
+        # Model load trong thread nền: server nhận kết nối ngay, /health trả 503 tới khi warm-up xong
+        warmup_sizes = warmup_batch_sizes(INFERENCE_MAX_BATCH_SIZE) if INFERENCE_WARMUP else None
+        self.predictor = BackgroundPredictor(
+            lambda: load_predictor(backend, MODEL_PATH, TFLITE_MODEL_PATH, warmup_sizes=warmup_sizes)
+        )
+        self.engine = InferenceEngine(
+            predict_fn=self.predictor,
+            max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+            max_wait_ms=INFERENCE_MAX_WAIT_MS,
+            batch_sizes=warmup_sizes,
+            timeout=INFERENCE_TIMEOUT_SECONDS
+        )
+        self.tta = tta
+
+        # Chỉ import module database khi bật lưu trữ (config yêu cầu DB_PASSWORD / Firebase credentials)
+        self.storage = storage
+        self._mysql = None
+        self._firestore = None
+        if storage in ("mysql", "both"):
+            from database import db_operations
+            self._mysql = db_operations
+        if storage in ("firestore", "both"):
+            from database.firestore_manager import FirestoreManager
+            self._firestore = FirestoreManager()
+            if self._mysql is not None and OUTBOX_ENABLED:
+                # MySQL ghi sự kiện outbox, relay đồng bộ sang Firestore thay cho ghi trực tiếp
+                if OUTBOX_RELAY_IN_PROCESS:
+                    from database.outbox_relay import start_outbox_relay
+                    start_outbox_relay(self._firestore)
+                self._firestore = None
+
+    def is_ready(self) -> bool:
+        return self.predictor.is_ready()
+
+    def diagnose(self, image_bytes: bytes, filename: str = "upload.jpg", user_id: Optional[str] = None) -> dict:
+        #Chẩn đoán một ảnh, trả về dict kết quả (có thể serialize JSON)
+        with span("decode"):
+            image = decode_image(io.BytesIO(image_bytes))
+        with span("preprocess"):
+            img = preprocess_image(image)
+        with span("inference"):
+            preds = self.engine.predict(img)
+        preds = self._refine(img, preds)
+        return self._build_result(image, image_bytes, filename, user_id, preds)
+
+    def diagnose_many(self, files: List[tuple], user_id: Optional[str] = None) -> List[dict]:
+        #files: list (filename, bytes); cả request chạy chung một batch, ảnh lỗi không làm hỏng ảnh khác
+        if len(files) == 1:
+            filename, data = files[0]
+            try:
+                return [self.diagnose(data, filename, user_id)]
+            except Exception as e:
+                return [{'filename': filename, 'error': str(e)}]
+
+        results = [None] * len(files)
+        decoded = []
+        batch = np.empty((len(files), IMG_SIZE, IMG_SIZE, 3), dtype=np.float32)
+        for i, (filename, data) in enumerate(files):
+            try:
+                image = decode_image(io.BytesIO(data))
+                preprocess_image(image, out=batch[len(decoded)])
+                decoded.append((i, filename, image, data))
+            except Exception as e:
+                results[i] = {'filename': filename, 'error': str(e)}
+
+        if decoded:
+            preds = self.engine.predict_batch(batch[:len(decoded)])
+            for j, ((i, filename, image, data), p) in enumerate(zip(decoded, preds)):
+                p = self._refine(batch[j], p)
+                results[i] = self._build_result(image, data, filename, user_id, p)
+        return results
+
+    def _refine(self, img, preds):
+        # TTA chỉ cho dự đoán trong khoảng [LOW, HIGH) (nếu bật)
+        if self.tta and needs_tta(preds):
+            with span("tta"):
+                return apply_tta(img, preds, self.engine.predict_batch)
+        return preds
+
+    def _build_result(self, image, image_bytes, filename, user_id, preds) -> dict:
+        result = summarize_prediction(preds, self.class_names)
+        result['filename'] = filename
+        result['saved'] = False
+
+        # Giống handle_diagnosis: chỉ lưu khi có user và đủ ngưỡng tin cậy
+        if user_id and result['status'] != 'low_confidence' and self.storage != "none":
+            result['saved'] = self._persist(image, image_bytes, filename, user_id, preds, result)
+        return result
+
+    def _persist(self, image, image_bytes, filename, user_id, preds, result) -> bool:
+        saved = True
+
+        if self._firestore is not None:
+            try:
+                self._firestore.save_diagnosis(
+                    user_id=user_id,
+                    plant_type=result['plant_type'],
+                    disease=result['disease'],
+                    confidence=float(result['confidence']),
+                    top3_predictions=result['top3_predictions']
+                )
+            except Exception as e:
+                print(f"Lỗi Firestore: {e}")
+                saved = False
+
+        if self._mysql is not None:
+            image_path = save_diagnosis_image(image, user_id, filename, data=image_bytes)
+            diagnosis_id = self._mysql.save_diagnosis(
+                plant_type=result['plant_type'],
+                disease_status=result['disease'],
+                confidence=float(result['confidence'] / 100.0),
+                predictions={self.class_names[i]: float(preds[i]) for i in range(len(self.class_names))},
+                firebase_user_id=user_id,
+                image_path=image_path,
+                top3_predictions=result['top3_predictions']
+            )
+            if not diagnosis_id:
+                saved = False
+
+        return saved
@@ -0,0 +1,177 @@
+"""
+Image Store Module
+Lưu ảnh chẩn đoán theo nội dung (content-addressed): mỗi nội dung ảnh chỉ lưu một lần,
+tên file là sha256 của bytes gốc, chia thư mục con theo 2 cấp prefix của hash
+(uploads/blobs/ab/cd/abcd....jpg) để không thư mục nào có quá nhiều file.
+
+Số lần tham chiếu (ref_count) được giữ trong bảng image_blobs (MySQL), xem database/db_operations.py.
+Mỗi ảnh có thumbnail JPEG nhỏ nằm cạnh file gốc (<tên>.thumb.jpg) cho trang lịch sử.
+Ảnh ngoài kho (ảnh cũ, ảnh gốc của người dùng lưu bởi diagnose_batch --save-db) có thumbnail
+trong <IMAGE_STORE_DIR>/thumbs/, không ghi gì vào thư mục của ảnh gốc.
+"""
+
+
+import io
+import os
+import hashlib
+import tempfile
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+from config.persistence import IMAGE_STORE_DIR, THUMBNAIL_SIZE
+
+
+# Nhận dạng định dạng theo magic bytes (không cần decode ảnh)
+_SIGNATURES = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+    (b"BM", ".bmp"),
+)
+
+
+# Đuôi file được xem là ảnh khi quét cây thư mục cũ
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.jfif', '.gif', '.bmp')
+
+
+def guess_extension(data: bytes, original_filename: str = "") -> str:
+    for signature, ext in _SIGNATURES:
+        if data.startswith(signature):
+            return ext
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    return os.path.splitext(original_filename)[1].lower() or ".jpg"
+
+
+THUMBNAIL_SUFFIX = ".thumb.jpg"
+THUMBNAIL_DIR = os.path.join(IMAGE_STORE_DIR, "thumbs")
+
+
+def _write_atomic(path: str, data: bytes):
+    # Ghi file tạm trong cùng thư mục rồi rename: không bao giờ có file ghi dở dưới tên thật
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def thumbnail_path(path: str) -> str:
+    if hash_from_path(path):
+        return os.path.splitext(path)[0] + THUMBNAIL_SUFFIX
+    # Ảnh ngoài kho: tên theo đường dẫn tuyệt đối + mtime (ảnh gốc bị sửa thì tạo thumbnail mới)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = 0
+    key = hashlib.sha1(f"{os.path.abspath(path)}|{mtime}".encode("utf-8")).hexdigest()
+    return os.path.join(THUMBNAIL_DIR, key[:2], key + THUMBNAIL_SUFFIX)
+
+
+def make_thumbnail(path: str, data: bytes = None, size: int = THUMBNAIL_SIZE) -> str:
+    #Tạo thumbnail JPEG tại thumbnail_path(path) (từ bytes nếu có sẵn, không thì đọc file); trả về đường dẫn thumbnail
+    image = Image.open(io.BytesIO(data) if data is not None else path)
+    # JPEG: decode thẳng ở độ phân giải nhỏ (DCT scaling), nhanh hơn nhiều so với decode full rồi thu nhỏ
+    image.draft('RGB', (size, size))
+    image = image.convert('RGB')
+    image.thumbnail((size, size), Image.BILINEAR)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=80, optimize=True)
+    thumb_path = thumbnail_path(path)
+    _write_atomic(thumb_path, buffer.getvalue())
+    return thumb_path
+
+
+def ensure_thumbnail(path: str) -> Optional[str]:
+    #Đường dẫn thumbnail của ảnh; ảnh cũ chưa có thumbnail thì tạo lúc này. None nếu không có ảnh gốc
+    thumb_path = thumbnail_path(path)
+    if os.path.exists(thumb_path):
+        return thumb_path
+    if not os.path.exists(path):
+        return None
+    return make_thumbnail(path)
+
+
+def hash_from_path(path: str) -> Optional[str]:
+    #sha256 của blob từ đường dẫn trong store; None nếu không phải file của store (ảnh cũ)
+    if not path:
+        return None
+    name = os.path.splitext(os.path.basename(path))[0]
+    if len(name) != 64 or any(c not in "0123456789abcdef" for c in name):
+        return None
+    return name
+
+
+class ImageStore:
+
+    def __init__(self, root: str = IMAGE_STORE_DIR):
+        self.root = root
+
+    def path_for(self, digest: str, ext: str) -> str:
+        return "/".join((self.root.replace("\\", "/").rstrip("/"), digest[:2], digest[2:4], digest + ext))
+
+    def locate(self, data: bytes, original_filename: str = "") -> Tuple[str, str]:
+        #(sha256, đường dẫn) của nội dung trong store, chưa ghi gì ra đĩa
+        digest = hashlib.sha256(data).hexdigest()
+        return digest, self.path_for(digest, guess_extension(data, original_filename))
+
+    def put(self, data: bytes, original_filename: str = "") -> Tuple[str, str, bool]:
+        """
+        Lưu bytes gốc (không encode lại). Trả về (sha256, đường dẫn, True nếu vừa ghi file mới).
+        Nội dung đã có thì không ghi lại.
+        """
+        digest, path = self.locate(data, original_filename)
+        if os.path.exists(path):
+            return digest, path, False
+
+        _write_atomic(path, data)
+        return digest, path, True
+
+    def remove(self, path: str):
+        #Xóa blob cùng thumbnail của nó
+        for p in (path, thumbnail_path(path)):
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+
+
+def scan_savings(root: str) -> Dict:
+    """
+    Thống kê dung lượng tiết kiệm được nếu lưu theo nội dung: hash toàn bộ file ảnh dưới root
+    (vd. cây uploads/diagnoses cũ), so sánh tổng dung lượng với dung lượng các nội dung khác nhau.
+    """
+    total_files = total_bytes = 0
+    unique: Dict[str, int] = {}
+    for dirpath, _, files in os.walk(root):
+        for fname in files:
+            if not fname.lower().endswith(IMAGE_EXTENSIONS) or fname.endswith(THUMBNAIL_SUFFIX):
+                continue
+            path = os.path.join(dirpath, fname)
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+            size = os.path.getsize(path)
+            total_files += 1
+            total_bytes += size
+            unique.setdefault(digest.hexdigest(), size)
+
+    unique_bytes = sum(unique.values())
+    return {
+        'files': total_files,
+        'bytes': total_bytes,
+        'unique_files': len(unique),
+        'unique_bytes': unique_bytes,
+        'saved_bytes': total_bytes - unique_bytes,
+        'saved_ratio': (total_bytes - unique_bytes) / total_bytes if total_bytes else 0.0
+    }
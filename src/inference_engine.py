@@ -0,0 +1,175 @@
+"""
+Inference Engine Module
+Gom các request dự đoán từ nhiều session Streamlit thành micro-batch
+để chạy một lần forward pass duy nhất trên model.
+"""
+
+
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+
+
+class _PendingRequest:
+    #Một request đang chờ trong hàng đợi: input + nơi nhận kết quả
+
+    __slots__ = ("inputs", "event", "result", "error")
+
+    def __init__(self, inputs: np.ndarray):
+        self.inputs = inputs
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class InferenceEngine:
+    """
+    Engine dùng chung cho toàn process.
+
+    predict_fn nhận batch float32 shape (N, 224, 224, 3) đã preprocess
+    và trả về ma trận xác suất shape (N, num_classes).
+
+    batch_sizes: các batch size đã warm-up; batch gộp được đệm ảnh 0 lên size nhỏ nhất
+    chứa vừa, để predictor (nhất là TFLite) không phải cấp phát lại tensor cho shape mới.
+    """
+
+    def __init__(
+        self,
+        predict_fn: Callable[[np.ndarray], np.ndarray],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        batch_sizes: Optional[List[int]] = None,
+        timeout: float = 30.0
+    ):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.timeout = float(timeout)
+        self.batch_sizes = sorted({int(s) for s in batch_sizes}) if batch_sizes else None
+
+        self._queue: "queue.Queue[Optional[_PendingRequest]]" = queue.Queue()
+        self._closed = False
+        # Kiểm tra _closed và đưa request vào hàng đợi là một bước: không có request nào lọt sau sentinel của close()
+        self._lock = threading.Lock()
+        # Request lấy ra nhưng không vừa batch hiện tại, mở đầu batch sau (chỉ worker thread dùng)
+        self._carry: Optional[_PendingRequest] = None
+
+        # Thống kê đơn giản để theo dõi hiệu quả gom batch
+        self.total_batches = 0
+        self.total_images = 0
+
+        self._worker = threading.Thread(
+            target=self._run,
+            name="leafguard-inference-engine",
+            daemon=True
+        )
+        self._worker.start()
+
+    def predict(self, image: np.ndarray, timeout: Optional[float] = None) -> np.ndarray:
+        #Dự đoán một ảnh đã preprocess shape (224, 224, 3), trả về vector xác suất
+        return self.predict_batch(image[np.newaxis, ...], timeout=timeout)[0]
+
+    def predict_batch(self, images: np.ndarray, timeout: Optional[float] = None) -> np.ndarray:
+        #Dự đoán nhiều ảnh (N, 224, 224, 3); các ảnh có thể được gộp chung batch với session khác
+        #timeout=None dùng timeout mặc định của engine
+        request = _PendingRequest(np.asarray(images, dtype=np.float32))
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("InferenceEngine đã bị đóng")
+            self._queue.put(request)
+
+        if not request.event.wait(self.timeout if timeout is None else timeout):
+            raise TimeoutError("Hết thời gian chờ kết quả dự đoán")
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def close(self):
+        #Dừng worker thread (các request đang chờ vẫn được xử lý xong)
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._worker.join()
+
+    def _collect_batch(self, first: _PendingRequest) -> tuple[List[_PendingRequest], bool]:
+        # Gom thêm request cho tới khi đủ batch hoặc hết thời gian chờ
+        batch = [first]
+        size = len(first.inputs)
+        deadline = time.monotonic() + self.max_wait
+
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if item is None:
+                return batch, True
+
+            # Không gộp vượt max_batch_size: request này chờ sang batch kế tiếp
+            if size + len(item.inputs) > self.max_batch_size:
+                self._carry = item
+                break
+
+            batch.append(item)
+            size += len(item.inputs)
+
+        return batch, False
+
+    def _run(self):
+        while True:
+            if self._carry is not None:
+                first, self._carry = self._carry, None
+            else:
+                first = self._queue.get()
+            if first is None:
+                break
+
+            batch, stop = self._collect_batch(first)
+            self._process(batch)
+
+            if stop:
+                break
+
+    def _padded_size(self, n: int) -> int:
+        # Batch size đã warm-up nhỏ nhất chứa được n ảnh; lớn hơn mọi size (request quá lớn) thì giữ nguyên
+        if self.batch_sizes:
+            for size in self.batch_sizes:
+                if size >= n:
+                    return size
+        return n
+
+    def _process(self, batch: List[_PendingRequest]):
+        try:
+            inputs = np.concatenate([r.inputs for r in batch], axis=0)
+            n = len(inputs)
+            padded = self._padded_size(n)
+            if padded > n:
+                padding = np.zeros((padded - n,) + inputs.shape[1:], dtype=inputs.dtype)
+                inputs = np.concatenate([inputs, padding], axis=0)
+            outputs = np.asarray(self.predict_fn(inputs))[:n]
+
+            self.total_batches += 1
+            self.total_images += n
+
+            # Trả kết quả về đúng request theo thứ tự đã gộp
+            offset = 0
+            for request in batch:
+                n = len(request.inputs)
+                request.result = outputs[offset:offset + n]
+                offset += n
+        except Exception as e:
+            for request in batch:
+                request.error = e
+        finally:
+            for request in batch:
+                request.event.set()
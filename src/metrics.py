@@ -0,0 +1,253 @@
+"""
+Metrics Module
+Đo latency theo từng stage của request chẩn đoán, giữ histogram trong process
+và xuất ra định dạng Prometheus text (file hoặc endpoint /metrics).
+"""
+
+
+import os
+import time
+import threading
+import functools
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict
+
+import numpy as np
+
+from config import metrics_hooks
+from config.metrics import (
+    LATENCY_METRICS_ENABLED,
+    METRICS_FILE,
+    METRICS_PORT,
+    METRICS_FILE_INTERVAL_SECONDS,
+    METRICS_WINDOW_SIZE
+)
+
+
+METRIC_NAME = "leafguard_stage_latency_seconds"
+
+# Bucket (giây) cho histogram, từ vài ms (decode, preprocess) tới vài giây (network)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class StageHistogram:
+    #Histogram latency của một stage: bucket tích lũy + cửa sổ mẫu gần nhất để tính percentile
+
+    def __init__(self, window_size: int = METRICS_WINDOW_SIZE):
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self._window = np.zeros(window_size, dtype=np.float64)
+        self._window_pos = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    self.bucket_counts[i] += 1
+                    break
+            self._window[self._window_pos % len(self._window)] = seconds
+            self._window_pos += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            n = min(self._window_pos, len(self._window))
+            samples = self._window[:n].copy()
+            cumulative = list(np.cumsum(self.bucket_counts))
+            count, total = self.count, self.total
+
+        quantiles = {q: float(np.quantile(samples, q)) if n else 0.0 for q in QUANTILES}
+        return {'count': count, 'sum': total, 'buckets': cumulative, 'quantiles': quantiles}
+
+
+_histograms: Dict[str, StageHistogram] = {}
+_histograms_lock = threading.Lock()
+
+# Gauge đọc trực tiếp từ component (connection pool, hàng đợi...) tại thời điểm xuất metrics
+# name -> (help, hàm trả về {label: value})
+_gauges: Dict[str, tuple] = {}
+
+# Context rỗng dùng chung khi tắt metrics (gần như không tốn chi phí)
+_NOOP_SPAN = nullcontext()
+
+
+def is_enabled() -> bool:
+    return LATENCY_METRICS_ENABLED
+
+
+def _get_histogram(stage: str) -> StageHistogram:
+    histogram = _histograms.get(stage)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(stage, StageHistogram())
+    return histogram
+
+
+def observe(stage: str, seconds: float):
+    if LATENCY_METRICS_ENABLED:
+        _get_histogram(stage).observe(seconds)
+
+
+class _Span:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _get_histogram(self.stage).observe(time.perf_counter() - self.start)
+        return False
+
+
+def span(stage: str):
+    """
+    Đo thời gian một đoạn code:
+        with span("inference"):
+            preds = engine.predict(img)
+    """
+    if not LATENCY_METRICS_ENABLED:
+        return _NOOP_SPAN
+    return _Span(stage)
+
+
+def timed(stage: str):
+    #Decorator đo thời gian cả hàm; khi tắt metrics trả về chính hàm gốc (không có overhead)
+    def decorator(fn):
+        if not LATENCY_METRICS_ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def register_gauge(name: str, help_text: str, collect: Callable[[], Dict[str, float]]):
+    """
+    Đăng ký gauge: collect() trả về {giá trị label "kind": số}, ví dụ
+        register_gauge("leafguard_mysql_pool", "MySQL pool state.", pool.stats)
+    """
+    with _histograms_lock:
+        _gauges[name] = (help_text, collect)
+
+
+def snapshot() -> Dict[str, dict]:
+    #p50/p95/p99 (giây) và số lần gọi cho từng stage
+    with _histograms_lock:
+        items = list(_histograms.items())
+    return {stage: histogram.snapshot() for stage, histogram in sorted(items)}
+
+
+def render_prometheus() -> str:
+    #Xuất toàn bộ histogram theo Prometheus text exposition format
+    lines = [
+        f"# HELP {METRIC_NAME} Latency of each diagnosis request stage.",
+        f"# TYPE {METRIC_NAME} histogram",
+    ]
+    stats = snapshot()
+    for stage, s in stats.items():
+        for bound, cumulative in zip(BUCKETS, s['buckets']):
+            lines.append(f'{METRIC_NAME}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'{METRIC_NAME}_bucket{{stage="{stage}",le="+Inf"}} {s["count"]}')
+        lines.append(f'{METRIC_NAME}_sum{{stage="{stage}"}} {s["sum"]:.6f}')
+        lines.append(f'{METRIC_NAME}_count{{stage="{stage}"}} {s["count"]}')
+
+    quantile_name = f"{METRIC_NAME}_recent"
+    lines.append(f"# HELP {quantile_name} p50/p95/p99 over the most recent samples of each stage.")
+    lines.append(f"# TYPE {quantile_name} summary")
+    for stage, s in stats.items():
+        for q, value in s['quantiles'].items():
+            lines.append(f'{quantile_name}{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+        lines.append(f'{quantile_name}_sum{{stage="{stage}"}} {s["sum"]:.6f}')
+        lines.append(f'{quantile_name}_count{{stage="{stage}"}} {s["count"]}')
+
+    with _histograms_lock:
+        gauges = sorted(_gauges.items())
+    for name, (help_text, collect) in gauges:
+        try:
+            values = collect()
+        except Exception as e:
+            print(f"Lỗi đọc gauge {name}: {e}")
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for kind, value in sorted(values.items()):
+            lines.append(f'{name}{{kind="{kind}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_file(path: str):
+    #Ghi ra file tạm rồi rename để collector không đọc phải file ghi dở
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        data = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def start_exporters(metrics_file: str = METRICS_FILE, port: int = METRICS_PORT):
+    #Khởi động exporter (chỉ một lần mỗi process) khi có cấu hình file / port;
+    #gauge (pool, outbox) được xuất cả khi tắt đo latency
+    global _exporters_started
+    if not (metrics_file or port):
+        return
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+
+    if metrics_file:
+        def write_loop():
+            while True:
+                time.sleep(METRICS_FILE_INTERVAL_SECONDS)
+                try:
+                    write_prometheus_file(metrics_file)
+                except OSError as e:
+                    print(f"Lỗi ghi metrics: {e}")
+
+        threading.Thread(target=write_loop, name="metrics-file-writer", daemon=True).start()
+        print(f"Metrics được ghi định kỳ vào: {metrics_file}")
+
+    if port:
+        server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"Metrics endpoint: http://127.0.0.1:{port}/metrics")
+
+
+# Gắn vào hook của config/database.py và database/* (các module đó không import src.metrics)
+metrics_hooks.install(
+    observe=observe if LATENCY_METRICS_ENABLED else None,
+    register_gauge=register_gauge
+)
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.preprocessing.image import ImageDataGenerator
+from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
+
+from src.data_loader import _find_dataset_root, IMG_SIZE
+from src.model_trainer import evaluate_and_save_report
+from src.tflite_predictor import TFLitePredictor
+from src.predictor import KerasPredictor
+
+
+def create_calibration_generator(dataset_dir="dataset", batch_size=1):
+    # Lấy ảnh từ dataset/val (shuffle để đủ đại diện cho mọi class)
+    dataset_root = _find_dataset_root(dataset_dir)
+    val_dir = os.path.join(dataset_root, "val")
+    datagen = ImageDataGenerator(preprocessing_function=preprocess_input)
+    return datagen.flow_from_directory(
+        directory=val_dir,
+        target_size=(IMG_SIZE, IMG_SIZE),
+        batch_size=batch_size,
+        class_mode=None,
+        shuffle=True,
+        seed=42
+    )
+
+
+def export_int8_tflite(model, calibration_gen, output_path, num_calibration_samples=200):
+    #Quantize full-integer INT8 (weights + activations + input/output)
+    num_samples = min(num_calibration_samples, calibration_gen.samples)
+    print(f"Đang calibrate với {num_samples} ảnh từ tập val...")
+
+    def representative_dataset():
+        calibration_gen.reset()
+        for _ in range(num_samples):
+            batch_x = next(calibration_gen)
+            yield [batch_x[:1].astype(np.float32)]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.int8
+    converter.inference_output_type = tf.int8
+
+    tflite_model = converter.convert()
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(output_path, 'wb') as f:
+        f.write(tflite_model)
+
+    print(f"✅ Đã lưu model INT8 vào: {output_path}")
+    return output_path
+
+
+def measure_latency(predict_fn, runs=50, warmup=5):
+    #Đo latency batch-1 (ms): trả về p50, p95 và trung bình
+    image = np.random.uniform(-1.0, 1.0, size=(1, IMG_SIZE, IMG_SIZE, 3)).astype(np.float32)
+    for _ in range(warmup):
+        predict_fn(image)
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        predict_fn(image)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return {
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p95_ms': float(np.percentile(timings, 95)),
+        'mean_ms': float(np.mean(timings))
+    }
+
+
+def compare_models(keras_model, keras_path, tflite_path, test_gen, class_names, output_dir="models"):
+    #Đánh giá model INT8 trên test set và so sánh với model float32
+    quantized = TFLitePredictor(tflite_path)
+    keras_predictor = KerasPredictor(keras_model)
+
+    # Đánh giá cả 2 model trên cùng test set (report riêng để không ghi đè)
+    keras_report, _ = evaluate_and_save_report(
+        keras_predictor, test_gen, class_names,
+        output_dir=output_dir, report_name="evaluation_report_float32.json"
+    )
+    int8_report, _ = evaluate_and_save_report(
+        quantized, test_gen, class_names,
+        output_dir=output_dir, report_name="evaluation_report_int8.json"
+    )
+
+    print("\nĐang đo latency batch-1...")
+    keras_latency = measure_latency(keras_predictor)
+    int8_latency = measure_latency(quantized)
+
+    comparison = {
+        'keras': {
+            'path': keras_path,
+            'size_mb': os.path.getsize(keras_path) / (1024 * 1024) if os.path.exists(keras_path) else None,
+            'accuracy': keras_report['accuracy'],
+            'macro_f1': keras_report['macro avg']['f1-score'],
+            'latency': keras_latency
+        },
+        'tflite_int8': {
+            'path': tflite_path,
+            'size_mb': os.path.getsize(tflite_path) / (1024 * 1024),
+            'accuracy': int8_report['accuracy'],
+            'macro_f1': int8_report['macro avg']['f1-score'],
+            'latency': int8_latency
+        }
+    }
+    comparison['accuracy_drop'] = comparison['keras']['accuracy'] - comparison['tflite_int8']['accuracy']
+
+    report_file = os.path.join(output_dir, "tflite_export_report.json")
+    with open(report_file, 'w', encoding='utf-8') as f:
+        json.dump(comparison, f, indent=2, ensure_ascii=False)
+
+    print("\n📊 SO SÁNH KERAS FLOAT32 vs TFLITE INT8:")
+    for name in ('keras', 'tflite_int8'):
+        info = comparison[name]
+        print(f"   - {name:12s}: acc={info['accuracy']:.4f}, F1={info['macro_f1']:.4f}, "
+              f"size={info['size_mb']:.2f}MB, p50={info['latency']['p50_ms']:.2f}ms")
+    print(f"   - Accuracy drop: {comparison['accuracy_drop'] * 100:.2f}%")
+    print(f"\n✅ Đã lưu báo cáo so sánh vào: {report_file}")
+
+    return comparison
@@ -8,6 +8,7 @@ from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout
 from tensorflow.keras.models import Model
 from tensorflow.keras.optimizers import Adam
 from sklearn.metrics import classification_report, confusion_matrix
+from src.predictor import as_predictor
 
 
 def build_mobilenetv2(num_classes):
@@ -73,7 +74,7 @@ def train_model(model, train_gen, val_gen, epochs=20, class_weights=None):
     return history
 
 
-def evaluate_and_save_report(model, test_gen, class_names, output_dir="models"):
+def evaluate_and_save_report(model, test_gen, class_names, output_dir="models", report_name="evaluation_report.json"):
     print("\n" + "=" * 60)
     print("ĐANG ĐÁNH GIÁ MÔ HÌNH TRÊN TEST SET...")
     print("=" * 60)
@@ -82,8 +83,9 @@ def evaluate_and_save_report(model, test_gen, class_names, output_dir="models"):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     
-    # Predict trên test set
+    # Predict trên test set (qua tf.function thay vì model.predict)
     print("Đang dự đoán trên test set...")
+    model = as_predictor(model)
     y_true = []
     y_pred = []
     
@@ -93,7 +95,7 @@ def evaluate_and_save_report(model, test_gen, class_names, output_dir="models"):
     
     for step in range(steps):
         batch_x, batch_y = next(test_gen)
-        predictions = model.predict(batch_x, verbose=0)
+        predictions = model(batch_x)
         
         # Lấy true labels và predictions
         batch_y_true = np.argmax(batch_y, axis=1)
@@ -122,7 +124,7 @@ def evaluate_and_save_report(model, test_gen, class_names, output_dir="models"):
     cm = confusion_matrix(y_true, y_pred)
     
     # Lưu classification report
-    report_file = os.path.join(output_dir, "evaluation_report.json")
+    report_file = os.path.join(output_dir, report_name)
     with open(report_file, 'w', encoding='utf-8') as f:
         json.dump(report_dict, f, indent=2, ensure_ascii=False)
     
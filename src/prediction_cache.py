@@ -0,0 +1,97 @@
+"""
+Prediction Cache Module
+Cache vector dự đoán theo hash nội dung ảnh (LRU + TTL), dùng chung cho toàn process
+"""
+
+
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+
+def model_identity(model_path: str) -> str:
+    #Định danh file model theo đường dẫn + mtime + size: train lại model sẽ đổi định danh
+    try:
+        stat = os.stat(model_path)
+        return f"{os.path.abspath(model_path)}:{stat.st_mtime_ns}:{stat.st_size}"
+    except OSError:
+        return f"{os.path.abspath(model_path)}:missing"
+
+
+class PredictionCache:
+    """
+    Cache LRU có giới hạn số entry và thời gian sống (TTL).
+
+    Key = sha256(định danh model + bytes ảnh gốc), nên cùng một ảnh upload lại
+    hoặc Streamlit rerun sẽ không chạy model lần nữa.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = float(ttl_seconds)
+
+        self._entries: "OrderedDict[str, tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(image_bytes: bytes, model_id: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(model_id.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(image_bytes)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            stored_at, preds = entry
+            if self.ttl_seconds > 0 and now - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return preds
+
+    def put(self, key: str, preds: np.ndarray):
+        preds = np.array(preds, copy=True)
+        preds.flags.writeable = False  # Vector dùng chung giữa các session, không cho sửa
+
+        with self._lock:
+            self._entries[key] = (time.monotonic(), preds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0
+            }
@@ -0,0 +1,154 @@
+"""
+Predictor Module
+Wrapper inference chi phí thấp cho Keras model và hàm load model dùng chung
+(app Streamlit, đánh giá, các tool chạy batch)
+"""
+
+
+import os
+import time
+import threading
+import numpy as np
+import tensorflow as tf
+
+from src.tflite_predictor import TFLitePredictor
+
+
+IMG_SIZE = 224
+
+INPUT_SIGNATURE = [tf.TensorSpec(shape=(None, IMG_SIZE, IMG_SIZE, 3), dtype=tf.float32)]
+
+# Cờ sẵn sàng của process: bật sau khi model đã load và warm-up xong
+_model_ready = threading.Event()
+
+
+class KerasPredictor:
+    """
+    Gọi trực tiếp model qua tf.function đã trace sẵn.
+
+    model.predict() tạo data adapter và chạy callback mỗi lần gọi, chiếm phần lớn
+    latency batch-1 trên CPU. Input signature cố định (None, 224, 224, 3) nên graph
+    chỉ trace một lần cho mọi batch size.
+    """
+
+    def __init__(self, model: tf.keras.Model):
+        self.model = model
+        self._fn = tf.function(
+            lambda x: model(x, training=False),
+            input_signature=INPUT_SIGNATURE
+        )
+        # Trace graph ngay lúc load thay vì ở request đầu tiên
+        self._fn.get_concrete_function()
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        batch = tf.convert_to_tensor(batch, dtype=tf.float32)
+        return self._fn(batch).numpy()
+
+    def predict(self, batch: np.ndarray, verbose: int = 0) -> np.ndarray:
+        #Tương thích với keras Model.predict để dùng chung code đánh giá
+        return self(batch)
+
+
+def as_predictor(model):
+    #Bọc Keras model thành KerasPredictor (predictor có sẵn thì giữ nguyên)
+    if isinstance(model, tf.keras.Model):
+        return KerasPredictor(model)
+    return model
+
+
+def is_model_ready() -> bool:
+    #UI và health check đọc cờ này để biết model đã sẵn sàng phục vụ chưa
+    return _model_ready.is_set()
+
+
+def warmup_batch_sizes(max_batch_size: int) -> list:
+    #Các batch size được warm-up: 1, các lũy thừa của 2 và max_batch_size (InferenceEngine đệm batch lên các size này)
+    sizes = {1, max(1, int(max_batch_size))}
+    size = 2
+    while size < max_batch_size:
+        sizes.add(size)
+        size *= 2
+    return sorted(sizes)
+
+
+def warm_up(predictor, batch_sizes) -> float:
+    """
+    Chạy forward pass trên input giả cho từng batch size để trace graph
+    và chọn kernel trước request thật đầu tiên. Trả về thời gian warm-up (giây).
+    """
+    start = time.perf_counter()
+    for batch_size in batch_sizes:
+        predictor(np.zeros((batch_size, IMG_SIZE, IMG_SIZE, 3), dtype=np.float32))
+    return time.perf_counter() - start
+
+
+def load_predictor(backend: str, model_path: str, tflite_model_path: str = None, warmup_sizes=None):
+    """
+    Load model theo backend và trả về predictor callable(batch) -> probabilities.
+    Nếu có warmup_sizes thì warm-up trước khi trả về; cờ sẵn sàng được bật khi xong.
+
+    Raises:
+        FileNotFoundError: nếu file model không tồn tại
+    """
+    if backend == "tflite":
+        if not tflite_model_path or not os.path.exists(tflite_model_path):
+            raise FileNotFoundError(f"Không tìm thấy model TFLite: {tflite_model_path}")
+        predictor = TFLitePredictor(tflite_model_path)
+    elif backend == "keras":
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Không tìm thấy model: {model_path}")
+        predictor = KerasPredictor(tf.keras.models.load_model(model_path))
+    else:
+        raise ValueError(f"Backend không hợp lệ: {backend} (chỉ hỗ trợ 'keras' hoặc 'tflite')")
+
+    if warmup_sizes:
+        elapsed = warm_up(predictor, warmup_sizes)
+        print(f"Warm-up model ({backend}) xong trong {elapsed:.2f}s, batch sizes: {list(warmup_sizes)}")
+
+    _model_ready.set()
+    return predictor
+
+
+class BackgroundPredictor:
+    """
+    Chạy load_fn (load + warm-up model) trong thread nền để UI / API phục vụ ngay khi khởi động.
+
+    Gọi predictor trước khi load xong sẽ chờ tối đa wait_timeout giây.
+    Lỗi khi load (vd. FileNotFoundError) được giữ ở thuộc tính error.
+    """
+
+    def __init__(self, load_fn, wait_timeout: float = 300.0):
+        self.wait_timeout = wait_timeout
+        self.predictor = None
+        self.error = None
+        self._load_fn = load_fn
+        self._loaded = threading.Event()
+        self._thread = threading.Thread(target=self._load, name="leafguard-model-loader", daemon=True)
+        self._thread.start()
+
+    def _load(self):
+        try:
+            self.predictor = self._load_fn()
+        except Exception as e:
+            self.error = e
+            print(f"Lỗi load model: {e}")
+        finally:
+            self._loaded.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        #Chờ thread load kết thúc (thành công hoặc lỗi); True nếu đã kết thúc
+        return self._loaded.wait(timeout)
+
+    def is_loaded(self) -> bool:
+        return self._loaded.is_set()
+
+    def is_ready(self) -> bool:
+        #Model này đã load + warm-up xong và không lỗi
+        return self._loaded.is_set() and self.error is None
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        if not self._loaded.wait(self.wait_timeout):
+            raise TimeoutError("Model chưa load xong")
+        if self.error is not None:
+            raise RuntimeError(f"Load model thất bại: {self.error}") from self.error
+        return self.predictor(batch)
@@ -0,0 +1,83 @@
+"""
+Preprocessing Module
+Decode ảnh upload/camera và chuẩn bị tensor đầu vào cho MobileNetV2
+"""
+
+
+import threading
+import numpy as np
+from PIL import Image
+
+from config.inference import DECODE_DRAFT_SIZE, PREPROCESS_RESAMPLE
+
+
+IMG_SIZE = 224
+
+RESAMPLE_FILTERS = {
+    "nearest": Image.Resampling.NEAREST,
+    "bilinear": Image.Resampling.BILINEAR,
+    "bicubic": Image.Resampling.BICUBIC,
+    "lanczos": Image.Resampling.LANCZOS,
+}
+
+# Buffer float32 tái sử dụng cho mỗi thread (tránh cấp phát mới mỗi request)
+_buffers = threading.local()
+
+
+def decode_image(file, draft_size: int = DECODE_DRAFT_SIZE) -> Image.Image:
+    """
+    Decode ảnh sang RGB.
+
+    Với JPEG, dùng draft mode để libjpeg decode thẳng ở độ phân giải giảm
+    (1/2, 1/4, 1/8) mà vẫn >= draft_size mỗi chiều: ảnh 12MP chỉ tốn
+    một phần nhỏ thời gian so với decode đầy đủ.
+    """
+    image = Image.open(file)
+    if image.format == "JPEG" and draft_size:
+        image.draft("RGB", (draft_size, draft_size))
+    return image.convert("RGB")
+
+
+def _fit_box(width: int, height: int) -> tuple:
+    # Vùng crop giữa ảnh theo tỉ lệ 1:1 (giống ImageOps.fit với centering mặc định)
+    if width > height:
+        left = (width - height) / 2
+        return (left, 0, left + height, height)
+    top = (height - width) / 2
+    return (0, top, width, top + width)
+
+
+def _get_buffer() -> np.ndarray:
+    buffer = getattr(_buffers, "image", None)
+    if buffer is None:
+        buffer = np.empty((IMG_SIZE, IMG_SIZE, 3), dtype=np.float32)
+        _buffers.image = buffer
+    return buffer
+
+
+def preprocess_image(image: Image.Image, out: np.ndarray = None, resample: str = PREPROCESS_RESAMPLE) -> np.ndarray:
+    """
+    Crop + resize về 224x224 và áp dụng mobilenet_v2.preprocess_input (x / 127.5 - 1)
+    trong một bước, ghi kết quả vào buffer float32.
+
+    Nếu không truyền `out`, kết quả nằm trong buffer dùng lại của thread hiện tại:
+    giá trị sẽ bị ghi đè ở lần gọi tiếp theo, cần copy nếu muốn giữ lâu.
+    Truyền `out=batch[i]` để ghi thẳng vào một batch đã cấp phát sẵn.
+    """
+    if out is None:
+        out = _get_buffer()
+
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    # Crop và resize gộp một lần; reducing_gap cho phép PIL thu nhỏ bằng reduce() trước
+    resized = image.resize(
+        (IMG_SIZE, IMG_SIZE),
+        RESAMPLE_FILTERS[resample],
+        box=_fit_box(*image.size),
+        reducing_gap=2.0
+    )
+
+    np.multiply(np.asarray(resized), 1.0 / 127.5, out=out, casting="unsafe")
+    out -= 1.0
+    return out
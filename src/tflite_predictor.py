@@ -0,0 +1,67 @@
+"""
+TFLite Predictor Module
+Chạy model .tflite (kể cả full-integer INT8) với cùng interface như Keras model
+"""
+
+
+import threading
+import numpy as np
+import tensorflow as tf
+
+
+class TFLitePredictor:
+    """
+    Bọc tf.lite.Interpreter để dùng thay thế Keras model.
+
+    Input là batch float32 đã preprocess (N, 224, 224, 3); nếu model được
+    quantize INT8 thì input được quantize và output được dequantize tự động.
+    """
+
+    def __init__(self, model_path: str, num_threads: int = None):
+        self.model_path = model_path
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input['shape'][0])
+
+        # Interpreter không thread-safe
+        self._lock = threading.Lock()
+
+    def _quantize(self, batch: np.ndarray) -> np.ndarray:
+        dtype = self._input['dtype']
+        if dtype == np.float32:
+            return batch.astype(np.float32, copy=False)
+        scale, zero_point = self._input['quantization']
+        info = np.iinfo(dtype)
+        q = np.round(batch / scale + zero_point)
+        return np.clip(q, info.min, info.max).astype(dtype)
+
+    def _dequantize(self, output: np.ndarray) -> np.ndarray:
+        if self._output['dtype'] == np.float32:
+            return output
+        scale, zero_point = self._output['quantization']
+        return (output.astype(np.float32) - zero_point) * scale
+
+    def _resize(self, batch_size: int):
+        # Chỉ resize khi batch size thay đổi để tránh allocate lại mỗi lần
+        if batch_size != self._batch_size:
+            self.interpreter.resize_tensor_input(self._input['index'], [batch_size, 224, 224, 3])
+            self.interpreter.allocate_tensors()
+            self._input = self.interpreter.get_input_details()[0]
+            self._output = self.interpreter.get_output_details()[0]
+            self._batch_size = batch_size
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            self._resize(len(batch))
+            self.interpreter.set_tensor(self._input['index'], self._quantize(batch))
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self._output['index'])
+        return self._dequantize(output)
+
+    def predict(self, batch: np.ndarray, verbose: int = 0) -> np.ndarray:
+        #Tương thích với keras Model.predict để dùng chung code đánh giá
+        return self(batch)
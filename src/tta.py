@@ -0,0 +1,61 @@
+"""
+Test-Time Augmentation Module
+Chỉ áp dụng cho các dự đoán trong vùng cảnh báo [CONFIDENCE_THRESHOLD_LOW, CONFIDENCE_THRESHOLD_HIGH):
+tạo các bản lật/crop từ tensor 224x224 đã preprocess, chạy một batch duy nhất
+và lấy trung bình với dự đoán gốc.
+"""
+
+
+import numpy as np
+import tensorflow as tf
+
+from src.utils import CONFIDENCE_THRESHOLD_LOW, CONFIDENCE_THRESHOLD_HIGH
+from src.preprocessing import IMG_SIZE
+
+
+CROP_SCALE = 0.875
+
+_m = (1.0 - CROP_SCALE) / 2
+_s = CROP_SCALE
+
+# Các view dưới dạng box chuẩn hóa [y1, x1, y2, x2] cho tf.image.crop_and_resize
+# (box có x1 > x2 hoặc y1 > y2 tương đương lật ảnh)
+TTA_BOXES = np.array([
+    [0.0, 1.0, 1.0, 0.0],          # Lật ngang
+    [1.0, 0.0, 0.0, 1.0],          # Lật dọc
+    [_m, _m, 1 - _m, 1 - _m],      # Crop giữa
+    [_m, 1 - _m, 1 - _m, _m],      # Crop giữa + lật ngang
+    [0.0, 0.0, _s, _s],            # Crop góc trên trái
+    [0.0, 1 - _s, _s, 1.0],        # Crop góc trên phải
+    [1 - _s, 0.0, 1.0, _s],        # Crop góc dưới trái
+    [1 - _s, 1 - _s, 1.0, 1.0],    # Crop góc dưới phải
+], dtype=np.float32)
+
+
+def needs_tta(preds: np.ndarray) -> bool:
+    #Chỉ dự đoán trong vùng cảnh báo mới cần TTA; tin cậy cao không cần, dưới ngưỡng LOW (ảnh không phải lá) thì bỏ qua
+    confidence = float(np.max(preds) * 100)
+    return CONFIDENCE_THRESHOLD_LOW <= confidence < CONFIDENCE_THRESHOLD_HIGH
+
+
+def build_tta_views(img: np.ndarray) -> np.ndarray:
+    #Tạo tất cả view trong một lần gọi crop_and_resize: shape (len(TTA_BOXES), 224, 224, 3)
+    views = tf.image.crop_and_resize(
+        img[np.newaxis, ...].astype(np.float32, copy=False),
+        boxes=TTA_BOXES,
+        box_indices=np.zeros(len(TTA_BOXES), dtype=np.int32),
+        crop_size=(IMG_SIZE, IMG_SIZE)
+    )
+    return views.numpy()
+
+
+def apply_tta(img: np.ndarray, preds: np.ndarray, predict_batch) -> np.ndarray:
+    """
+    Trung bình dự đoán gốc với dự đoán của các view augment.
+
+    predict_batch: callable(batch) -> probabilities, ví dụ InferenceEngine.predict_batch;
+    toàn bộ view chạy trong một lần forward pass.
+    """
+    views = build_tta_views(img)
+    view_preds = np.asarray(predict_batch(views))
+    return (preds + view_preds.sum(axis=0)) / (len(views) + 1)
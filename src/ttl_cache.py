@@ -0,0 +1,83 @@
+"""
+TTL Cache Module
+Cache kết quả truy vấn trong thời gian ngắn, có chống "cache stampede":
+khi entry hết hạn chỉ một thread chạy lại truy vấn, các thread khác dùng giá trị cũ
+(hoặc chờ nếu chưa có giá trị nào).
+"""
+
+
+import time
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+
+class TTLCache:
+    #Cache key -> giá trị với thời gian sống cố định, thread-safe, load theo kiểu single-flight
+
+    def __init__(self, ttl_seconds: float = 30):
+        self.ttl_seconds = float(ttl_seconds)
+
+        self._entries: Dict[Hashable, tuple] = {}  # key -> (thời điểm load, giá trị)
+        self._loading: Dict[Hashable, threading.Event] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Trả về giá trị còn hạn trong cache, hoặc gọi loader() để lấy mới.
+        loader() trả về None được xem là lỗi: không lưu vào cache.
+        """
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and now - entry[0] <= self.ttl_seconds:
+                    self.hits += 1
+                    return entry[1]
+
+                event = self._loading.get(key)
+                if event is None:
+                    # Thread này chịu trách nhiệm load
+                    event = threading.Event()
+                    self._loading[key] = event
+                    self.misses += 1
+                    break
+
+                if entry is not None:
+                    # Thread khác đang load: dùng tạm giá trị cũ thay vì cùng truy vấn database
+                    self.stale_hits += 1
+                    return entry[1]
+
+            # Chưa có giá trị nào: chờ thread đang load rồi đọc lại
+            event.wait()
+
+        try:
+            value = loader()
+            if value is not None:
+                with self._lock:
+                    self._entries[key] = (time.monotonic(), value)
+            return value
+        finally:
+            with self._lock:
+                del self._loading[key]
+            event.set()
+
+    def invalidate(self, key: Hashable = None):
+        #Xóa một key, hoặc toàn bộ cache nếu không truyền key
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses
+            }
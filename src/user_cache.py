@@ -0,0 +1,86 @@
+"""
+User Cache Module
+Cache kết quả truy vấn theo từng user (lịch sử, bộ lọc, thống kê) cho các trang History / Profile:
+mỗi lần tương tác Streamlit chạy lại cả script, nhưng dữ liệu của user chỉ đổi khi lưu / xóa chẩn đoán.
+
+Mỗi user có một số phiên bản; save_diagnosis / delete_diagnosis (MySQL và Firestore) tăng số này,
+entry lưu với phiên bản cũ tự động bị bỏ qua. TTL chỉ là lưới an toàn cho thay đổi từ process khác
+(vd. outbox relay chạy riêng).
+"""
+
+
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+from config.database import USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL_SECONDS
+
+
+class UserQueryCache:
+    #Cache (user, key) -> giá trị, hợp lệ khi phiên bản của user chưa đổi và chưa quá TTL; LRU, thread-safe
+
+    def __init__(self, max_entries: int = USER_CACHE_MAX_ENTRIES, ttl_seconds: float = USER_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = float(ttl_seconds)
+
+        self._versions: Dict[str, int] = {}
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # (user, key) -> (phiên bản, thời điểm load, giá trị)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def version(self, user_id: str) -> int:
+        with self._lock:
+            return self._versions.get(user_id, 0)
+
+    def bump(self, *user_ids: str):
+        #Dữ liệu của các user này vừa đổi: mọi entry đã cache của họ không còn hợp lệ
+        with self._lock:
+            for user_id in user_ids:
+                if user_id:
+                    self._versions[user_id] = self._versions.get(user_id, 0) + 1
+                    self.invalidations += 1
+
+    def get_or_load(self, user_id: str, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Trả về giá trị đã cache của (user_id, key), hoặc gọi loader() để lấy mới.
+        loader() trả về None được xem là lỗi: không lưu vào cache.
+        Giá trị trả về được dùng chung giữa các lần gọi, không sửa trực tiếp.
+        """
+        cache_key = (user_id, key)
+        now = time.monotonic()
+        with self._lock:
+            version = self._versions.get(user_id, 0)
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[0] == version and now - entry[1] <= self.ttl_seconds:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        value = loader()
+        if value is not None:
+            with self._lock:
+                # Lưu kèm phiên bản đọc được trước khi load: nếu có ghi xen giữa, entry này đã lỗi thời
+                self._entries[cache_key] = (version, now, value)
+                self._entries.move_to_end(cache_key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'users': len(self._versions),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations
+            }
+
+
+# Một cache cho cả process: MySQL (db_operations) và Firestore (FirestoreManager) dùng chung phiên bản
+user_query_cache = UserQueryCache()
@@ -1,31 +1,31 @@
+import io
 import os
-from datetime import datetime
 from PIL import Image
 import streamlit as st
+from src.image_store import ImageStore, make_thumbnail, thumbnail_path
 
 
-# Save diagnosis image to directory
-def save_diagnosis_image(image: Image.Image, user_id: str, original_filename: str) -> str:
+# Save diagnosis image to content-addressed store (src/image_store.py)
+def save_diagnosis_image(image: Image.Image, user_id: str, original_filename: str, data: bytes = None) -> str:
+    # data: bytes gốc của file upload (lưu nguyên vẹn); không có thì encode lại image thành JPEG
+    # Cùng nội dung ảnh chỉ lưu một lần; ghi lại nhiều lần không sao (tên file theo nội dung).
+    # ref_count trong bảng image_blobs được tăng bởi save_diagnosis, cùng transaction với bản ghi chẩn đoán
     try:
-        # Create uploads/diagnoses directory if not exists
-        upload_dir = f"uploads/diagnoses/{user_id}"
-        os.makedirs(upload_dir, exist_ok=True)
+        if data is None:
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=95)
+            data = buffer.getvalue()
        
-        # Create unique filename with timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        file_extension = os.path.splitext(original_filename)[1] or ".jpg"
-        filename = f"{timestamp}_{original_filename}"
+        _, path, _ = ImageStore().put(data, original_filename)
        
-        # Full path
-        file_path = os.path.join(upload_dir, filename)
+        # Thumbnail cho trang lịch sử; lỗi tạo thumbnail không làm hỏng việc lưu ảnh
+        if not os.path.exists(thumbnail_path(path)):
+            try:
+                make_thumbnail(path, data=data)
+            except Exception as e:
+                print(f"Lỗi tạo thumbnail: {e}")
        
-        # Save image
-        image.save(file_path, quality=95)
-       
-        # Return relative path
-        image_path = file_path.replace("\\", "/")  # Normalize path cho cross-platform
-       
-        return image_path
+        return path
        
     except Exception as e:
         st.warning(f"⚠️ Lỗi lưu ảnh: {str(e)}")
@@ -141,6 +141,78 @@ def get_plant_type_from_label(raw_label: str) -> str:
     return parts[0] if parts else ""
 
 
+# Confidence thresholds (%) dùng chung cho app, CLI và API
+CONFIDENCE_THRESHOLD_LOW = 40.0   # Dưới ngưỡng này: không xác định được, không lưu kết quả
+CONFIDENCE_THRESHOLD_HIGH = 60.0  # Dưới ngưỡng này: kết quả chưa đáng tin cậy
+
+
+# Top 3 predictions cùng loại cây với nhãn dự đoán
+def get_top3_predictions(preds, class_names: list, raw_label: str) -> list:
+    """
+    Lấy tối đa 3 dự đoán cùng loại cây với nhãn top-1, ưu tiên các dự đoán >= 40%
+    Returns: list of {'label': "Cây - Bệnh", 'confidence': float (%)}
+    """
+    top_plant_type = get_plant_type_from_label(raw_label)
+   
+    filtered_predictions = []
+    for i, class_name in enumerate(class_names):
+        plant_type = get_plant_type_from_label(class_name)
+        conf = preds[i] * 100
+        if plant_type == top_plant_type and conf >= 40.0:
+            filtered_predictions.append((i, class_name, conf))
+   
+    filtered_predictions.sort(key=lambda x: x[2], reverse=True)
+    top3_filtered = filtered_predictions[:3]
+   
+    if len(top3_filtered) == 0:
+        same_plant_predictions = [(i, class_names[i], preds[i] * 100)
+                                  for i in range(len(class_names))
+                                  if get_plant_type_from_label(class_names[i]) == top_plant_type]
+        same_plant_predictions.sort(key=lambda x: x[2], reverse=True)
+        top3_filtered = same_plant_predictions[:3]
+   
+    top3_predictions = []
+    for idx, class_name, conf in top3_filtered:
+        plant_name_vn, disease_name_vn = process_label(class_name)
+        lbl = f"{plant_name_vn} - {disease_name_vn}"
+        top3_predictions.append({
+            'label': lbl,
+            'confidence': float(conf)
+        })
+    return top3_predictions
+
+
+# Summarize prediction vector (không phụ thuộc UI / database)
+def summarize_prediction(preds, class_names: list) -> dict:
+    """
+    Gom các bước xử lý kết quả giống handle_diagnosis: nhãn top-1, tên tiếng Việt,
+    trạng thái theo ngưỡng confidence và top 3
+    status: 'low_confidence' (< LOW), 'uncertain' (< HIGH) hoặc 'confident'
+    """
+    class_idx = int(preds.argmax())
+    confidence = float(preds[class_idx] * 100)
+    raw_label = class_names[class_idx]
+    plant_name, disease_name = process_label(raw_label)
+    is_healthy = "healthy" in disease_name.lower() or "khỏe mạnh" in disease_name.lower()
+   
+    if confidence < CONFIDENCE_THRESHOLD_LOW:
+        status = 'low_confidence'
+    elif confidence < CONFIDENCE_THRESHOLD_HIGH:
+        status = 'uncertain'
+    else:
+        status = 'confident'
+   
+    return {
+        'raw_label': raw_label,
+        'plant_type': plant_name,
+        'disease': disease_name,
+        'confidence': confidence,
+        'is_healthy': is_healthy,
+        'status': status,
+        'top3_predictions': get_top3_predictions(preds, class_names, raw_label)
+    }
+
+
 # Load solutions from JSON file
 @st.cache_data
 def load_solutions():
@@ -0,0 +1,287 @@
+"""
+Write-Behind Module
+Hàng đợi lưu trữ chạy nền cho handle_diagnosis: người dùng thấy kết quả ngay,
+việc lưu ảnh, ghi Firestore, ghi MySQL và cập nhật thống kê chạy sau.
+
+Mỗi job được ghi vào spool trên đĩa (JSON + bytes ảnh gốc) trước khi trả về,
+nên process bị tắt đột ngột thì lần khởi động sau vẫn xử lý tiếp.
+"""
+
+
+import os
+import json
+import time
+import heapq
+import uuid
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config.persistence import (
+    WRITE_BEHIND_SPOOL_DIR,
+    WRITE_BEHIND_MAX_RETRIES,
+    WRITE_BEHIND_BACKOFF_BASE_SECONDS,
+    WRITE_BEHIND_BACKOFF_MAX_SECONDS
+)
+
+
+# Một sink: (tên, hàm nhận job (dict) và trả về True nếu ghi thành công, các sink phải xong trước).
+# Hàm có thể ghi thêm vào job['state'] cho các sink phụ thuộc; sink phụ thuộc vẫn chạy khi sink trước bỏ cuộc
+Sink = Tuple[str, Callable[[dict], bool], Tuple[str, ...]]
+
+
+def _write_json_atomic(path: str, data: dict):
+    # Ghi file tạm + fsync + rename: không bao giờ để lại file job ghi dở
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class WriteBehindQueue:
+    """
+    Worker nền chạy từng sink của mỗi job một cách độc lập: mỗi sink có lịch, số lần thử và backoff riêng,
+    sink lỗi không làm chậm hay làm mất việc ghi của sink khác. Sink đã xong không chạy lại.
+    Quá max_retries thì chỉ sink đó bỏ cuộc; khi mọi sink đã xong hoặc bỏ cuộc, job có sink bỏ cuộc
+    được chuyển vào spool/failed để xử lý thủ công.
+    """
+
+    def __init__(
+        self,
+        sinks: List[Sink],
+        spool_dir: str = WRITE_BEHIND_SPOOL_DIR,
+        max_retries: int = WRITE_BEHIND_MAX_RETRIES,
+        backoff_base: float = WRITE_BEHIND_BACKOFF_BASE_SECONDS,
+        backoff_max: float = WRITE_BEHIND_BACKOFF_MAX_SECONDS
+    ):
+        self.sinks = {name: (fn, tuple(depends_on)) for name, fn, depends_on in sinks}
+        self.spool_dir = spool_dir
+        self.failed_dir = os.path.join(spool_dir, "failed")
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        os.makedirs(self.failed_dir, exist_ok=True)
+
+        # Bộ đếm theo sink: thành công / lỗi (mỗi lần thử) / bỏ cuộc
+        self.counters: Dict[str, Dict[str, int]] = {
+            name: {'succeeded': 0, 'failed': 0, 'gave_up': 0} for name in self.sinks
+        }
+
+        self._schedule: List[Tuple[float, str, str]] = []  # heap (thời điểm chạy, job_id, sink)
+        self._scheduled = set()  # (job_id, sink) đang có trong heap: mỗi sink của job tối đa một lịch
+        self._cond = threading.Condition()
+
+        # Nạp lại các job còn dang dở từ lần chạy trước
+        recovered = 0
+        for fname in sorted(os.listdir(spool_dir)):
+            if fname.endswith(".json"):
+                job_id = fname[:-5]
+                for name in self.sinks:
+                    self._push(0.0, job_id, name)
+                recovered += 1
+        if recovered:
+            print(f"Write-behind: khôi phục {recovered} job từ spool")
+
+        self._worker = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._worker.start()
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self.spool_dir, f"{job_id}.json")
+
+    def blob_path(self, job_id: str) -> str:
+        #Đường dẫn bytes ảnh gốc đã spool của job
+        return os.path.join(self.spool_dir, f"{job_id}.bin")
+
+    def enqueue(self, payload: dict, blob: Optional[bytes] = None) -> str:
+        #Ghi job xuống đĩa rồi mới đưa vào hàng đợi; trả về job_id
+        job_id = f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}_{uuid.uuid4().hex[:8]}"
+
+        if blob is not None:
+            with open(self.blob_path(job_id), 'wb') as f:
+                f.write(blob)
+                f.flush()
+                os.fsync(f.fileno())
+
+        job = {
+            'id': job_id,
+            'payload': payload,
+            'has_blob': blob is not None,
+            'blob_path': self.blob_path(job_id) if blob is not None else None,
+            'done': [],
+            'gave_up': [],
+            'attempts': {},
+            'state': {}
+        }
+        _write_json_atomic(self._job_path(job_id), job)
+
+        # Sink không phụ thuộc chạy ngay; sink phụ thuộc được xếp lịch khi các sink trước đã xong / bỏ cuộc
+        for name, (_, depends_on) in self.sinks.items():
+            if not depends_on:
+                self._push(0.0, job_id, name)
+        return job_id
+
+    def pending_count(self) -> int:
+        #Số job còn sink chưa chạy xong
+        with self._cond:
+            return len({job_id for _, job_id, _ in self._schedule})
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'pending': len({job_id for _, job_id, _ in self._schedule}),
+                'sinks': {name: dict(c) for name, c in self.counters.items()}
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._schedule:
+                        wait = self._schedule[0][0] - time.time()
+                        if wait <= 0:
+                            _, job_id, name = heapq.heappop(self._schedule)
+                            self._scheduled.discard((job_id, name))
+                            break
+                        self._cond.wait(timeout=wait)
+                    else:
+                        self._cond.wait()
+
+            try:
+                self._process(job_id, name)
+            except Exception as e:
+                # Job hỏng (file JSON lỗi...) không được làm dừng worker
+                print(f"Write-behind: lỗi xử lý job {job_id} (sink '{name}'): {e}")
+
+    def _push(self, when: float, job_id: str, name: str):
+        with self._cond:
+            if (job_id, name) in self._scheduled:
+                return
+            self._scheduled.add((job_id, name))
+            heapq.heappush(self._schedule, (when, job_id, name))
+            self._cond.notify()
+
+    def _process(self, job_id: str, name: str):
+        path = self._job_path(job_id)
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            job = json.load(f)
+        job.setdefault('gave_up', [])
+
+        settled = set(job['done']) | set(job['gave_up'])
+        sink, depends_on = self.sinks[name]
+        if name in settled or not settled.issuperset(depends_on):
+            # Đã xong, hoặc chưa tới lượt (sẽ được xếp lịch khi các sink trước xong)
+            return
+
+        try:
+            ok = bool(sink(job))
+        except Exception as e:
+            print(f"Write-behind: sink '{name}' lỗi: {e}")
+            ok = False
+
+        with self._cond:
+            self.counters[name]['succeeded' if ok else 'failed'] += 1
+
+        if not ok:
+            attempts = job['attempts'].get(name, 0) + 1
+            job['attempts'][name] = attempts
+            if attempts <= self.max_retries:
+                _write_json_atomic(path, job)
+                delay = min(self.backoff_base * (2 ** (attempts - 1)), self.backoff_max)
+                self._push(time.time() + delay, job_id, name)
+                return
+
+            # Bỏ cuộc riêng sink này; các sink khác của job vẫn tiếp tục
+            with self._cond:
+                self.counters[name]['gave_up'] += 1
+            job['gave_up'].append(name)
+            print(f"Write-behind: job {job_id} bỏ cuộc ở sink '{name}' sau {attempts} lần thử")
+        else:
+            job['done'].append(name)
+
+        _write_json_atomic(path, job)
+        settled.add(name)
+
+        # Xếp lịch các sink đang chờ sink này
+        for other, (_, other_depends_on) in self.sinks.items():
+            if other not in settled and name in other_depends_on and settled.issuperset(other_depends_on):
+                self._push(0.0, job_id, other)
+
+        if len(settled) < len(self.sinks):
+            return
+
+        if job['gave_up']:
+            # Có sink bỏ cuộc: chuyển job vào failed/ để xử lý thủ công
+            os.replace(path, os.path.join(self.failed_dir, f"{job_id}.json"))
+            if job.get('has_blob') and os.path.exists(self.blob_path(job_id)):
+                os.replace(self.blob_path(job_id), os.path.join(self.failed_dir, f"{job_id}.bin"))
+            return
+
+        # Tất cả sink đã xong: dọn spool
+        os.remove(path)
+        if job.get('has_blob') and os.path.exists(self.blob_path(job_id)):
+            os.remove(self.blob_path(job_id))
+
+
+def build_diagnosis_sinks(firestore) -> List[Sink]:
+    """
+    Các sink cho một lần chẩn đoán: lưu ảnh, Firestore, MySQL (bảng statistics cập nhật trong cùng transaction)
+    Firestore và ảnh chạy độc lập; MySQL chờ sink ảnh (cần image_path) nhưng vẫn lưu khi sink ảnh bỏ cuộc
+    Khi bật outbox không có sink Firestore: MySQL ghi sự kiện outbox, relay đồng bộ sang Firestore
+    """
+    from config.persistence import OUTBOX_ENABLED
+    from src.utils import save_diagnosis_image
+    from database.db_operations import save_diagnosis as save_diagnosis_mysql
+
+    def save_image(job):
+        payload = job['payload']
+        if not job.get('has_blob'):
+            return True
+        # Lưu nguyên bytes gốc vào kho ảnh, không cần decode
+        with open(job['blob_path'], 'rb') as f:
+            data = f.read()
+        image_path = save_diagnosis_image(None, payload['user_id'], payload['filename'], data=data)
+        job['state']['image_path'] = image_path
+        return image_path is not None
+
+    def save_firestore(job):
+        payload = job['payload']
+        return firestore.save_diagnosis(
+            user_id=payload['user_id'],
+            plant_type=payload['plant_type'],
+            disease=payload['disease'],
+            confidence=float(payload['confidence']),
+            top3_predictions=payload['top3_predictions'],
+            document_id=f"wb-{job['id']}"
+        ) is not None
+
+    def save_mysql(job):
+        payload = job['payload']
+        image_path = job['state'].get('image_path')
+        if image_path and not os.path.exists(image_path):
+            # File vừa bị xóa (tham chiếu cuối được giải phóng) sau khi sink ảnh chạy: ghi lại trước khi lưu
+            if not save_image(job):
+                return False
+        diagnosis_id = save_diagnosis_mysql(
+            plant_type=payload['plant_type'],
+            disease_status=payload['disease'],
+            confidence=float(payload['confidence'] / 100.0),
+            predictions=payload['predictions'],
+            firebase_user_id=payload['user_id'],
+            image_path=job['state'].get('image_path'),
+            top3_predictions=payload['top3_predictions'],
+            request_key=job['id']
+        )
+        if not diagnosis_id:
+            return False
+        job['state']['mysql_id'] = diagnosis_id
+        return True
+
+    sinks = [("image", save_image, ()), ("mysql", save_mysql, ("image",))]
+    if not OUTBOX_ENABLED:
+        sinks.append(("firestore", save_firestore, ()))
+    return sinks